@@ -0,0 +1,61 @@
+"""
+Microbenchmark for animation frame selection.
+
+Compares the original linear scan over the durations list with the
+binary search over the precomputed timeline used by MatrixContent.
+
+    python benchmarks/bench_frame_lookup.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matrix_content import MatrixContent  # noqa: E402
+
+FRAME_COUNTS = [10, 100, 1000, 10000]
+NUMBER = 2000
+
+
+def linear_frame_index(start_time, durations, now):
+    """The lookup MatrixController used before the timeline was added."""
+    elapsed = now - start_time
+    total_duration = sum(durations)
+    if total_duration == 0: return 0
+
+    loop_time = elapsed % total_duration
+    current_time = 0
+    for i, duration in enumerate(durations):
+        current_time += duration
+        if current_time > loop_time:
+            return i
+    return 0
+
+
+def run():
+    results = []
+    for frame_count in FRAME_COUNTS:
+        durations = [1.0 / 30] * frame_count
+        # Tiny frames keep setup cheap; lookup cost does not depend on frame size
+        content = MatrixContent.from_frames(np.zeros((frame_count, 1, 1, 3), dtype=np.uint8), durations)
+        # Pick an instant near the end of the loop, the linear scan's worst case
+        start_time = -(content.total_duration * 0.99)
+        content.start_time = start_time
+
+        linear = timeit.timeit(lambda: linear_frame_index(start_time, durations, 0.0), number=NUMBER)
+        timeline = timeit.timeit(lambda: content.frame_index(0.0), number=NUMBER)
+        results.append({
+            'frames': frame_count,
+            'linear_us': linear / NUMBER * 1e6,
+            'bisect_us': timeline / NUMBER * 1e6,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'frames':>8} {'linear (us)':>12} {'bisect (us)':>12} {'speedup':>8}")
+    for r in run():
+        print(f"{r['frames']:>8} {r['linear_us']:>12.2f} {r['bisect_us']:>12.2f} {r['linear_us'] / r['bisect_us']:>7.1f}x")
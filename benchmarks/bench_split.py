@@ -0,0 +1,82 @@
+"""
+Benchmark for split-mode animation processing.
+
+Compares the original per-frame Pillow path (resize to 128x64, then two
+crops per frame) with the batched path used by MatrixController.display_split:
+one N x 64 x 128 x 3 stack with the A and B halves taken as views. Both
+still resize frame by frame with Pillow; the batched path also resizes with
+reducing_gap (frame_ops.REDUCING_GAP), so the per-frame path is measured
+with and without it and the two effects are reported separately.
+
+    python benchmarks/bench_split.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import frame_ops  # noqa: E402
+
+FRAME_COUNT = 150
+SOURCE_SIZES = [(128, 64), (480, 270), (1280, 720)]
+REPEAT = 3
+
+
+def make_frames(size, count=FRAME_COUNT):
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    return [Image.fromarray(np.roll(base, i, axis=1)) for i in range(count)]
+
+
+def split_per_frame(frames, reducing_gap=None):
+    """The display_split loop before batching (exact Lanczos by default)."""
+    frames_a = []
+    frames_b = []
+    for f in frames:
+        img = f.convert('RGB').resize((128, 64), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+        frames_a.append(img.crop((0, 0, 64, 64)))
+        frames_b.append(img.crop((64, 0, 128, 64)))
+    return frames_a, frames_b
+
+
+def split_per_frame_reducing_gap(frames):
+    return split_per_frame(frames, frame_ops.REDUCING_GAP)
+
+
+def split_batched(frames):
+    return frame_ops.split_halves(frame_ops.resize_frames(frames, (128, 64)))
+
+
+def best_fps(fn, frames):
+    best = float('inf')
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn(frames)
+        best = min(best, time.perf_counter() - started)
+    return len(frames) / best
+
+
+def run():
+    results = []
+    for size in SOURCE_SIZES:
+        frames = make_frames(size)
+        results.append({
+            'source': f"{size[0]}x{size[1]}",
+            'per_frame_fps': best_fps(split_per_frame, frames),
+            'per_frame_reducing_gap_fps': best_fps(split_per_frame_reducing_gap, frames),
+            'batched_fps': best_fps(split_batched, frames),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'source':>10} {'per-frame (f/s)':>16} {'+reducing_gap':>14} {'batched (f/s)':>14}"
+          f" {'gap speedup':>12} {'batch speedup':>14}")
+    for r in run():
+        gap = r['per_frame_reducing_gap_fps']
+        print(f"{r['source']:>10} {r['per_frame_fps']:>16.0f} {gap:>14.0f} {r['batched_fps']:>14.0f}"
+              f" {gap / r['per_frame_fps']:>11.1f}x {r['batched_fps'] / gap:>13.1f}x")
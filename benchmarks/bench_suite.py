@@ -0,0 +1,396 @@
+"""
+Offline benchmark suite: frame serving, upload-to-display latency, peak
+memory per upload and the push paths, end to end against a stub Pi.
+
+Everything runs on this machine in a throwaway folder (its own instance
+folder, database and sd_uploads), with synthetic fixtures from
+fixtures.py, so nothing touches a real deployment or needs a panel:
+
+- frame serving: requests per second and latency percentiles for the
+  Pi's polling endpoints, through Flask's test client (the app's own
+  cost) and through a real gunicorn process over HTTP (what the Pi sees)
+- uploads: for every fixture and mode, the time from the request to the
+  content being displayed and to the job finishing (pushes included),
+  with the job's per-stage durations
+- memory: peak Python allocations per upload (tracemalloc) and the
+  process's peak RSS. tracemalloc only sees this process, so decodes on
+  the decode pool's worker processes aren't counted
+- pushes: SD uploads (chunked transfer, then the hash-only relink) and
+  live draw deltas, answered by pi_stub.py in a separate process
+
+Results are written as JSON together with the git commit, Python
+version and CPU count, so runs can be compared:
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --quick --skip-gunicorn
+    python benchmarks/bench_suite.py --compare before.json after.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures  # noqa: E402
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+CLIENT_ID = 'bench'
+UPLOAD_MODES = ['matrix_a', 'both', 'split', 'separate']
+FRAME_ENDPOINTS = [
+    ('png', '/api/matrix/a'),
+    ('rgb565', '/api/matrix/a?format=rgb565'),
+    ('version', '/api/matrix/a/version'),
+    ('bundle', '/api/matrix/a/bundle?format=rgb565'),
+]
+
+
+def percentiles(times):
+    times = sorted(times)
+    pick = lambda q: times[min(len(times) - 1, int(len(times) * q))] * 1000
+    return {'count': len(times), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+            'mean_ms': sum(times) / len(times) * 1000}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+class Suite:
+    def __init__(self, workdir, repeat, duration):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.duration = duration
+        self.fixtures = fixtures.generate(os.path.join(workdir, 'fixtures'))
+        self.stub_port = free_port()
+        self.stub = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'pi_stub.py'), str(self.stub_port)],
+                                     stdout=subprocess.DEVNULL)
+        self.stub_url = f'http://127.0.0.1:{self.stub_port}'
+        wait_for(f'{self.stub_url}/stub/requests')
+
+        # main creates its folders on import, relative to the working directory
+        # and in the instance folder, so both point into the throwaway folder
+        self.env = dict(os.environ, LEMONA_INSTANCE_PATH=os.path.join(workdir, 'instance'))
+        os.environ['LEMONA_INSTANCE_PATH'] = self.env['LEMONA_INSTANCE_PATH']
+        os.chdir(workdir)
+        import main
+        self.main = main
+        main.client_comm.PORT = self.stub_port
+
+        with main.app.app_context():
+            main.db.create_all()
+            main.db.session.add(main.User(username=USERNAME, is_admin=True, is_approved=True,
+                                          password=main.bcrypt.generate_password_hash(PASSWORD).decode()))
+            main.db.session.commit()
+        self.client = main.app.test_client()
+        self.client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+        self.client.post('/api/admin/clients', json={'client_id': CLIENT_ID})
+        self.headers = {'X-Client-ID': CLIENT_ID}
+        # The stub Pi reports in like a real one, so pushes are addressed to it
+        self.client.post('/api/telemetry', json={'network': {'ip': '127.0.0.1'}}, headers=self.headers)
+
+    def close(self):
+        self.stub.terminate()
+        self.stub.wait(timeout=30)
+        self.main.decode_pool.shutdown()
+        # The instance folder may be deleted next; stop writing metrics into it
+        self.main.metrics.store = None
+
+    # --- Uploads ---
+
+    def wait(self, job_id):
+        while True:
+            job = self.client.get(f'/api/jobs/{job_id}').json
+            if job['status'] in ('done', 'error'):
+                return job
+            time.sleep(0.002)
+
+    def upload(self, mode, name):
+        """One /api/upload to completion; returns (job, request start time)."""
+        def field(path):
+            return (open(path, 'rb'), os.path.basename(path))
+
+        data = {'mode': mode, 'file_a': field(self.fixtures[name])}
+        if mode == 'separate':
+            data['file_b'] = field(self.fixtures[name])
+        started = time.time()
+        response = self.client.post('/api/upload', data=data, headers=self.headers,
+                                    content_type='multipart/form-data')
+        if response.status_code != 202:
+            raise RuntimeError(f"Upload of {name} in {mode} mode failed: {response.get_data(as_text=True)}")
+        job = self.wait(response.json['job_id'])
+        if job['status'] != 'done':
+            raise RuntimeError(f"Upload job for {name} in {mode} mode failed: {job['error']}")
+        return job, started
+
+    def bench_uploads(self):
+        results = []
+        for name in self.fixtures:
+            for mode in UPLOAD_MODES:
+                self.upload(mode, name)  # Warm-up (imports, codec setup, first snapshot writes)
+                displayed, finished, stages = [], [], {}
+                for _ in range(self.repeat):
+                    job, started = self.upload(mode, name)
+                    for stage in job['stages']:
+                        stages.setdefault(stage['name'], []).append(stage['duration'])
+                        if stage['name'] == 'display':
+                            displayed.append(stage['started'] + stage['duration'] - started)
+                    finished.append(job['finished'] - started)
+                results.append({
+                    'fixture': name, 'bytes': os.path.getsize(self.fixtures[name]), 'mode': mode,
+                    'to_display': percentiles(displayed), 'to_done': percentiles(finished),
+                    'stages_p50_ms': {s: percentiles(t)['p50_ms'] for s, t in stages.items()},
+                })
+                print(f"  upload {name:>24} {mode:>8}: display p50 {results[-1]['to_display']['p50_ms']:8.1f} ms,"
+                      f" done p50 {results[-1]['to_done']['p50_ms']:8.1f} ms")
+        return results
+
+    def bench_memory(self):
+        """Peak traced allocations of one upload, per fixture and mode."""
+        results = []
+        tracemalloc.start()
+        try:
+            for name in self.fixtures:
+                for mode in UPLOAD_MODES:
+                    tracemalloc.reset_peak()
+                    baseline, _ = tracemalloc.get_traced_memory()
+                    self.upload(mode, name)
+                    _, peak = tracemalloc.get_traced_memory()
+                    results.append({'fixture': name, 'mode': mode, 'peak_bytes': peak - baseline})
+                    print(f"  memory {name:>24} {mode:>8}: {(peak - baseline) / 1e6:8.2f} MB")
+        finally:
+            tracemalloc.stop()
+        return results
+
+    # --- Frame serving ---
+
+    def bench_test_client(self):
+        """The app's own cost per request, without HTTP or a server."""
+        self.upload('split', 'gif_64x64x30.gif')
+        results = {}
+        for label, path in FRAME_ENDPOINTS:
+            times = []
+            deadline = time.perf_counter() + self.duration
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = self.client.get(path, headers=self.headers)
+                response.get_data()
+                times.append(time.perf_counter() - started)
+            results[label] = dict(percentiles(times), requests_per_second=len(times) / sum(times))
+            print(f"  test client {label:>8}: {results[label]['requests_per_second']:8.0f} req/s")
+        return results
+
+    def bench_gunicorn(self, workers, threads, connections):
+        """
+        Frame serving through gunicorn over loopback HTTP, with `connections`
+        keep-alive clients polling as fast as they can. Uses the same
+        instance folder, so it serves the content uploaded above.
+        """
+        port = free_port()
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+                   '--bind', f'127.0.0.1:{port}', '--pythonpath', REPO_DIR, '--log-level', 'warning', 'main:app']
+        server = subprocess.Popen(command, cwd=self.workdir, env=self.env)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            wait_for(f'{base}/api/matrix/a/version')
+
+            results = {}
+            for label, path in FRAME_ENDPOINTS:
+                times, errors = [], []
+                deadline = time.perf_counter() + self.duration
+
+                def poll():
+                    session = requests.Session()
+                    own = []
+                    while time.perf_counter() < deadline:
+                        started = time.perf_counter()
+                        try:
+                            response = session.get(base + path, headers=self.headers, timeout=10)
+                            if response.status_code != 200:
+                                errors.append(response.status_code)
+                        except requests.RequestException as e:
+                            errors.append(str(e))
+                        own.append(time.perf_counter() - started)
+                    times.extend(own)
+
+                pollers = [threading.Thread(target=poll) for _ in range(connections)]
+                started = time.perf_counter()
+                for t in pollers:
+                    t.start()
+                for t in pollers:
+                    t.join()
+                elapsed = time.perf_counter() - started
+                results[label] = dict(percentiles(times), requests_per_second=len(times) / elapsed,
+                                      errors=len(errors))
+                print(f"  gunicorn {label:>8}: {results[label]['requests_per_second']:8.0f} req/s,"
+                      f" p99 {results[label]['p99_ms']:.1f} ms")
+            return {'workers': workers, 'threads': threads, 'connections': connections, 'endpoints': results}
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    # --- Pushes ---
+
+    def bench_sd_push(self):
+        """SD upload to the stub: chunked transfer of a new file, then a relink of the same hash."""
+        results = {}
+        for name in self.fixtures:
+            path = self.fixtures[name]
+            requests.post(f'{self.stub_url}/stub/reset')
+            timings = {}
+            for label in ('transfer', 'relink'):
+                started = time.time()
+                with open(path, 'rb') as f:
+                    response = self.client.post('/api/sd/upload', data={'file': (f, name)}, headers=self.headers,
+                                                content_type='multipart/form-data')
+                job = self.wait(response.json['job_id'])
+                if job['status'] != 'done':
+                    raise RuntimeError(f"SD push of {name} failed: {job['error']}")
+                timings[label] = (job['finished'] - started) * 1000
+            chunks = requests.get(f'{self.stub_url}/stub/requests').json().get('sd_transfer', 0)
+            results[name] = dict(bytes=os.path.getsize(path), chunks=chunks,
+                                 **{f'{k}_ms': v for k, v in timings.items()})
+            print(f"  sd push {name:>24}: transfer {timings['transfer']:7.1f} ms, relink {timings['relink']:6.1f} ms")
+        return results
+
+    def bench_draw_delta(self):
+        """/api/draw/delta round trips, each forwarded to the stub Pi."""
+        rect = {'x': 10, 'y': 10, 'w': 8, 'h': 8, 'data': base64.b64encode(bytes(8 * 8 * 3)).decode()}
+        times = []
+        for i in range(self.repeat * 10):
+            started = time.perf_counter()
+            response = self.client.post('/api/draw/delta', json={'rects': [dict(rect, x=i % 120)]},
+                                        headers=self.headers)
+            times.append(time.perf_counter() - started)
+            if not response.json.get('pushed'):
+                raise RuntimeError(f"Draw delta was not pushed: {response.json}")
+        print(f"  draw delta: p50 {percentiles(times)['p50_ms']:.2f} ms")
+        return percentiles(times)
+
+
+def wait_for(url, timeout=30):
+    """Waits until a freshly started server answers at url."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return requests.get(url, timeout=5)
+        except requests.RequestException:
+            if time.time() > deadline:
+                raise RuntimeError(f"Nothing is answering at {url}")
+            time.sleep(0.1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run(repeat=5, duration=3.0, gunicorn=True, workers=3, threads=8, connections=8, workdir=None):
+    """Runs the whole suite and returns the results as a dict."""
+    cleanup = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='lemona_bench_'))
+    cwd = os.getcwd()
+    suite = Suite(workdir, repeat, duration)
+    try:
+        results = {
+            'meta': {
+                'timestamp': time.time(), 'git_commit': git_commit(), 'python': platform.python_version(),
+                'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                'repeat': repeat, 'duration_seconds': duration,
+            },
+        }
+        print("Uploads")
+        results['uploads'] = suite.bench_uploads()
+        print("Memory")
+        results['memory'] = suite.bench_memory()
+        print("Frame serving")
+        results['serving_test_client'] = suite.bench_test_client()
+        if gunicorn:
+            results['serving_gunicorn'] = suite.bench_gunicorn(workers, threads, connections)
+        print("Pushes")
+        results['sd_push'] = suite.bench_sd_push()
+        results['draw_delta'] = suite.bench_draw_delta()
+        # ru_maxrss is in kilobytes on Linux
+        results['meta']['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return results
+    finally:
+        suite.close()
+        os.chdir(cwd)
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def headline(results):
+    """The figures worth comparing between runs, as {name: (value, unit)}."""
+    figures = {}
+    for u in results.get('uploads', []):
+        figures[f"upload {u['fixture']} {u['mode']} to display p50"] = (u['to_display']['p50_ms'], 'ms')
+    for m in results.get('memory', []):
+        figures[f"memory {m['fixture']} {m['mode']}"] = (m['peak_bytes'] / 1e6, 'MB')
+    for label, r in results.get('serving_test_client', {}).items():
+        figures[f"test client {label}"] = (r['requests_per_second'], 'req/s')
+    for label, r in results.get('serving_gunicorn', {}).get('endpoints', {}).items():
+        figures[f"gunicorn {label}"] = (r['requests_per_second'], 'req/s')
+        figures[f"gunicorn {label} p99"] = (r['p99_ms'], 'ms')
+    for name, r in results.get('sd_push', {}).items():
+        figures[f"sd push {name}"] = (r['transfer_ms'], 'ms')
+    if 'draw_delta' in results:
+        figures['draw delta p50'] = (results['draw_delta']['p50_ms'], 'ms')
+    return figures
+
+
+def compare(before, after):
+    """Prints every headline figure of two result files side by side."""
+    old, new = headline(before), headline(after)
+    for name in new:
+        if name in old:
+            (a, unit), (b, _) = old[name], new[name]
+            change = f"{(b - a) / a * 100:+7.1f}%" if a else ''
+            print(f"{name:<52} {a:10.2f} -> {b:10.2f} {unit:<5} {change}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', '-o', default='bench_results.json', help="JSON file for the results")
+    parser.add_argument('--quick', action='store_true', help="fewer repetitions and shorter load runs")
+    parser.add_argument('--skip-gunicorn', action='store_true', help="only measure serving via the test client")
+    parser.add_argument('--workers', type=int, default=3, help="gunicorn workers (default: 3, as deployed)")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker (default: 8)")
+    parser.add_argument('--connections', type=int, default=8, help="concurrent HTTP clients for gunicorn")
+    parser.add_argument('--workdir', help="keep fixtures and state in this folder instead of a temp folder")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            compare(json.load(a), json.load(b))
+        sys.exit(0)
+
+    output = os.path.abspath(args.output)
+    results = run(repeat=2 if args.quick else 5, duration=1.0 if args.quick else 5.0,
+                  gunicorn=not args.skip_gunicorn, workers=args.workers, threads=args.threads,
+                  connections=args.connections, workdir=args.workdir)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
@@ -0,0 +1,110 @@
+"""
+Benchmark for the live upload path: temp files vs in-memory buffers.
+
+Times what one /api/upload does with a file before it is displayed:
+receive it, decode and resize it, and read it again for the push to the
+Pi. The temp-file path is what handle_upload did before UploadBuffer
+(save to mkstemp, decode from the path, reopen for the push, delete);
+the buffered path keeps the upload in memory and gives the decoder and
+the push their own readers over the same bytes.
+
+    python benchmarks/bench_upload_buffers.py
+
+Run it from the repository root; it imports main for process_content.
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from upload_buffer import UploadBuffer  # noqa: E402
+
+REPEAT = 20
+
+
+def make_png(size):
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def make_gif(size, count):
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    frames = [Image.fromarray(np.roll(base, i * 4, axis=1)) for i in range(count)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=50)
+    return buffer.getvalue()
+
+
+FIXTURES = [
+    ('png 64x64', 'a.png', lambda: make_png((64, 64))),
+    ('png 640x480', 'a.png', lambda: make_png((640, 480))),
+    ('png 1920x1080', 'a.png', lambda: make_png((1920, 1080))),
+    ('gif 64x64 x30', 'a.gif', lambda: make_gif((64, 64), 30)),
+    ('gif 320x240 x30', 'a.gif', lambda: make_gif((320, 240), 30)),
+]
+
+
+def via_temp_file(data, filename):
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(io.BytesIO(data).read())
+        content = main.process_content(path, filename)
+        with open(path, 'rb') as f:
+            f.read()
+        return content
+    finally:
+        os.remove(path)
+
+
+def via_buffer(data, filename):
+    upload = UploadBuffer(io.BytesIO(data), filename, main.LIVE_SPOOL_SIZE)
+    try:
+        content = main.process_content(upload.source(), upload.filename)
+        with upload.open() as f:
+            f.read()
+        return content
+    finally:
+        upload.close()
+
+
+def latencies(fn, data, filename):
+    times = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn(data, filename)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.95) - 1]
+
+
+def run():
+    results = []
+    for name, filename, make in FIXTURES:
+        data = make()
+        temp_p50, temp_p95 = latencies(via_temp_file, data, filename)
+        buffer_p50, buffer_p95 = latencies(via_buffer, data, filename)
+        results.append({
+            'fixture': name,
+            'bytes': len(data),
+            'temp_p50_ms': temp_p50 * 1000, 'temp_p95_ms': temp_p95 * 1000,
+            'buffer_p50_ms': buffer_p50 * 1000, 'buffer_p95_ms': buffer_p95 * 1000,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'fixture':>16} {'bytes':>9} {'temp p50/p95 (ms)':>18} {'buffer p50/p95 (ms)':>20}")
+    for r in run():
+        print(f"{r['fixture']:>16} {r['bytes']:>9} {r['temp_p50_ms']:>8.2f} / {r['temp_p95_ms']:<7.2f}"
+              f" {r['buffer_p50_ms']:>9.2f} / {r['buffer_p95_ms']:<7.2f}")
@@ -0,0 +1,77 @@
+"""
+Synthetic media for the benchmarks, generated locally and deterministically
+(fixed seeds), so runs on different machines use identical inputs.
+
+    python benchmarks/fixtures.py <folder>
+"""
+import io
+import os
+import sys
+
+import imageio
+import numpy as np
+from PIL import Image
+
+PNG_SIZES = [(64, 64), (640, 480), (1920, 1080)]
+GIF_SPECS = [((64, 64), 30), ((320, 240), 30)]
+MP4_SPECS = [((320, 240), 60, 30)]  # size, frames, fps
+
+
+def _noise(size, seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+
+
+def png_bytes(size, seed=0):
+    buffer = io.BytesIO()
+    Image.fromarray(_noise(size, seed)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def gif_bytes(size, count, seed=0):
+    """An animation of a scrolling noise frame, 50 ms per frame."""
+    base = _noise(size, seed)
+    frames = [Image.fromarray(np.roll(base, i * 4, axis=1)) for i in range(count)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=50)
+    return buffer.getvalue()
+
+
+def write_mp4(path, size, count, fps, seed=0):
+    """A scrolling-noise H.264 clip, written with the bundled ffmpeg."""
+    base = _noise(size, seed)
+    with imageio.get_writer(path, fps=fps, codec='libx264', macro_block_size=1) as writer:
+        for i in range(count):
+            writer.append_data(np.roll(base, i * 4, axis=1))
+
+
+def generate(folder):
+    """
+    Writes every fixture into folder (skipping ones already there) and
+    returns {name: path}.
+    """
+    os.makedirs(folder, exist_ok=True)
+    fixtures = {}
+
+    def write(name, make):
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            make(path)
+        fixtures[name] = path
+
+    def write_bytes(data):
+        return lambda path: open(path, 'wb').write(data())
+
+    for i, size in enumerate(PNG_SIZES):
+        write(f'png_{size[0]}x{size[1]}.png', write_bytes(lambda size=size, i=i: png_bytes(size, i)))
+    for i, (size, count) in enumerate(GIF_SPECS):
+        write(f'gif_{size[0]}x{size[1]}x{count}.gif', write_bytes(lambda size=size, count=count, i=i: gif_bytes(size, count, i)))
+    for i, (size, count, fps) in enumerate(MP4_SPECS):
+        write(f'mp4_{size[0]}x{size[1]}x{count}.mp4',
+              lambda path, size=size, count=count, fps=fps, i=i: write_mp4(path, size, count, fps, i))
+    return fixtures
+
+
+if __name__ == '__main__':
+    for name, path in generate(sys.argv[1] if len(sys.argv) > 1 else 'fixtures').items():
+        print(f"{name:>24} {os.path.getsize(path):>10} bytes")
@@ -0,0 +1,175 @@
+"""
+A stand-in for the Pi's HTTP API, so the server's push paths can be
+benchmarked end to end on one machine. It implements the endpoints
+ClientComm calls (live uploads and draw deltas, the SD hash/link/chunked
+transfer protocol, plain SD uploads, play/stop, playlists) and keeps what it
+receives in memory. Nothing is displayed; every request is answered as
+soon as its body has been read, so measured push times are the server's
+side of the transfer plus loopback HTTP.
+
+    python benchmarks/pi_stub.py [port]
+
+Benchmarks run it in its own process (so its allocations don't show up
+in the server's memory figures) and use /stub/requests and /stub/reset
+to see and clear what it received.
+"""
+import hashlib
+import sys
+import threading
+import time
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PiStub:
+    def __init__(self, port=0, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+        self.app = self._create_app()
+        self.server = None
+        self.thread = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+            self.files = {}      # filename -> sha256
+            self.blobs = set()   # sha256 of stored files
+            self.partial = {}    # sha256 -> bytearray of a chunked transfer
+
+    def _log(self, endpoint, size=0):
+        with self._lock:
+            self.requests.append((time.time(), endpoint, size))
+
+    def _create_app(self):
+        app = Flask('pi_stub')
+
+        @app.route('/api/live/upload', methods=['POST'])
+        def live_upload():
+            size = sum(len(f.read()) for f in request.files.values())
+            self._log('live_upload', size)
+            return jsonify({'status': 'success', 'mode': request.form.get('mode')})
+
+        @app.route('/api/live/draw', methods=['POST'])
+        def live_draw():
+            self._log('live_draw', request.content_length or 0)
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/sd/have', methods=['POST'])
+        def sd_have():
+            self._log('sd_have')
+            hashes = request.json.get('hashes', [])
+            with self._lock:
+                return jsonify({'have': [h for h in hashes if h in self.blobs]})
+
+        @app.route('/api/sd/link', methods=['POST'])
+        def sd_link():
+            self._log('sd_link')
+            data = request.json
+            with self._lock:
+                if data['sha256'] not in self.blobs:
+                    return jsonify({'error': 'Unknown hash'}), 404
+                self.files[data['filename']] = data['sha256']
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/sd/transfer/<sha256>', methods=['PUT'])
+        def sd_transfer(sha256):
+            chunk = request.get_data()
+            self._log('sd_transfer', len(chunk))
+            offset = int(request.headers['X-Offset'])
+            if hashlib.sha256(chunk).hexdigest() != request.headers.get('X-Chunk-SHA256'):
+                return jsonify({'error': 'Chunk hash mismatch'}), 400
+            with self._lock:
+                data = self.partial.setdefault(sha256, bytearray())
+                if offset != len(data):
+                    return jsonify({'received': len(data)}), 409
+                data.extend(chunk)
+                return jsonify({'received': len(data)})
+
+        @app.route('/api/sd/transfer/<sha256>/complete', methods=['POST'])
+        def sd_transfer_complete(sha256):
+            self._log('sd_transfer_complete')
+            with self._lock:
+                data = self.partial.pop(sha256, b'')
+                if hashlib.sha256(data).hexdigest() != sha256:
+                    return jsonify({'error': 'File hash mismatch'}), 400
+                self.blobs.add(sha256)
+                self.files[request.json['filename']] = sha256
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/sd/upload', methods=['POST'])
+        def sd_upload():
+            f = request.files['file']
+            data = f.read()
+            self._log('sd_upload', len(data))
+            digest = hashlib.sha256(data).hexdigest()
+            with self._lock:
+                self.blobs.add(digest)
+                self.files[f.filename] = digest
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/sd/files/<filename>', methods=['DELETE'])
+        def sd_delete(filename):
+            with self._lock:
+                self.files.pop(filename, None)
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/sd/<action>', methods=['POST'])
+        def sd_command(action):
+            self._log(f'sd_{action}')
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/playlist', methods=['POST'])
+        def playlist():
+            self._log('playlist', request.content_length or 0)
+            return jsonify({'status': 'success', 'version': request.json.get('version')})
+
+        @app.route('/stub/requests', methods=['GET'])
+        def stub_requests():
+            with self._lock:
+                counts = {}
+                for _, endpoint, _ in self.requests:
+                    counts[endpoint] = counts.get(endpoint, 0) + 1
+            return jsonify(counts)
+
+        @app.route('/stub/reset', methods=['POST'])
+        def stub_reset():
+            self.reset()
+            return jsonify({'status': 'success'})
+
+        @app.route('/api/config', methods=['POST'])
+        def config():
+            self._log('config')
+            return jsonify({'status': 'success'})
+
+        return app
+
+    def start(self):
+        """Serves in a background thread; returns the bound port."""
+        self.server = make_server(self.host, self.port, self.app, threaded=True,
+                                  request_handler=_QuietHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, name='pi-stub', daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+if __name__ == '__main__':
+    stub = PiStub(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    print(f"Pi stub listening on http://{stub.host}:{stub.start()}")
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,321 @@
+import hashlib
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+
+class ClientComm:
+    """
+    All server-to-Pi HTTP traffic goes through here.
+
+    Each client IP gets one pooled keep-alive requests.Session, fire-and-forget
+    pushes run on a bounded executor, and every call is recorded in per-endpoint
+    latency/error metrics (see get_metrics), which also feed /metrics.
+    """
+
+    PORT = 5000
+    # Chunked SD transfers: fixed chunk size and attempts per chunk
+    CHUNK_SIZE = 256 * 1024
+    CHUNK_RETRIES = 3
+
+    def __init__(self, max_workers=4, pool_size=4):
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='client-push')
+        self._sessions = {}
+        self._metrics = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def session(self, client_ip):
+        with self._lock:
+            session = self._sessions.get(client_ip)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                self._sessions[client_ip] = session
+            return session
+
+    def url(self, client_ip, path):
+        return f"http://{client_ip}:{self.PORT}{path}"
+
+    def request(self, method, client_ip, path, timeout=5, metric=None, **kwargs):
+        """Sends a request over the client's pooled session; raises on connection errors."""
+        metric = metric or path
+        started = time.perf_counter()
+        try:
+            response = self.session(client_ip).request(method, self.url(client_ip, path), timeout=timeout, **kwargs)
+        except Exception as e:
+            self._record(metric, time.perf_counter() - started, error=str(e))
+            raise
+        error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+        self._record(metric, time.perf_counter() - started, error=error)
+        return response
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn in the background on the bounded push executor."""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def fan_out(self, client_ips, fn):
+        """
+        Starts fn(client_ip) for every client on the push executor, so pushes
+        to a fleet run concurrently but never more than max_workers at once.
+        Returns {client_ip: future}.
+        """
+        return {client_ip: self.submit(fn, client_ip) for client_ip in dict.fromkeys(client_ips)}
+
+    def _record(self, metric, elapsed, error=None):
+        histograms = self._histograms.get(metric)
+        if histograms is None:
+            histograms = self._histograms.setdefault(metric, (
+                metrics.histogram('pi_request_seconds', endpoint=metric),
+                metrics.counter('pi_request_errors', endpoint=metric),
+            ))
+        histograms[0].observe(elapsed)
+        if error:
+            histograms[1].inc()
+        with self._lock:
+            m = self._metrics.setdefault(metric, {
+                'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'last_error': None,
+            })
+            m['calls'] += 1
+            m['total_seconds'] += elapsed
+            m['max_seconds'] = max(m['max_seconds'], elapsed)
+            if error:
+                m['errors'] += 1
+                m['last_error'] = error
+
+    def get_metrics(self):
+        with self._lock:
+            result = {}
+            for metric, m in self._metrics.items():
+                result[metric] = dict(m, avg_seconds=m['total_seconds'] / m['calls'] if m['calls'] else 0.0)
+            return result
+
+    # --- Pi endpoints ---
+
+    def push_live_content(self, mode, client_ip, source_a, filename_a, source_b=None, filename_b=None):
+        """
+        Pushes live content to the client for immediate playback. Sources
+        are paths or binary file objects (closed once sent), so uploads
+        held in memory are sent without touching disk.
+        """
+        files = {}
+        try:
+            if source_a is not None:
+                files['file_a'] = (filename_a, open(source_a, 'rb') if isinstance(source_a, str) else source_a)
+            if source_b is not None:
+                files['file_b'] = (filename_b, open(source_b, 'rb') if isinstance(source_b, str) else source_b)
+
+            data = {'mode': mode}
+            print(f"Pushing live content to {self.url(client_ip, '/api/live/upload')}")
+            self.request('POST', client_ip, '/api/live/upload', files=files, data=data, timeout=5)
+            return True
+        except Exception as e:
+            print(f"Error pushing live content: {e}")
+            return False
+        finally:
+            for f in files.values():
+                f[1].close()
+
+    def push_draw_delta(self, client_ip, delta):
+        """
+        Sends changed rectangles/runs of the draw canvas to the client.
+        Returns True/False, or None if the client doesn't support deltas.
+        """
+        try:
+            response = self.request('POST', client_ip, '/api/live/draw', json=delta, timeout=2)
+        except Exception as e:
+            print(f"Error pushing draw delta: {e}")
+            return False
+        if response.status_code == 404:
+            return None
+        return response.status_code == 200
+
+    def push_playlist(self, client_ip, schedule):
+        """
+        Sends an exported playlist for the client to play from its SD card.
+        Returns True/False, or None if the client doesn't support playlists.
+        """
+        try:
+            response = self.request('POST', client_ip, '/api/playlist', json=schedule, timeout=5)
+        except Exception as e:
+            print(f"Error pushing playlist: {e}")
+            return False
+        if response.status_code == 404:
+            return None
+        return response.status_code == 200
+
+    @staticmethod
+    def _sd_options(mode, pos1, pos2):
+        data = {'mode': mode}
+        if pos1 is not None: data['position_1'] = pos1
+        if pos2 is not None: data['position_2'] = pos2
+        return data
+
+    def push_file(self, filepath, filename, client_ip, mode='both', pos1=None, pos2=None, sha256=None):
+        """Pushes a file to the client's SD card storage."""
+        try:
+            with open(filepath, 'rb') as f:
+                files = {'file': (filename, f)}
+                data = self._sd_options(mode, pos1, pos2)
+                if sha256: data['sha256'] = sha256
+
+                print(f"Pushing file {filename} to {self.url(client_ip, '/api/sd/upload')} with mode {mode}")
+                response = self.request('POST', client_ip, '/api/sd/upload', files=files, data=data, timeout=10)
+                if response.status_code == 200:
+                    print(f"Successfully pushed {filename}")
+                    return True
+                print(f"Failed to push {filename}: {response.text}")
+        except Exception as e:
+            print(f"Error pushing file: {e}")
+        return False
+
+    def sd_have(self, client_ip, hashes):
+        """
+        Asks the client which of the given SHA-256 hashes it already stores.
+        Clients that predate the call (404) are treated as having none.
+        """
+        response = self.request('POST', client_ip, '/api/sd/have', json={'hashes': list(hashes)}, timeout=5)
+        if response.status_code == 404:
+            return set()
+        response.raise_for_status()
+        return set(response.json().get('have', []))
+
+    def sd_link(self, client_ip, filename, sha256, mode='both', pos1=None, pos2=None):
+        """Tells the client to store a file it already has (by hash) under filename."""
+        data = dict(self._sd_options(mode, pos1, pos2), filename=filename, sha256=sha256)
+        response = self.request('POST', client_ip, '/api/sd/link', json=data, timeout=5)
+        return response.status_code == 200
+
+    def push_chunked(self, client_ip, path, filename, sha256, mode='both', pos1=None, pos2=None,
+                     offset=0, progress=None):
+        """
+        Sends a file to the client's SD card in CHUNK_SIZE pieces, read from
+        disk one at a time, starting at offset (how far an earlier attempt
+        got). Every chunk carries its own SHA-256 and is retried with
+        backoff; when the client has a different offset it answers 409 with
+        its own and the push continues from there. progress(offset) is
+        called after every acknowledged chunk.
+
+        Returns True once the client confirmed the whole file, False if the
+        push was interrupted and None if the client doesn't support chunked
+        transfers.
+        """
+        url_path = f'/api/sd/transfer/{sha256}'
+        total = os.path.getsize(path)
+        try:
+            with open(path, 'rb') as f:
+                while offset < total:
+                    f.seek(offset)
+                    chunk = f.read(self.CHUNK_SIZE)
+                    headers = {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Offset': str(offset),
+                        'X-Total-Size': str(total),
+                        'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest(),
+                    }
+                    for attempt in range(self.CHUNK_RETRIES):
+                        try:
+                            response = self.request('PUT', client_ip, url_path, timeout=10, data=chunk,
+                                                    headers=headers, metric='/api/sd/transfer/<sha256>')
+                        except Exception as e:
+                            print(f"Error sending {filename} at {offset}: {e}")
+                            response = None
+                        if response is not None:
+                            if response.status_code == 404:
+                                return None
+                            if response.status_code in (200, 409):
+                                break
+                        time.sleep(0.5 * 2 ** attempt)
+                    else:
+                        print(f"Push of {filename} interrupted at {offset} of {total} bytes")
+                        return False
+                    offset = int(response.json()['received'])
+                    if progress:
+                        progress(offset)
+
+            data = dict(self._sd_options(mode, pos1, pos2), filename=filename)
+            response = self.request('POST', client_ip, f'{url_path}/complete', json=data, timeout=30,
+                                    metric='/api/sd/transfer/<sha256>/complete')
+        except Exception as e:
+            print(f"Error pushing {filename}: {e}")
+            return False
+        if response.status_code == 404:
+            return None
+        if response.status_code == 200:
+            print(f"Successfully pushed {filename}")
+            return True
+        # The assembled file didn't match its hash; start over next time
+        print(f"Client rejected {filename}: {response.text}")
+        if progress:
+            progress(0)
+        return False
+
+    def push_assets(self, client_ip, assets, mode='both', pos1=None, pos2=None, begin_transfer=None):
+        """
+        Pushes SD assets, given as (filename, sha256, path) tuples. The client
+        is asked once which hashes it already has; those are only linked
+        under their filename and the rest are sent with push_chunked (or
+        push_file for clients without chunked transfers).
+
+        begin_transfer(filename, sha256, size), if given, returns a tracker
+        with the offset to resume from (sent), update(offset) and
+        finish(ok). Returns {filename: sha256} of the files that reached
+        the client.
+        """
+        try:
+            have = self.sd_have(client_ip, {sha256 for _, sha256, _ in assets})
+        except Exception as e:
+            print(f"Error asking client for its SD hashes: {e}")
+            return {}
+
+        synced = {}
+        for filename, sha256, path in assets:
+            if sha256 in have:
+                try:
+                    ok = self.sd_link(client_ip, filename, sha256, mode, pos1, pos2)
+                except Exception as e:
+                    print(f"Error linking {filename} on client: {e}")
+                    ok = False
+            else:
+                transfer = begin_transfer(filename, sha256, os.path.getsize(path)) if begin_transfer else None
+                ok = self.push_chunked(client_ip, path, filename, sha256, mode, pos1, pos2,
+                                       offset=transfer.sent if transfer else 0,
+                                       progress=transfer.update if transfer else None)
+                if ok is None:
+                    ok = self.push_file(path, filename, client_ip, mode, pos1, pos2, sha256=sha256)
+                if transfer:
+                    transfer.finish(ok)
+                if ok:
+                    have.add(sha256)
+            if ok:
+                synced[filename] = sha256
+        return synced
+
+    def push_settings(self, settings, client_ip):
+        """Pushes settings to the client."""
+        try:
+            print(f"Pushing settings to {self.url(client_ip, '/api/config')}")
+            response = self.request('POST', client_ip, '/api/config', json=settings, timeout=5)
+            if response.status_code == 200:
+                print("Successfully pushed settings")
+                return True
+            print(f"Failed to push settings: {response.text}")
+        except Exception as e:
+            print(f"Error pushing settings: {e}")
+        return False
+
+    def delete_sd_file(self, client_ip, filename):
+        return self.request('DELETE', client_ip, f'/api/sd/files/{filename}', timeout=5,
+                            metric='/api/sd/files/<filename>')
+
+    def sd_command(self, client_ip, action):
+        """Sends 'play' or 'stop' to the client's SD card player."""
+        return self.request('POST', client_ip, f'/api/sd/{action}', timeout=5)
@@ -0,0 +1,235 @@
+import fcntl
+import mmap
+import os
+import pickle
+import tempfile
+import threading
+
+
+class SharedStore:
+    """
+    File-backed key/value state shared between gunicorn workers.
+
+    Every key is a pickle file in a common folder that is replaced atomically
+    on write. Readers keep the last object they loaded and only go back to
+    disk when the file changes, so a read normally costs a single stat().
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.pickle")
+
+    @staticmethod
+    def _stamp(st):
+        # os.replace() always installs a new inode, so this changes on every write
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def write(self, key, value):
+        path = self._path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix=f".{key}-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._cache[key] = (self._stamp(os.stat(path)), value)
+
+    def read(self, key, default=None):
+        path = self._path(key)
+        try:
+            stamp = self._stamp(os.stat(path))
+        except FileNotFoundError:
+            return default
+
+        cached = self._cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # Replaced or truncated between stat() and open(); keep what we had
+            return cached[1] if cached else default
+
+        with self._lock:
+            self._cache[key] = (stamp, value)
+        return value
+
+    def update(self, key, fn, default=None):
+        """
+        Read-modify-write of a key under an exclusive file lock, so
+        concurrent updates from different workers are not lost.
+        Returns the new value.
+        """
+        with open(os.path.join(self.folder, f".{key}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                value = fn(self.read(key, default))
+                self.write(key, value)
+                return value
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def touch(self, key):
+        """Marks a heartbeat key as seen now (only the mtime is used)."""
+        path = os.path.join(self.folder, f"{key}.seen")
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    def last_touched(self, key):
+        try:
+            return os.stat(os.path.join(self.folder, f"{key}.seen")).st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def keys(self, prefix=''):
+        """Lists stored keys starting with prefix, with their mtime."""
+        result = []
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(prefix) and entry.name.endswith('.pickle'):
+                try:
+                    result.append((entry.name[:-len('.pickle')], entry.stat().st_mtime))
+                except FileNotFoundError:
+                    pass
+        return result
+
+
+class SnapshotStore:
+    """
+    Large immutable values as flat files that are memory-mapped on read.
+
+    Values provide write_snapshot(f); loader(buffer) rebuilds them from a
+    read-only mmap of the file, typically as views into it. Files are
+    replaced atomically, so a mapping stays valid (on the old inode) while
+    a new snapshot is written, and the page cache is shared by every
+    worker mapping the same file. Reads are cached by file stamp like in
+    SharedStore.
+    """
+
+    EXTENSION = '.snapshot'
+
+    def __init__(self, folder, loader):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.loader = loader
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}{self.EXTENSION}")
+
+    def write(self, key, value):
+        path = self._path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix=f".{key}-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                value.write_snapshot(f)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._forget(key)
+
+    def _forget(self, key):
+        """
+        Drops the cached mapping of key. The mmap (and the descriptor that
+        pins the file) is closed now, or once the last content using it is
+        freed.
+        """
+        with self._lock:
+            entry = self._cache.pop(key, None)
+        if entry is None:
+            return
+        buffer = entry[2]
+        del entry
+        try:
+            buffer.close()
+        except BufferError:
+            pass
+
+    def read(self, key, default=None):
+        path = self._path(key)
+        try:
+            stamp = SharedStore._stamp(os.stat(path))
+        except FileNotFoundError:
+            # Deleted, maybe by another worker: don't keep its file pinned
+            self._forget(key)
+            return default
+
+        cached = self._cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        try:
+            with open(path, 'rb') as f:
+                # Stamp of the file actually mapped, in case it was replaced meanwhile
+                stamp = SharedStore._stamp(os.fstat(f.fileno()))
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Missing, or empty (mmap refuses zero-length files)
+            self._forget(key)
+            return default
+
+        try:
+            value = self.loader(buffer)
+        except ValueError as e:
+            print(f"Ignoring unreadable snapshot {key}: {e}")
+            return default
+
+        self._forget(key)
+        with self._lock:
+            self._cache[key] = (stamp, value, buffer)
+        return value
+
+    def touch(self, key):
+        """Sets a snapshot's mtime to now; returns False if it doesn't exist."""
+        try:
+            os.utime(self._path(key), None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._forget(key)
+
+    def sweep(self):
+        """Drops cached mappings of snapshots that were deleted (by other workers, say)."""
+        with self._lock:
+            keys = list(self._cache)
+        for key in keys:
+            if not os.path.exists(self._path(key)):
+                self._forget(key)
+
+    def keys(self, prefix=''):
+        """Lists stored keys starting with prefix, with their mtime."""
+        result = []
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(prefix) and entry.name.endswith(self.EXTENSION):
+                try:
+                    result.append((entry.name[:-len(self.EXTENSION)], entry.stat().st_mtime))
+                except FileNotFoundError:
+                    pass
+        return result
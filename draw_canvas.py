@@ -0,0 +1,112 @@
+import base64
+import binascii
+
+import numpy as np
+
+
+class DrawCanvas:
+    """
+    The Draw tab's canvas for one client, spanning both matrices.
+
+    The pixels live in the shared store as {'seq', 'pixels'} and every
+    update is a locked read-modify-write of that key, so strokes applied by
+    different workers all land on the same canvas. Updates are deltas:
+
+      - rects: {"x", "y", "w", "h", "data"}, data being base64 RGB888
+        bytes of the rectangle, row-major
+      - runs: {"x", "y", "length", "color": [r, g, b]}, a horizontal run of
+        one color
+
+    Rectangles and runs are clipped to the canvas.
+    """
+
+    WIDTH = 128
+    HEIGHT = 64
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def _blank(self):
+        return {'seq': 0, 'pixels': np.zeros((self.HEIGHT, self.WIDTH, 3), dtype=np.uint8)}
+
+    def get(self):
+        """Returns (seq, pixels); pixels must not be modified."""
+        state = self.store.read(self.key) or self._blank()
+        return state['seq'], state['pixels']
+
+    def _clip(self, x, y, w, h):
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.WIDTH), min(y + h, self.HEIGHT)
+        return x0, y0, x1, y1
+
+    def parse(self, delta):
+        """
+        Validates a delta and decodes it into (rects, runs), with rect data
+        as H x W x 3 arrays. Raises ValueError for malformed input.
+        """
+        if not isinstance(delta, dict):
+            raise ValueError('Delta must be a JSON object')
+        for name in ('rects', 'runs'):
+            items = delta.get(name, [])
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                raise ValueError(f'{name} must be a list of objects')
+        rects = []
+        runs = []
+        try:
+            for rect in delta.get('rects', []):
+                x, y, w, h = (int(rect[k]) for k in ('x', 'y', 'w', 'h'))
+                if w <= 0 or h <= 0:
+                    raise ValueError('Rectangle must not be empty')
+                data = np.frombuffer(base64.b64decode(rect['data']), dtype=np.uint8)
+                if data.size != w * h * 3:
+                    raise ValueError(f'Rectangle data must be {w * h * 3} bytes of RGB')
+                rects.append((x, y, data.reshape(h, w, 3)))
+            for run in delta.get('runs', []):
+                x, y, length = int(run['x']), int(run['y']), int(run['length'])
+                color = [int(c) for c in run['color']]
+                if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+                    raise ValueError('Run color must be [r, g, b]')
+                runs.append((x, y, length, color))
+        except (KeyError, TypeError, binascii.Error) as e:
+            raise ValueError(f'Malformed delta: {e}')
+        if not rects and not runs:
+            raise ValueError('Delta has no rects or runs')
+        return rects, runs
+
+    def apply(self, delta):
+        """
+        Applies a delta. Returns (seq, clipped) where clipped is the delta
+        in the request's format, clipped to the canvas, for forwarding.
+        """
+        rects, runs = self.parse(delta)
+        clipped = {'rects': [], 'runs': []}
+
+        def update(state):
+            pixels = state['pixels'].copy()
+            for x, y, data in rects:
+                x0, y0, x1, y1 = self._clip(x, y, data.shape[1], data.shape[0])
+                if x0 < x1 and y0 < y1:
+                    region = data[y0 - y:y1 - y, x0 - x:x1 - x]
+                    pixels[y0:y1, x0:x1] = region
+                    clipped['rects'].append({'x': x0, 'y': y0, 'w': x1 - x0, 'h': y1 - y0,
+                                             'data': base64.b64encode(region.tobytes()).decode('ascii')})
+            for x, y, length, color in runs:
+                x0, y0, x1, y1 = self._clip(x, y, length, 1)
+                if x0 < x1 and y0 < y1:
+                    pixels[y0, x0:x1] = color
+                    clipped['runs'].append({'x': x0, 'y': y0, 'length': x1 - x0, 'color': color})
+            return {'seq': state['seq'] + 1, 'pixels': pixels}
+
+        state = self.store.update(self.key, update, self._blank())
+        return state['seq'], clipped
+
+    def set_image(self, image):
+        """Replaces the whole canvas with a PIL image (resized to the canvas if needed)."""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.size != (self.WIDTH, self.HEIGHT):
+            image = image.resize((self.WIDTH, self.HEIGHT))
+        pixels = np.asarray(image).copy()
+        return self.store.update(self.key, lambda state: {'seq': state['seq'] + 1, 'pixels': pixels},
+                                 self._blank())['seq']
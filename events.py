@@ -0,0 +1,61 @@
+import copy
+import threading
+import time
+
+
+class ChangeNotifier:
+    """
+    Content and settings change notifications for the Pi.
+
+    The current versions live in the shared store under key (one per
+    client) with a sequence number that increases on every change. Waiters in the
+    publishing worker wake up immediately; waiters in other workers notice
+    the change on their next stat() of the store, every poll_interval.
+    """
+
+    # content_seq and settings_seq record the seq of the last change of each,
+    # so setting identical content again is still reported and a client can
+    # tell what changed after any seq it saw
+    INITIAL_STATE = {'seq': 0, 'content': {'a': None, 'b': None}, 'content_seq': {'a': 0, 'b': 0}, 'settings': 0,
+                     'settings_seq': 0}
+
+    def __init__(self, store, key='change_versions', poll_interval=0.1):
+        self.store = store
+        self.key = key
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+
+    def current(self):
+        return self.store.read(self.key, self.INITIAL_STATE)
+
+    def publish(self, kind, matrix=None, version=None):
+        """Records a change: kind is 'content' (with matrix and version) or 'settings'."""
+        def apply(state):
+            state = copy.deepcopy(state)
+            state['seq'] += 1
+            if kind == 'content':
+                state['content'][matrix] = version
+                state['content_seq'][matrix] = state['seq']
+            else:
+                state['settings'] += 1
+                state['settings_seq'] = state['seq']
+            return state
+
+        state = self.store.update(self.key, apply, self.INITIAL_STATE)
+        with self._condition:
+            self._condition.notify_all()
+        return state
+
+    def wait(self, since, timeout):
+        """
+        Blocks until the sequence number is past since or timeout seconds
+        have passed; returns the current state either way.
+        """
+        deadline = time.time() + timeout
+        while True:
+            state = self.current()
+            remaining = deadline - time.time()
+            if state['seq'] > since or remaining <= 0:
+                return state
+            with self._condition:
+                self._condition.wait(min(self.poll_interval, remaining))
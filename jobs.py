@@ -0,0 +1,120 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    Handle passed to a running job function.
+
+    Every change is written to the shared store so GET /api/jobs/<id> sees
+    the same record whichever gunicorn worker serves it.
+    """
+
+    def __init__(self, manager, record):
+        self.manager = manager
+        self.record = record
+
+    @property
+    def id(self):
+        return self.record['id']
+
+    def _save(self):
+        self.manager.store.write(f"job_{self.id}", self.record)
+
+    def stage(self, name):
+        return _JobStage(self, name)
+
+    def progress(self, value):
+        self.record['progress'] = round(min(max(value, 0.0), 1.0), 3)
+        self._save()
+
+    def set_result(self, **result):
+        self.record['result'].update(result)
+        self._save()
+
+
+class _JobStage:
+    def __init__(self, job, name):
+        self.job = job
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        self.job.record['stage'] = self.name
+        self.job.record['stages'].append({'name': self.name, 'started': self.started, 'duration': None})
+        self.job._save()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.job.record['stages'][-1]['duration'] = time.time() - self.started
+        self.job._save()
+        return False
+
+
+class JobManager:
+    """Runs background jobs on a bounded thread pool and tracks their state."""
+
+    # Finished job records older than this are removed on the next submit
+    JOB_TTL = 3600
+
+    def __init__(self, store, max_workers=2):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, cleanup=None, **kwargs):
+        """
+        Queues fn(job, *args, **kwargs) and returns the new job ID.
+        cleanup, if given, is called once the job has finished either way.
+        """
+        self.prune()
+        record = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': 'queued',
+            'stage': None,
+            'progress': 0.0,
+            'stages': [],
+            'result': {},
+            'error': None,
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+        }
+        job = Job(self, record)
+        job._save()
+        self.executor.submit(self._run, job, fn, args, kwargs, cleanup)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs, cleanup):
+        job.record['status'] = 'running'
+        job.record['started'] = time.time()
+        job._save()
+        try:
+            fn(job, *args, **kwargs)
+            job.record['status'] = 'done'
+            job.record['progress'] = 1.0
+        except Exception as e:
+            print(f"Job {job.id} ({job.record['kind']}) failed: {e}")
+            job.record['status'] = 'error'
+            job.record['error'] = str(e)
+        finally:
+            job.record['finished'] = time.time()
+            job._save()
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"Job {job.id} cleanup failed: {e}")
+
+    def get(self, job_id):
+        return self.store.read(f"job_{job_id}")
+
+    def prune(self):
+        cutoff = time.time() - self.JOB_TTL
+        with self._lock:
+            for key, mtime in self.store.keys('job_'):
+                if mtime < cutoff:
+                    self.store.delete(key)
@@ -1,18 +1,40 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, abort
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_bcrypt import Bcrypt
-from PIL import Image, ImageSequence
+from PIL import Image
 import io
+import atexit
+import copy
+import hashlib
+import threading
 import base64
 import time
 import os
 import tempfile
-import imageio
-import threading
-import requests
-
-app = Flask(__name__)
+import numpy as np
+from content_store import SharedStore, SnapshotStore
+import frame_ops
+from matrix_content import MatrixContent
+from client_comm import ClientComm
+from sd_assets import SdAssetStore, TransferTracker
+from draw_canvas import DrawCanvas
+from upload_buffer import UploadBuffer
+from media_decode import DecodePool, decode_content, process_content
+import sd_transcode
+from jobs import JobManager
+from events import ChangeNotifier
+from playlist import PlaylistEngine, new_item, prepared_assets
+from metrics import metrics
+import json
+import re
+
+# LEMONA_INSTANCE_PATH moves the database and shared state elsewhere
+# (the benchmark suite runs against a throwaway instance this way)
+INSTANCE_PATH = os.environ.get('LEMONA_INSTANCE_PATH')
+app = Flask(__name__, instance_path=os.path.abspath(INSTANCE_PATH) if INSTANCE_PATH else None)
 app.config['SECRET_KEY'] = 'your-secret-key-here' # Change this in production
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -20,6 +42,42 @@ SD_UPLOAD_FOLDER = 'sd_uploads'
 if not os.path.exists(SD_UPLOAD_FOLDER):
     os.makedirs(SD_UPLOAD_FOLDER)
 
+# State shared by all gunicorn workers (matrix content, telemetry, heartbeats)
+SHARED_STATE_FOLDER = os.path.join(app.instance_path, 'shared_state')
+shared_store = SharedStore(SHARED_STATE_FOLDER)
+# Processed matrix content, memory-mapped back in after a restart
+content_snapshots = SnapshotStore(os.path.join(app.instance_path, 'content_snapshots'), MatrixContent.from_snapshot)
+# Bounded pool for upload decoding and pushes to the client
+jobs = JobManager(shared_store, max_workers=2)
+# Scheduled playlists per client; the callbacks are defined further down
+playlists = PlaylistEngine(shared_store, lambda client_id: get_display(client_id),
+                           lambda client_id, item: render_playlist_item(client_id, item))
+# SD card files, stored by content hash with a per-client name index (files
+# used by playlists are kept even when no index refers to them)
+sd_assets = SdAssetStore(SD_UPLOAD_FOLDER, shared_store, pinned=playlists.pinned_hashes)
+# How far each client got with each chunked SD push (resume point and progress)
+sd_transfers = TransferTracker(shared_store)
+# Pooled HTTP sessions and a bounded executor for all traffic to the Pi
+client_comm = ClientComm(max_workers=8)
+# Worker processes for decodes that run in parallel (separate-mode A and B)
+decode_pool = DecodePool(max_workers=min(2, os.cpu_count() or 1))
+atexit.register(decode_pool.shutdown)
+
+# Latency histograms and counters, summed over all workers at /metrics
+metrics.describe('stage_seconds', 'Time spent in each processing stage in seconds.')
+metrics.describe('db_commit_seconds', 'Database commit time in seconds.')
+metrics.describe('pi_request_seconds', 'Latency of calls to the Pi in seconds, per endpoint.')
+metrics.describe('pi_request_errors', 'Failed calls to the Pi (connection errors and HTTP >= 400), per endpoint.')
+decode_seconds = metrics.histogram('stage_seconds', stage='decode')
+serve_seconds = metrics.histogram('stage_seconds', stage='serve')
+telemetry_commit_seconds = metrics.histogram('db_commit_seconds', operation='telemetry')
+client_config_commit_seconds = metrics.histogram('db_commit_seconds', operation='client_config')
+
+# Every Pi identifies itself with a client ID (X-Client-ID header or ?client=);
+# Pis that send none are the 'default' client
+DEFAULT_CLIENT = 'default'
+CLIENT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
@@ -36,17 +94,19 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"User('{self.username}', '{self.is_admin}', '{self.is_approved}')"
 
-def get_client_ip():
-    """Helper to get the client IP from telemetry or settings."""
+def get_client_ip(client_id=None):
+    """Helper to get a client's IP from telemetry or settings."""
+    latest_telemetry = get_latest_telemetry(client_id)
     if 'network' in latest_telemetry and 'ip' in latest_telemetry['network']:
         return latest_telemetry['network']['ip']
-    settings = ClientSettings.get_settings()
-    if settings.last_ip:
-        return settings.last_ip
+    settings = get_display(client_id).settings.get()
+    if settings['last_ip']:
+        return settings['last_ip']
     return None
 
 class ClientSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.String(64), unique=True, default=DEFAULT_CLIENT)
     polling_rate = db.Column(db.Float, default=1.0)
     gpio_slowdown = db.Column(db.Integer, default=4)
     hardware_pulsing = db.Column(db.Boolean, default=True)
@@ -67,6 +127,8 @@ class ClientSettings(db.Model):
     sd_slide_duration = db.Column(db.Float, default=30.0)
     sd_video_fps = db.Column(db.Float, default=30.0)
     sd_playlist_refresh_rate = db.Column(db.Float, default=10.0)
+    live_max_frames = db.Column(db.Integer, default=150)
+    live_video_fps = db.Column(db.Float, default=30.0)
     
     # Telemetry fields (persisted)
     last_ip = db.Column(db.String(20), default="")
@@ -75,12 +137,14 @@ class ClientSettings(db.Model):
     last_refresh_rate = db.Column(db.Float, default=0.0)
     last_seen = db.Column(db.Float, default=0.0)
     
-    # Default singleton retrieval
+    # Per-client retrieval; other clients than the default one only exist once
+    # registered, so this returns None for them until then
     @classmethod
-    def get_settings(cls):
-        settings = cls.query.first()
-        if not settings:
+    def get_settings(cls, client_id=DEFAULT_CLIENT):
+        settings = cls.query.filter_by(client_id=client_id).first()
+        if not settings and client_id == DEFAULT_CLIENT:
             settings = cls(
+                client_id=DEFAULT_CLIENT,
                 polling_rate=5.0, 
                 gpio_slowdown=4, 
                 hardware_pulsing=True, 
@@ -98,18 +162,259 @@ class ClientSettings(db.Model):
                 matrix_pwm_lsb_nanoseconds=130,
                 sd_slide_duration=30.0,
                 sd_video_fps=30.0,
-                sd_playlist_refresh_rate=10.0
+                sd_playlist_refresh_rate=10.0,
+                live_max_frames=150,
+                live_video_fps=30.0
             )
             db.session.add(settings)
             db.session.commit()
         return settings
 
+    @classmethod
+    def register(cls, client_id):
+        """
+        Adds a client, starting from the default client's settings. Returns
+        (settings, created).
+        """
+        settings = cls.query.filter_by(client_id=client_id).first()
+        if settings:
+            return settings, False
+        template = cls.get_settings()
+        settings = cls(client_id=client_id, **{f: getattr(template, f) for f in ADMIN_SETTINGS_FIELDS})
+        db.session.add(settings)
+        try:
+            db.session.commit()
+        except exc.IntegrityError:
+            # Another worker registered the same client first
+            db.session.rollback()
+            return cls.query.filter_by(client_id=client_id).first(), False
+        return settings, True
+
+    @classmethod
+    def is_registered(cls, client_id):
+        if client_id == DEFAULT_CLIENT:
+            return True
+        with app.app_context():
+            return db.session.query(cls.query.filter_by(client_id=client_id).exists()).scalar()
+
+    @classmethod
+    def client_ids(cls):
+        """IDs of all registered clients, default first."""
+        ids = [row.client_id for row in cls.query.with_entities(cls.client_id).order_by(cls.id)]
+        return [DEFAULT_CLIENT] + [c for c in ids if c != DEFAULT_CLIENT]
+
+class TelemetrySample(db.Model):
+    """Append-only history of telemetry reports from the Pis."""
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.String(64), default=DEFAULT_CLIENT, index=True)
+    timestamp = db.Column(db.Float, nullable=False, index=True)
+    ip = db.Column(db.String(20), default="")
+    ssid = db.Column(db.String(100), default="")
+    network_type = db.Column(db.String(20), default="")
+    refresh_rate = db.Column(db.Float, nullable=True)
+
+class TelemetryRollup(db.Model):
+    """Per-minute aggregate of TelemetrySample, keyed by client and the minute's start time."""
+    client_id = db.Column(db.String(64), primary_key=True, default=DEFAULT_CLIENT)
+    minute = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, default=0)
+    refresh_count = db.Column(db.Integer, default=0)
+    refresh_sum = db.Column(db.Float, default=0.0)
+    refresh_min = db.Column(db.Float, nullable=True)
+    refresh_max = db.Column(db.Float, nullable=True)
+
+class TelemetryBuffer:
+    """
+    Write-behind buffer for telemetry reports.
+
+    Reports are appended in memory and written in one transaction (samples,
+    minute rollups and the last_* fields of ClientSettings) once BATCH_SIZE
+    reports are pending or FLUSH_INTERVAL seconds have passed. Writes only
+    happen on a daemon thread, so a report never waits for the database;
+    append wakes it early when a batch is full.
+    """
+
+    BATCH_SIZE = 50
+    FLUSH_INTERVAL = 10.0
+    # Reports kept while the database can't be written; the oldest go first
+    MAX_PENDING = 5000
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+
+    def append(self, data, client_id=DEFAULT_CLIENT):
+        network = data.get('network', {})
+        refresh_rate = data.get('refresh_rate')
+        sample = {
+            'client_id': client_id,
+            'timestamp': data['last_seen'],
+            'ip': network.get('ip', ''),
+            'ssid': network.get('ssid', ''),
+            'network_type': network.get('type', ''),
+            'refresh_rate': float(refresh_rate) if refresh_rate is not None else None,
+        }
+        with self._lock:
+            self._pending.append(sample)
+            due = len(self._pending) >= self.BATCH_SIZE
+        self._ensure_thread()
+        if due:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True, name='telemetry-flush')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"Error flushing telemetry: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._pending[:0] = batch
+                    del self._pending[:-self.MAX_PENDING]
+                raise
+            return len(batch)
+
+    def _write(self, batch):
+        db.session.bulk_insert_mappings(TelemetrySample, batch)
+
+        rollups = {}
+        latest = {}
+        for sample in batch:
+            key = (sample['client_id'], int(sample['timestamp'] // 60) * 60)
+            latest[sample['client_id']] = sample
+            rollup = rollups.setdefault(key, {'client_id': key[0], 'minute': key[1], 'count': 0, 'refresh_count': 0,
+                                              'refresh_sum': 0.0, 'refresh_min': None, 'refresh_max': None})
+            rollup['count'] += 1
+            rate = sample['refresh_rate']
+            if rate is not None:
+                rollup['refresh_count'] += 1
+                rollup['refresh_sum'] += rate
+                rollup['refresh_min'] = rate if rollup['refresh_min'] is None else min(rollup['refresh_min'], rate)
+                rollup['refresh_max'] = rate if rollup['refresh_max'] is None else max(rollup['refresh_max'], rate)
+
+        # Merged into the stored minute in one statement, so workers flushing
+        # the same minute add up instead of colliding on the primary key
+        table = TelemetryRollup.__table__
+        for rollup in rollups.values():
+            insert = sqlite_insert(table).values(**rollup)
+            new = insert.excluded
+            db.session.execute(insert.on_conflict_do_update(
+                index_elements=[table.c.client_id, table.c.minute],
+                set_={
+                    'count': table.c.count + new.count,
+                    'refresh_count': table.c.refresh_count + new.refresh_count,
+                    'refresh_sum': table.c.refresh_sum + new.refresh_sum,
+                    # SQLite's two-argument min/max are NULL if either side is
+                    'refresh_min': func.min(func.coalesce(table.c.refresh_min, new.refresh_min),
+                                            func.coalesce(new.refresh_min, table.c.refresh_min)),
+                    'refresh_max': func.max(func.coalesce(table.c.refresh_max, new.refresh_max),
+                                            func.coalesce(new.refresh_max, table.c.refresh_max)),
+                }))
+
+        for client_id, sample in latest.items():
+            if not sample['ip']:
+                continue
+            settings = ClientSettings.get_settings(client_id)
+            if settings is None:
+                continue
+            settings.last_ip = sample['ip']
+            settings.last_ssid = sample['ssid']
+            settings.last_network_type = sample['network_type']
+            if sample['refresh_rate'] is not None:
+                settings.last_refresh_rate = sample['refresh_rate']
+            settings.last_seen = sample['timestamp']
+
+        with telemetry_commit_seconds.time():
+            db.session.commit()
+
+telemetry_buffer = TelemetryBuffer()
+
+@atexit.register
+def flush_telemetry_on_exit():
+    try:
+        with app.app_context():
+            telemetry_buffer.flush()
+    except Exception as e:
+        print(f"Error flushing telemetry on exit: {e}")
+
+# Fields sent to the Pi by /api/client-config
+CLIENT_CONFIG_FIELDS = [
+    'polling_rate', 'gpio_slowdown', 'hardware_pulsing', 'brightness',
+    'position_1', 'position_2', 'request_send_rate', 'wifi_ssid', 'wifi_password',
+    'matrix_rows', 'matrix_cols', 'matrix_chain', 'matrix_parallel', 'matrix_pwm_lsb_nanoseconds',
+    'sd_slide_duration', 'sd_video_fps', 'sd_playlist_refresh_rate',
+]
+# Fields shown in the admin settings form
+ADMIN_SETTINGS_FIELDS = CLIENT_CONFIG_FIELDS + ['live_max_frames', 'live_video_fps']
+
+class SettingsCache:
+    """
+    In-memory copy of one client's ClientSettings row.
+
+    The copy is reloaded from the database only when the settings version
+    in the change notifier moves, which update_admin_settings does after
+    committing, so every worker picks up the change on its next read.
+    """
+
+    def __init__(self, notifier, client_id=DEFAULT_CLIENT):
+        self.notifier = notifier
+        self.client_id = client_id
+        self.version = None
+        self.etag = None
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the settings as a read-only dict of column values."""
+        version = self.notifier.current()['settings']
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    settings = ClientSettings.get_settings(self.client_id)
+                    values = {c.name: getattr(settings, c.name) for c in ClientSettings.__table__.columns}
+                    self._settings = values
+                    self.etag = hashlib.sha1(json.dumps(
+                        {f: values[f] for f in CLIENT_CONFIG_FIELDS}, sort_keys=True).encode()).hexdigest()[:16]
+                    self.version = version
+        return self._settings
+
+# Heartbeats from /api/client-config are written to the database at most this
+# often per client; heartbeat_state maps client ID to the last write time
+HEARTBEAT_FLUSH_INTERVAL = 30.0
+heartbeat_state = {}
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# --- Global State for Telemetry ---
-latest_telemetry = {}
+# --- Shared State for Telemetry ---
+def get_latest_telemetry(client_id=None):
+    """Returns a copy of the latest telemetry a client reported to any worker."""
+    return dict(shared_store.read(get_display(client_id).telemetry_key, {}))
+
+def set_latest_telemetry(data, client_id=None):
+    shared_store.write(get_display(client_id).telemetry_key, data)
 
 # --- Decorators ---
 def admin_required(f):
@@ -133,232 +438,423 @@ def approval_required(f):
     return login_required(wrapper)
 
 class MatrixController:
-    def __init__(self):
+    # Minimum interval between heartbeat writes per worker
+    SEEN_INTERVAL = 1.0
+    # Bumped whenever the stored content layout changes, so content written
+    # by an older deploy is discarded instead of served
+    CONTENT_FORMAT = 5
+    # Panel geometry used for the raw frame buffers until the admin saves settings
+    DEFAULT_LAYOUT = {'panel_size': (64, 64), 'rotation': {'a': 0, 'b': 0}}
+    # Unreferenced assets older than this are removed, at most once per interval
+    ASSET_PRUNE_INTERVAL = 60.0
+
+    def __init__(self, store, snapshots, notifier=None, prefix=''):
+        """
+        prefix namespaces this controller's keys in the shared store, so
+        one store can hold the content of several clients. The processed
+        content itself (assets) lives in the snapshot store, which maps it
+        back in without decoding, so a restarted worker serves the last
+        frame straight away.
+        """
         self.width = 64
         self.height = 64
-        # Initialize with black images
-        self.content_a = {'type': 'static', 'image': Image.new('RGB', (self.width, self.height), (0, 0, 0))}
-        self.content_b = {'type': 'static', 'image': Image.new('RGB', (self.width, self.height), (0, 0, 0))}
+        self.store = store
+        self.snapshots = snapshots
+        self.notifier = notifier
+        self.prefix = prefix
         self.last_seen = {'a': 0, 'b': 0}
+        self._last_prune = 0
+        self._blanks = {}
+
+    def init_content(self):
+        """Shows black images unless another worker already set content."""
+        for matrix in ('a', 'b'):
+            if self.stored_content(matrix) is None:
+                self.clear_matrix(matrix)
         print("Matrix Controller Initialized")
 
+    def _key(self, name):
+        return f'{self.prefix}{name}'
+
+    def get_content(self, matrix):
+        """
+        The content a matrix shows: its stored content, or black frames
+        when there is none (say its asset was pruned by another worker).
+        """
+        content = self.stored_content(matrix)
+        return content if content is not None else self._blank_content(matrix)
+
+    def _blank_content(self, matrix):
+        layout = self.get_layout()
+        raw_layout = (tuple(layout['panel_size']), int(layout['rotation'][matrix]) % 360)
+        content = self._blanks.get(raw_layout)
+        if content is None:
+            content = MatrixContent.from_image(Image.new('RGB', (self.width, self.height), (0, 0, 0)))
+            content.render_raw(*raw_layout)
+            content.format = self.CONTENT_FORMAT
+            self._blanks[raw_layout] = content
+        return content
+
+    def stored_content(self, matrix):
+        """The content the matrix key points at, or None."""
+        # Matrix keys point at a shared asset, so clients showing the same
+        # content with the same panel layout share one stored copy
+        ref = self.store.read(self._key(f'matrix_{matrix}'))
+        if not isinstance(ref, dict) or ref.get('format') != self.CONTENT_FORMAT:
+            return None
+        content = self.snapshots.read(ref['asset'])
+        if content is None:
+            content = self._adopt_pickled_asset(ref['asset'])
+        if not isinstance(content, MatrixContent) or content.format != self.CONTENT_FORMAT:
+            return None
+        # The playback clock belongs to the matrix, not the shared asset
+        start_time = ref.get('start_time', content.start_time)
+        if start_time != content.start_time:
+            content = content.with_start_time(start_time)
+        return content
+
+    def _adopt_pickled_asset(self, asset_key):
+        """Moves an asset stored as a pickle by an older version into the snapshot store."""
+        content = self.store.read(asset_key)
+        if isinstance(content, MatrixContent):
+            self.snapshots.write(asset_key, content)
+            self.store.delete(asset_key)
+        return content
+
+    def get_layout(self):
+        return self.store.read(self._key('panel_layout'), self.DEFAULT_LAYOUT)
+
+    def set_layout(self, panel_size, position_1=0, position_2=0):
+        """
+        Updates the panel geometry (from matrix_cols/matrix_rows and the
+        position_1/position_2 rotations) and re-renders the raw buffers of
+        the current content for it.
+        """
+        layout = {'panel_size': tuple(panel_size), 'rotation': {'a': position_1, 'b': position_2}}
+        if layout == self.get_layout():
+            return
+        self.store.write(self._key('panel_layout'), layout)
+        for matrix in ('a', 'b'):
+            content = self.stored_content(matrix)
+            if content is not None:
+                self.set_content(matrix, content)
+
+    @property
+    def content_a(self):
+        return self.get_content('a')
+
+    @property
+    def content_b(self):
+        return self.get_content('b')
+
     def process_image(self, image, target_size=(64, 64)):
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        return image.resize(target_size, Image.Resampling.LANCZOS)
+        return frame_ops.resize_image(image, target_size)
+
+    def process_frames(self, frames, target_size=(64, 64)):
+        """Resizes all frames in one batch; returns an N x H x W x 3 uint8 array."""
+        return frame_ops.resize_frames(frames, target_size)
 
-    def set_content(self, matrix, content):
+    def build_content(self, content, target_size=(64, 64)):
         """
-        content: dict with keys:
+        Resizes a content dict (or a bare PIL Image) and packs it into a
+        MatrixContent. The input is left untouched.
+        """
+        if isinstance(content, Image.Image):
+            content = {'type': 'static', 'image': content}
+        if isinstance(content, MatrixContent):
+            return content
+        if content['type'] == 'animation':
+            return MatrixContent.from_frames(self.process_frames(content['frames'], target_size),
+                                             content['durations'], content.get('start_time'))
+        return MatrixContent.from_image(self.process_image(content['image'], target_size))
+
+    def set_content(self, matrix, content, start_time=None):
+        """
+        content: a MatrixContent, or a dict with keys:
           - type: 'static' or 'animation'
           - image: PIL Image (for static)
-          - frames: list of PIL Images (for animation)
+          - frames: N x H x W x 3 uint8 array or list of PIL Images (for animation)
           - durations: list of durations in seconds (for animation)
           - start_time: timestamp (for animation)
+
+        start_time, if given, overrides the content's own start of playback
+        (see set_contents). It is kept in the matrix key rather than in the
+        asset, so clients sharing an asset keep their own clocks.
+
+        Dicts are packed into a MatrixContent, which keeps the frames in one
+        contiguous array, the timeline for bisecting frame lookups, the PNG
+        encoding of every frame and the raw frames in the panel's native
+        layout for this matrix. The processed content is then published
+        to the shared store so every worker serves it without decoding the
+        upload again.
+        """
+        if matrix not in ('a', 'b'):
+            return
+        self.show_prepared({matrix: self.prepare_content(matrix, content)}, start_time)
+
+    def prepare_content(self, matrix, content):
+        """
+        The expensive half of set_content: packs and renders the content
+        for this matrix's panel layout and stores it as an asset, without
+        showing it. Returns the reference for show_prepared.
+        """
+        content = self.build_content(content, (self.width, self.height))
+        layout = self.get_layout()
+        (width, height), rotation = layout['panel_size'], int(layout['rotation'][matrix]) % 360
+        asset_key = f'asset_{content.digest}_{width}x{height}r{rotation}'
+        existing = self.snapshots.read(asset_key)
+        # Reusing a stored asset marks it as used now, so a prune in another
+        # worker doesn't delete it before the matrix key points at it
+        if not (isinstance(existing, MatrixContent) and existing.format == self.CONTENT_FORMAT
+                and self.snapshots.touch(asset_key)):
+            # Shallow copy so the same content can be set on both matrices (and
+            # other clients) with different raw layouts; the frame buffers
+            # themselves are shared
+            content = copy.copy(content)
+            content.render_raw((width, height), rotation)
+            content.format = self.CONTENT_FORMAT
+            self.snapshots.write(asset_key, content)
+        return {'asset': asset_key, 'format': self.CONTENT_FORMAT, 'start_time': content.start_time,
+                'version': content.version}
+
+    def show_prepared(self, refs, start_time=None):
+        """
+        Shows content stored by prepare_content ({matrix: ref}). This only
+        repoints the matrix keys, so it costs the same for any content.
+        start_time, if given, replaces the start of playback of animations.
+        """
+        for matrix, ref in refs.items():
+            if start_time is not None and ref['start_time'] is not None:
+                ref = dict(ref, start_time=start_time)
+            self.store.write(self._key(f'matrix_{matrix}'), ref)
+            if self.notifier:
+                self.notifier.publish('content', matrix, ref['version'])
+        self.prune_assets()
+
+    def set_contents(self, contents, start_time=None):
+        """
+        Sets the content of several matrices ({'a': content, 'b': content})
+        as one group: animations all start at the same start_time (now by
+        default), so the two halves of a split animation, or A and B of a
+        separate upload, always show the same frame index.
         """
-        if matrix == 'a':
-            self.content_a = content
-        elif matrix == 'b':
-            self.content_b = content
+        if start_time is None:
+            start_time = time.time()
+        for matrix, content in contents.items():
+            self.set_content(matrix, content, start_time)
+
+    def prune_assets(self):
+        """Deletes stored assets no matrix of any client points at any more."""
+        now = time.time()
+        if now - self._last_prune < self.ASSET_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        referenced = set()
+        for key, _ in self.store.keys():
+            if 'matrix_' in key:
+                ref = self.store.read(key)
+                if isinstance(ref, dict) and 'asset' in ref:
+                    referenced.add(ref['asset'])
+            elif key.endswith(PlaylistEngine.STATE_KEY):
+                # Rendered ahead by a playlist, not shown yet
+                referenced.update(prepared_assets(self.store.read(key)))
+        # The shared store only holds assets pickled by older versions
+        for store in (self.snapshots, self.store):
+            for key, mtime in store.keys('asset_'):
+                if key not in referenced and now - mtime > self.ASSET_PRUNE_INTERVAL:
+                    store.delete(key)
+        # Mappings of assets other workers pruned
+        self.snapshots.sweep()
 
     def display_on_a(self, content):
-        if isinstance(content, Image.Image):
-             # Legacy support for direct image passing
-             content = {'type': 'static', 'image': self.process_image(content)}
-        elif content['type'] == 'static':
-             content['image'] = self.process_image(content['image'])
-        elif content['type'] == 'animation':
-             content['frames'] = [self.process_image(f) for f in content['frames']]
-             content['start_time'] = time.time()
-        
-        self.set_content('a', content)
+        self.set_content('a', self.build_content(content))
         print("Displaying content on Matrix A")
 
     def display_on_b(self, content):
-        if isinstance(content, Image.Image):
-             content = {'type': 'static', 'image': self.process_image(content)}
-        elif content['type'] == 'static':
-             content['image'] = self.process_image(content['image'])
-        elif content['type'] == 'animation':
-             content['frames'] = [self.process_image(f) for f in content['frames']]
-             content['start_time'] = time.time()
-
-        self.set_content('b', content)
+        self.set_content('b', self.build_content(content))
         print("Displaying content on Matrix B")
 
-    def display_split(self, content):
-        # Handle split for static images only for now (or simple frame split for animations)
-        # For simplicity, let's assume split only works well for static images or we split each frame
-        
+    def build_split(self, content):
+        """Resizes content to 128x64 and returns the (A, B) halves as MatrixContent."""
         if isinstance(content, Image.Image):
              content = {'type': 'static', 'image': content}
 
         if content['type'] == 'static':
             img = self.process_image(content['image'], target_size=(128, 64))
-            img_a = img.crop((0, 0, 64, 64))
-            img_b = img.crop((64, 0, 128, 64))
-            self.display_on_a(img_a)
-            self.display_on_b(img_b)
-        elif content['type'] == 'animation':
-            # Split each frame
-            frames_a = []
-            frames_b = []
-            for f in content['frames']:
-                img = self.process_image(f, target_size=(128, 64))
-                frames_a.append(img.crop((0, 0, 64, 64)))
-                frames_b.append(img.crop((64, 0, 128, 64)))
-            
-            content_a = {
-                'type': 'animation',
-                'frames': frames_a,
-                'durations': content['durations'],
-                'start_time': time.time()
-            }
-            content_b = {
-                'type': 'animation',
-                'frames': frames_b,
-                'durations': content['durations'],
-                'start_time': time.time()
-            }
-            self.set_content('a', content_a)
-            self.set_content('b', content_b)
-        
+            return (MatrixContent.from_image(img.crop((0, 0, 64, 64))),
+                    MatrixContent.from_image(img.crop((64, 0, 128, 64))))
+        # Resize every frame in one batch, then take both halves as views
+        stack_a, stack_b = frame_ops.split_halves(self.process_frames(content['frames'], target_size=(128, 64)))
+        start_time = time.time()
+        return (MatrixContent.from_frames(stack_a, content['durations'], start_time),
+                MatrixContent.from_frames(stack_b, content['durations'], start_time))
+
+    def display_split(self, content):
+        content_a, content_b = self.build_split(content)
+        self.set_contents({'a': content_a, 'b': content_b})
         print("Displaying split content on Matrix A and B")
     
     def clear_matrix(self, matrix='both'):
-        black = Image.new('RGB', (self.width, self.height), (0, 0, 0))
-        content = {'type': 'static', 'image': black}
-        if matrix == 'a' or matrix == 'both':
-            self.set_content('a', content)
-        if matrix == 'b' or matrix == 'both':
-            self.set_content('b', content)
+        content = MatrixContent.from_image(Image.new('RGB', (self.width, self.height), (0, 0, 0)))
+        self.set_contents({m: content for m in ('a', 'b') if matrix in (m, 'both')})
         print(f"Cleared matrix {matrix}")
 
+    def get_current_frame_index(self, content):
+        return content.frame_index()
+
     def get_current_frame(self, content):
-        if content['type'] == 'static':
-            return content['image']
-        elif content['type'] == 'animation':
-            elapsed = time.time() - content['start_time']
-            total_duration = sum(content['durations'])
-            if total_duration == 0: return content['frames'][0]
-            
-            loop_time = elapsed % total_duration
-            current_time = 0
-            for i, duration in enumerate(content['durations']):
-                current_time += duration
-                if current_time > loop_time:
-                    return content['frames'][i]
-            return content['frames'][0]
-        return Image.new('RGB', (64, 64), (0, 0, 0))
+        return content.image(content.frame_index())
+
+    def mark_seen(self, matrix):
+        # Update last seen timestamp (shared with the other workers)
+        now = time.time()
+        if now - self.last_seen[matrix] > self.SEEN_INTERVAL:
+            self.last_seen[matrix] = now
+            self.store.touch(self._key(f'matrix_{matrix}'))
+
+    @serve_seconds.timed
+    def get_frame_bytes(self, matrix='a', content=None):
+        """
+        Returns the pre-encoded (png_bytes, etag) of the current frame, of
+        content if the caller already fetched the matrix's content.
+        """
+        self.mark_seen(matrix)
+        content = content or self.get_content(matrix)
+        return content.encoded(content.frame_index())
+
+    @serve_seconds.timed
+    def get_raw_frame_bytes(self, matrix='a', pixel_format='rgb888', content=None):
+        """Returns the precomputed (raw_bytes, etag) of the current frame in the panel layout."""
+        self.mark_seen(matrix)
+        content = content or self.get_content(matrix)
+        return content.raw_frame(content.frame_index(), pixel_format)
+
+    @serve_seconds.timed
+    def get_frame_pair(self, pixel_format='png', now=None):
+        """
+        Returns the frames of A and B for the same instant (now by default)
+        as {matrix: (content, index, data, etag)}, PNG-encoded or raw in the
+        panel layout.
+        """
+        now = time.time() if now is None else now
+        frames = {}
+        for matrix in ('a', 'b'):
+            self.mark_seen(matrix)
+            content = self.get_content(matrix)
+            index = content.frame_index(now)
+            if pixel_format == 'png':
+                data, etag = content.encoded(index)
+            else:
+                data, etag = content.raw_frame(index, pixel_format)
+            frames[matrix] = (content, index, data, etag)
+        return frames
 
     def get_image_bytes(self, matrix='a'):
-        # Update last seen timestamp
-        self.last_seen[matrix] = time.time()
-        
-        content = self.content_a if matrix == 'a' else self.content_b
-        img = self.get_current_frame(content)
-        
-        img_io = io.BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        return img_io
+        data, _ = self.get_frame_bytes(matrix)
+        return io.BytesIO(data)
     
     def get_status(self):
         now = time.time()
         # Consider connected if seen within last 10 seconds
-        connected_a = (now - self.last_seen['a']) < 10
-        connected_b = (now - self.last_seen['b']) < 10
+        connected_a = (now - self.store.last_touched(self._key('matrix_a'))) < 10
+        connected_b = (now - self.store.last_touched(self._key('matrix_b'))) < 10
         return {'a': connected_a, 'b': connected_b}
 
-controller = MatrixController()
+class Display:
+    """
+    Everything the server keeps for one client: its matrix content, change
+    notifications and cached settings. All of it lives in the shared store
+    under the client's key prefix, so any worker can build the same Display.
+    """
 
-def process_content_from_path(temp_path, filename):
-    """Processes a file from a path and returns a content dict."""
-    filename = filename.lower()
-    
-    try:
-        if filename.endswith(('.mp4', '.avi', '.mov', '.mkv')):
-            # Video processing using imageio
-            reader = imageio.get_reader(temp_path)
-            meta = reader.get_meta_data()
-            fps = meta.get('fps', 30)
-            duration_per_frame = 1.0 / fps
-            
-            frames = []
-            durations = []
-            
-            # Limit frames to prevent memory explosion (e.g., max 100 frames or 5 seconds)
-            max_frames = 150 
-            count = 0
-            
-            for frame in reader:
-                if count >= max_frames: break
-                # Convert numpy array to PIL Image
-                img = Image.fromarray(frame)
-                frames.append(img)
-                durations.append(duration_per_frame)
-                count += 1
-            
-            reader.close()
-            
-            if not frames:
-                raise Exception("No frames found in video")
-                
-            return {
-                'type': 'animation',
-                'frames': frames,
-                'durations': durations
-            }
-
-        elif filename.endswith('.gif'):
-            # GIF processing using Pillow
-            img = Image.open(temp_path)
-            
-            if getattr(img, "is_animated", False):
-                frames = []
-                durations = []
-                for frame in ImageSequence.Iterator(img):
-                    frames.append(frame.convert('RGB'))
-                    # GIF duration is in milliseconds
-                    durations.append(frame.info.get('duration', 100) / 1000.0)
-                
-                return {
-                    'type': 'animation',
-                    'frames': frames,
-                    'durations': durations
-                }
-            else:
-                return {
-                    'type': 'static',
-                    'image': img.convert('RGB')
-                }
-        else:
-            # Standard Image
-            img = Image.open(temp_path)
-            return {
-                'type': 'static',
-                'image': img.convert('RGB')
-            }
-            
-    except Exception as e:
-        print(f"Error processing file: {e}")
-        raise e
+    def __init__(self, client_id, store):
+        self.client_id = client_id
+        # The default client keeps the un-prefixed keys of single-Pi setups
+        self.prefix = '' if client_id == DEFAULT_CLIENT else f'client_{client_id}_'
+        self.telemetry_key = f'{self.prefix}telemetry'
+        self.notifier = ChangeNotifier(store, key=f'{self.prefix}change_versions')
+        self.settings = SettingsCache(self.notifier, client_id)
+        self.controller = MatrixController(store, content_snapshots, self.notifier, prefix=self.prefix)
+        self.canvas = DrawCanvas(store, f'{self.prefix}draw_canvas')
+
+displays = {}
+displays_lock = threading.Lock()
+
+def get_display(client_id=None):
+    """
+    Returns the Display of a registered client, creating it on first use;
+    raises ValueError for bad or unknown IDs (nothing is stored for them).
+    """
+    client_id = client_id or DEFAULT_CLIENT
+    display = displays.get(client_id)
+    if display is not None:
+        return display
+    if not CLIENT_ID_PATTERN.match(client_id):
+        raise ValueError(f'Invalid client ID: {client_id}')
+    if not ClientSettings.is_registered(client_id):
+        raise ValueError(f'Unknown client: {client_id}')
+    with displays_lock:
+        if client_id not in displays:
+            display = Display(client_id, shared_store)
+            display.controller.init_content()
+            if client_id != DEFAULT_CLIENT and not shared_store.read(display.controller._key('panel_layout')):
+                # Same starting point as the settings copied in ClientSettings.get_settings
+                layout = controller.get_layout()
+                display.controller.set_layout(layout['panel_size'], layout['rotation']['a'], layout['rotation']['b'])
+            displays[client_id] = display
+        return displays[client_id]
+
+# The default client's objects, for single-Pi code paths (its content is
+# initialized by start_background_work)
+default_display = displays[DEFAULT_CLIENT] = Display(DEFAULT_CLIENT, shared_store)
+controller = default_display.controller
+notifier = default_display.notifier
+settings_cache = default_display.settings
+
+def check_client_id(client_id):
+    """Aborts the request with a 400 for malformed client IDs and a 404 for unregistered ones."""
+    if not CLIENT_ID_PATTERN.match(client_id):
+        response = jsonify({'error': f'Invalid client ID: {client_id}'})
+        response.status_code = 400
+        abort(response)
+    if client_id not in displays and not ClientSettings.is_registered(client_id):
+        response = jsonify({'error': f'Unknown client: {client_id}'})
+        response.status_code = 404
+        abort(response)
+    return client_id
+
+def request_client_id():
+    """Client a request is for: X-Client-ID header, then ?client= or form field."""
+    return check_client_id(request.headers.get('X-Client-ID') or request.values.get('client') or DEFAULT_CLIENT)
+
+def request_display():
+    return get_display(request_client_id())
+
+def request_client_ids():
+    """
+    Clients an upload is aimed at: the 'clients' field, either 'all' or a
+    comma-separated list of IDs, falling back to the request's own client.
+    """
+    value = request.values.get('clients', '').strip()
+    if value == 'all':
+        return ClientSettings.client_ids()
+    if not value:
+        return [request_client_id()]
+    return [check_client_id(c) for c in dict.fromkeys(c.strip() for c in value.split(',') if c.strip())]
+
+# Live uploads up to this size are decoded and pushed from memory; larger
+# ones (and all videos, which ffmpeg reads from a file) are spilled to disk
+LIVE_SPOOL_SIZE = 8 * 1024 * 1024
 
 def process_upload(file_storage):
-    """Legacy wrapper for process_content_from_path"""
-    filename = file_storage.filename.lower()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp:
-        file_storage.save(temp.name)
-        temp_path = temp.name
-    
+    """Legacy wrapper for process_content"""
+    upload = UploadBuffer(file_storage.stream, file_storage.filename,
+                          0 if sd_transcode.is_video(file_storage.filename) else LIVE_SPOOL_SIZE)
     try:
-        return process_content_from_path(temp_path, filename)
+        with decode_seconds.time():
+            return process_content(upload.source(), upload.filename)
     finally:
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
+        upload.close()
 
 # --- Auth Routes ---
 @app.route('/register', methods=['GET', 'POST'])
@@ -471,23 +967,130 @@ def get_matrix_image(a):
     # Assuming Pi is on local network or we don't want to complicate Pi setup yet.
     if a not in ['a', 'b']:
         return jsonify({'error': 'Invalid matrix identifier. Use "a" or "b".'}), 400
-    return send_file(controller.get_image_bytes(a), mimetype='image/png')
+    controller = request_display().controller
+
+    # Raw panel bytes via ?format=rgb888|rgb565 or Accept: application/octet-stream
+    pixel_format = request.args.get('format')
+    if pixel_format is None and request.accept_mimetypes.best_match(
+            ['image/png', 'application/octet-stream']) == 'application/octet-stream':
+        pixel_format = 'rgb888'
+
+    # One content for the body and the headers, even if it changes meanwhile
+    content = controller.get_content(a)
+    if pixel_format is None or pixel_format == 'png':
+        data, etag = controller.get_frame_bytes(a, content)
+        mimetype = 'image/png'
+    elif pixel_format in MatrixContent.RAW_FORMATS:
+        data, etag = controller.get_raw_frame_bytes(a, pixel_format, content)
+        mimetype = 'application/octet-stream'
+    else:
+        return jsonify({'error': 'Invalid format. Use "png", "rgb888" or "rgb565".'}), 400
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(data, mimetype=mimetype)
+    if mimetype == 'application/octet-stream':
+        (width, height), _ = content.raw_layout
+        response.headers['X-Frame-Width'] = str(width)
+        response.headers['X-Frame-Height'] = str(height)
+        response.headers['X-Pixel-Format'] = pixel_format
+    response.headers['X-Content-Version'] = content.version
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/matrix/<a>/bundle', methods=['GET'])
+def get_matrix_bundle(a):
+    """
+    Whole current content of a matrix (all frames and durations) in one
+    container, so the Pi can download it once and play it locally.
+    """
+    if a not in ['a', 'b']:
+        return jsonify({'error': 'Invalid matrix identifier. Use "a" or "b".'}), 400
+    pixel_format = request.args.get('format', 'png')
+    if pixel_format != 'png' and pixel_format not in MatrixContent.RAW_FORMATS:
+        return jsonify({'error': 'Invalid format. Use "png", "rgb888" or "rgb565".'}), 400
+    controller = request_display().controller
+
+    controller.mark_seen(a)
+    content = controller.get_content(a)
+    etag = content.bundle_etag(pixel_format)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(content.bundle(pixel_format), mimetype='application/octet-stream')
+    response.headers['X-Content-Version'] = content.version
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/matrix/<a>/version', methods=['GET'])
+def get_matrix_version(a):
+    """Cheap check for whether a downloaded bundle is still current."""
+    if a not in ['a', 'b']:
+        return jsonify({'error': 'Invalid matrix identifier. Use "a" or "b".'}), 400
+    controller = request_display().controller
+    controller.mark_seen(a)
+    content = controller.get_content(a)
+    return jsonify({
+        'version': content.version,
+        'type': content.type,
+        'frame_count': content.frame_count,
+        'start_time': content.start_time
+    })
+
+@app.route('/api/matrix/frames', methods=['GET'])
+def get_matrix_frames():
+    """
+    The frames of A and B for the same instant in one container, so the
+    two halves of a split animation never show different frame indices.
+    ?at=<server timestamp> picks the instant, so the Pi can fetch a pair
+    ahead of time and show it exactly when it is due.
+    """
+    pixel_format = request.args.get('format', 'png')
+    if pixel_format != 'png' and pixel_format not in MatrixContent.RAW_FORMATS:
+        return jsonify({'error': 'Invalid format. Use "png", "rgb888" or "rgb565".'}), 400
+    try:
+        now = float(request.args['at']) if 'at' in request.args else time.time()
+    except ValueError:
+        return jsonify({'error': 'Invalid at. Use a Unix timestamp.'}), 400
+    frames = request_display().controller.get_frame_pair(pixel_format, now)
+
+    etag = '+'.join(etag for _, _, _, etag in frames.values())
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(MatrixContent.pack_frames(frames, now, pixel_format),
+                                      mimetype='application/octet-stream')
+    response.headers['X-Server-Time'] = repr(time.time())
+    response.set_etag(etag)
+    return response
+
+@app.route('/api/time', methods=['GET'])
+def get_server_time():
+    """
+    The server's clock, which all start_time values refer to. The Pi
+    estimates its offset from it NTP-style (time minus the midpoint of
+    its request's send and receive times) and plays content on the
+    corrected clock.
+    """
+    return jsonify({'time': time.time()})
 
 @app.route('/api/status', methods=['GET'])
 @login_required
 def get_status():
-    return jsonify(controller.get_status())
+    return jsonify(request_display().controller.get_status())
 
 @app.route('/api/clear', methods=['POST'])
 @approval_required
 def handle_clear():
-    controller.clear_matrix()
+    for client_id in request_client_ids():
+        get_display(client_id).controller.clear_matrix()
     return jsonify({'status': 'success', 'message': 'Matrices cleared'})
 
 @app.route('/api/draw', methods=['POST'])
 @approval_required
 def handle_draw():
-    temp_path = None
+    display = request_display()
     try:
         data = request.json
         image_data = data.get('image') # Base64 string
@@ -503,54 +1106,178 @@ def handle_draw():
         image = Image.open(io.BytesIO(image_bytes))
         
         # The drawing canvas is treated as "Split" mode (spanning both)
-        controller.display_split(image)
-        
-        # Push to client
-        fd, temp_path = tempfile.mkstemp(suffix='.png')
-        os.close(fd)
-        image.save(temp_path, format='PNG')
+        display.controller.display_split(image)
+        # Later deltas from /api/draw/delta apply on top of this image
+        display.canvas.set_image(image)
         
-        client_ip = get_client_ip()
+        # Push to client, straight from the request's bytes when they are a PNG already
+        client_ip = get_client_ip(display.client_id)
 
         if client_ip:
-            push_live_content_to_client('split', client_ip, temp_path, 'drawing.png')
+            if image.format != 'PNG':
+                buffer = io.BytesIO()
+                image.save(buffer, format='PNG')
+                image_bytes = buffer.getvalue()
+            client_comm.push_live_content('split', client_ip, io.BytesIO(image_bytes), 'drawing.png')
 
         return jsonify({'status': 'success', 'message': 'Drawing displayed'})
     except Exception as e:
         print(f"Error in draw: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        if temp_path and os.path.exists(temp_path):
+
+# Matrix content is re-rendered from the draw canvas at most this often per
+# client, so a fast stroke doesn't re-encode the panels for every delta
+DRAW_PUBLISH_INTERVAL = 0.2
+draw_publish_pending = set()
+draw_publish_lock = threading.Lock()
+
+def publish_draw_canvas(client_id):
+    with draw_publish_lock:
+        draw_publish_pending.discard(client_id)
+    display = get_display(client_id)
+    try:
+        _, pixels = display.canvas.get()
+        half_a, half_b = frame_ops.split_halves(pixels[np.newaxis])
+        display.controller.set_contents({'a': MatrixContent.from_image(frame_ops.to_image(half_a[0])),
+                                         'b': MatrixContent.from_image(frame_ops.to_image(half_b[0]))})
+    except Exception as e:
+        print(f"Error publishing drawing: {e}")
+
+def schedule_draw_publish(client_id):
+    """Publishes the client's draw canvas as matrix content after DRAW_PUBLISH_INTERVAL."""
+    with draw_publish_lock:
+        if client_id in draw_publish_pending:
+            return
+        draw_publish_pending.add(client_id)
+    timer = threading.Timer(DRAW_PUBLISH_INTERVAL, publish_draw_canvas, args=(client_id,))
+    timer.daemon = True
+    timer.start()
+
+@app.route('/api/draw/delta', methods=['POST'])
+@approval_required
+def handle_draw_delta():
+    """
+    Applies dirty rectangles or pixel runs to the client's draw canvas and
+    forwards just those to the Pi. No image is decoded or written to disk;
+    the matrix content other clients see is published shortly after.
+    """
+    display = request_display()
+    try:
+        seq, clipped = display.canvas.apply(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        schedule_draw_publish(display.client_id)
+
+        pushed = False
+        client_ip = get_client_ip(display.client_id)
+        if client_ip and (clipped['rects'] or clipped['runs']):
+            delta = dict(clipped, seq=seq, width=DrawCanvas.WIDTH, height=DrawCanvas.HEIGHT)
+            pushed = client_comm.push_draw_delta(client_ip, delta)
+            if pushed is None:
+                # The Pi predates delta drawing: send it the whole canvas instead
+                _, pixels = display.canvas.get()
+                buffer = io.BytesIO()
+                frame_ops.to_image(pixels).save(buffer, format='PNG')
+                buffer.seek(0)
+                pushed = client_comm.push_live_content('split', client_ip, buffer, 'drawing.png')
+
+        return jsonify({'status': 'success', 'seq': seq, 'pushed': pushed})
+    except Exception as e:
+        print(f"Error in draw delta: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def close_uploads(uploads):
+    for upload in uploads:
+        if upload:
+            upload.close()
+
+def remove_temp_files(paths):
+    for path in paths:
+        if path and os.path.exists(path):
             try:
-                os.remove(temp_path)
+                os.remove(path)
             except:
                 pass
 
-def push_live_content_to_client(mode, client_ip, path_a, filename_a, path_b=None, filename_b=None):
-    """Pushes live content to the client for immediate playback."""
-    url = f"http://{client_ip}:5000/api/live/upload"
-    try:
-        files = {}
-        if path_a:
-            files['file_a'] = (filename_a, open(path_a, 'rb'))
-        if path_b:
-            files['file_b'] = (filename_b, open(path_b, 'rb'))
-            
-        data = {'mode': mode}
-        print(f"Pushing live content to {url}")
-        requests.post(url, files=files, data=data, timeout=5)
-        
-        # Close files
-        for f in files.values():
-            f[1].close()
-            
-    except Exception as e:
-        print(f"Error pushing live content: {e}")
+def decode_for_mode(mode, sources, video_options):
+    """
+    Decodes the file(s) of an upload for a display mode and returns
+    (content_a, content_b). sources are (path or bytes, filename) pairs,
+    two of them in 'separate' mode, where A and B are decoded in parallel
+    on the decode pool. In 'both' mode A and B share one read-only
+    MatrixContent.
+    """
+    if mode == 'separate':
+        content_a, content_b = decode_pool.run_all(decode_content, [
+            (source, filename, (64, 64), video_options['max_frames'], video_options['fps'])
+            for source, filename in sources])
+        return content_a, content_b
+    source, filename = sources[0]
+    if mode == 'split':
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        return controller.build_split(process_content(source, filename, (128, 64), **video_options))
+    content = decode_content(source, filename, **video_options)
+    return content, content
+
+def mode_contents(mode, content_a, content_b):
+    """{matrix: content} for the matrices a display mode covers."""
+    contents = {}
+    if mode != 'matrix_b':
+        contents['a'] = content_a
+    if mode != 'matrix_a':
+        contents['b'] = content_b
+    return contents
+
+def render_playlist_item(client_id, item):
+    """Decodes a playlist item's files for PlaylistEngine, like a live upload of them."""
+    with app.app_context():
+        settings = get_display(client_id).settings.get()
+    video_options = {'max_frames': settings['live_max_frames'], 'fps': settings['live_video_fps']}
+    sources = [(sd_assets.blob_path(f['sha256']), f['filename']) for f in item['files']]
+    with decode_seconds.time():
+        return mode_contents(item['mode'], *decode_for_mode(item['mode'], sources, video_options))
+
+def run_upload_job(job, mode, client_ids, client_ips, upload_a, upload_b, video_options):
+    """
+    Background part of /api/upload: push to the clients, decode, display.
+
+    The upload is decoded and resized once however many clients it is
+    aimed at; every client's controller then only renders the raw frames
+    for its panel layout (shared between clients with the same layout).
+    Pushes to the clients run concurrently with the decode, every one
+    reading the same upload buffers as the decoder.
+    """
+    pushes = client_comm.fan_out(client_ips, lambda client_ip: client_comm.push_live_content(
+        mode, client_ip, upload_a.open(), upload_a.filename,
+        upload_b.open() if upload_b else None, upload_b.filename if upload_b else None))
+    job.progress(0.1)
+
+    with job.stage('decode'), decode_seconds.time():
+        content_a, content_b = decode_for_mode(mode, [(upload.path or upload.data, upload.filename)
+                                                      for upload in (upload_a, upload_b) if upload], video_options)
+    job.progress(0.7)
+
+    with job.stage('display'):
+        # One playback clock for both matrices of every target client
+        start_time = time.time()
+        contents = mode_contents(mode, content_a, content_b)
+        for client_id in client_ids:
+            get_display(client_id).controller.set_contents(contents, start_time)
+    job.progress(0.9)
+
+    with job.stage('push'):
+        failed = [ip for ip, future in pushes.items() if not future.result()]
+
+    job.set_result(message=f'Uploaded in {mode} mode to {len(client_ids)} client(s)',
+                   clients=client_ids, push_failed=failed)
 
 @app.route('/api/upload', methods=['POST'])
 @approval_required
 def handle_upload():
-    temp_paths = []
+    uploads = []
+    request_client_ids() # Reject bad client IDs before touching the files
     try:
         mode = request.form.get('mode')
         file_a = request.files.get('file_a')
@@ -558,68 +1285,52 @@ def handle_upload():
         
         if not mode:
             return jsonify({'error': 'Mode not specified'}), 400
-
-        # Helper to save temp file
-        def save_temp(f):
-            if not f: return None, None
-            filename = f.filename
-            fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
-            os.close(fd)
-            f.save(path)
-            temp_paths.append(path)
-            return path, filename
-
-        path_a, filename_a = save_temp(file_a)
-        path_b, filename_b = save_temp(file_b)
-
-        # Push to client if connected (or use last known IP)
-        client_ip = get_client_ip()
-
-        if client_ip:
-            # We run this synchronously to ensure files exist, or we could thread it if we manage cleanup carefully.
-            # Given the user wants to "post it", blocking briefly is acceptable.
-            push_live_content_to_client(mode, client_ip, path_a, filename_a, path_b, filename_b)
-
-        if mode == 'separate':
-            if not path_a or not path_b:
-                return jsonify({'error': 'Both files required for separate mode'}), 400
-            
-            content_a = process_content_from_path(path_a, filename_a)
-            content_b = process_content_from_path(path_b, filename_b)
-            controller.display_on_a(content_a)
-            controller.display_on_b(content_b)
-            
-        else:
-            if not path_a:
-                return jsonify({'error': 'File required'}), 400
-            
-            content = process_content_from_path(path_a, filename_a)
-            
-            if mode == 'matrix_a':
-                controller.display_on_a(content)
-            elif mode == 'matrix_b':
-                controller.display_on_b(content)
-            elif mode == 'both':
-                controller.display_on_a(content)
-                controller.display_on_b(content)
-            elif mode == 'split':
-                controller.display_split(content)
-            else:
-                return jsonify({'error': 'Invalid mode'}), 400
-
-        return jsonify({'status': 'success', 'message': f'Uploaded in {mode} mode'})
+        if mode not in ('matrix_a', 'matrix_b', 'both', 'split', 'separate'):
+            return jsonify({'error': 'Invalid mode'}), 400
+        if mode == 'separate' and (not file_a or not file_b):
+            return jsonify({'error': 'Both files required for separate mode'}), 400
+        if not file_a:
+            return jsonify({'error': 'File required'}), 400
+
+        # Helper to buffer an uploaded file (in memory unless it is large or a video)
+        def buffer_upload(f):
+            if not f: return None
+            upload = UploadBuffer(f.stream, f.filename, 0 if sd_transcode.is_video(f.filename) else LIVE_SPOOL_SIZE)
+            uploads.append(upload)
+            return upload
+
+        upload_a = buffer_upload(file_a)
+        upload_b = buffer_upload(file_b)
+
+        # Decoded once for all target clients, with the first client's video options
+        client_ids = request_client_ids()
+        settings = get_display(client_ids[0]).settings.get()
+        video_options = {'max_frames': settings['live_max_frames'], 'fps': settings['live_video_fps']}
+        # Push to the clients if connected (or use last known IPs)
+        client_ips = [ip for ip in (get_client_ip(c) for c in client_ids) if ip]
+
+        # Decoding and pushing happen on the job pool; the job owns the buffers
+        owned = list(uploads)
+        job_id = jobs.submit('upload', run_upload_job, mode, client_ids, client_ips, upload_a, upload_b,
+                             video_options, cleanup=lambda: close_uploads(owned))
+        uploads.clear()
+
+        return jsonify({'status': 'accepted', 'job_id': job_id, 'message': f'Upload in {mode} mode queued'}), 202
         
     except Exception as e:
         print(f"Error in upload: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        # Cleanup temp files
-        for path in temp_paths:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except:
-                    pass
+        # Cleanup buffers not handed over to a job
+        close_uploads(uploads)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 # --- Client API Routes ---
 
@@ -628,79 +1339,122 @@ def receive_telemetry():
     """
     Endpoint for the Raspberry Pi to report its status.
     """
-    global latest_telemetry
+    client_id = request_client_id()
     try:
         data = request.json
         # Add timestamp
         data['last_seen'] = time.time()
-        latest_telemetry = data
+        set_latest_telemetry(data, client_id)
         
-        # Update database with latest telemetry info
-        if 'network' in data and 'ip' in data['network']:
-            settings = ClientSettings.get_settings()
-            settings.last_ip = data['network']['ip']
-            if 'ssid' in data['network']:
-                settings.last_ssid = data['network']['ssid']
-            if 'type' in data['network']:
-                settings.last_network_type = data['network']['type']
-            if 'refresh_rate' in data:
-                settings.last_refresh_rate = float(data.get('refresh_rate', 0))
-            settings.last_seen = data['last_seen']
-            db.session.commit()
+        # History and the persisted last_* fields are written behind in batches
+        telemetry_buffer.append(data, client_id)
         
         # We could optionally return the new config here if we wanted to combine calls
         return jsonify({'status': 'success'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+# Seconds between keep-alive comments on an idle event stream
+EVENT_KEEPALIVE = 15
+# Open event streams per worker. Each one holds a gthread for as long as it
+# is connected, so this stays well below --threads in deploy/lemona.service;
+# further clients get a 204 and use /api/events/poll instead
+MAX_EVENT_STREAMS = 4
+event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+def change_events(state, since):
+    """Yields (event, data) for everything in a change state that changed after seq since."""
+    for matrix in ('a', 'b'):
+        if state['content_seq'][matrix] > since:
+            yield 'content', {'matrix': matrix, 'version': state['content'][matrix], 'seq': state['seq']}
+    # States written before settings_seq existed: report settings to be safe
+    if state.get('settings_seq', state['seq']) > since:
+        yield 'settings', {'version': state['settings'], 'seq': state['seq']}
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events stream the Pi opens outbound. Emits 'content' events
+    (matrix, version) and 'settings' events (version) as soon as they change.
+    Returns 204 when this worker already holds MAX_EVENT_STREAMS streams.
+    """
+    since = request.headers.get('Last-Event-ID', type=int)
+    notifier = request_display().notifier
+    if not event_streams.acquire(blocking=False):
+        return app.response_class(status=204)
+
+    def generate():
+        state = notifier.current()
+        yield f"id: {state['seq']}\nevent: state\ndata: {json.dumps(state)}\n\n"
+        last_seq = state['seq']
+        if since is not None:
+            # Replay what changed while the client was disconnected
+            for event, data in change_events(state, since):
+                yield f"id: {state['seq']}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+        while True:
+            state = notifier.wait(last_seq, EVENT_KEEPALIVE)
+            if state['seq'] <= last_seq:
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in change_events(state, last_seq):
+                yield f"id: {state['seq']}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            last_seq = state['seq']
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the stream
+    # Runs when the server closes the response, even if it was never iterated
+    response.call_on_close(event_streams.release)
+    return response
+
+@app.route('/api/events/poll', methods=['GET'])
+def poll_events():
+    """
+    Long-poll fallback: returns the change state as soon as its seq is
+    past ?since=, or after ?timeout= seconds (max 60) with changed=false.
+    """
+    since = request.args.get('since', default=-1, type=int)
+    timeout = min(max(request.args.get('timeout', default=25.0, type=float), 0.0), 60.0)
+    state = request_display().notifier.wait(since, timeout)
+    return jsonify(dict(state, changed=state['seq'] > since))
+
 @app.route('/api/client-config', methods=['GET'])
 def get_client_config():
     """
     Endpoint for the Raspberry Pi to fetch its configuration.
     """
+    display = request_display()
+    client_id = display.client_id
     # Update telemetry/online status from this heartbeat
     try:
         client_ip = request.remote_addr
         now = time.time()
+        previous_ip = get_latest_telemetry(client_id).get('network', {}).get('ip')
         
-        # Update global telemetry
-        global latest_telemetry
-        if 'network' not in latest_telemetry:
-            latest_telemetry['network'] = {}
+        # Update shared telemetry
+        latest_telemetry = get_latest_telemetry(client_id)
+        latest_telemetry['network'] = dict(latest_telemetry.get('network', {}))
         
         latest_telemetry['network']['ip'] = client_ip
         latest_telemetry['last_seen'] = now
         latest_telemetry['timestamp'] = now # Ensure age calculation works
+        set_latest_telemetry(latest_telemetry, client_id)
         
-        # Update database
-        settings = ClientSettings.get_settings()
-        settings.last_ip = client_ip
-        settings.last_seen = now
-        db.session.commit()
+        # Update database, coalesced to one commit per HEARTBEAT_FLUSH_INTERVAL
+        if client_ip != previous_ip or now - heartbeat_state.get(client_id, 0.0) >= HEARTBEAT_FLUSH_INTERVAL:
+            settings = ClientSettings.get_settings(client_id)
+            settings.last_ip = client_ip
+            settings.last_seen = now
+            with client_config_commit_seconds.time():
+                db.session.commit()
+            heartbeat_state[client_id] = now
     except Exception as e:
         print(f"Error updating telemetry from config fetch: {e}")
 
-    settings = ClientSettings.get_settings()
-    return jsonify({
-        'polling_rate': settings.polling_rate,
-        'gpio_slowdown': settings.gpio_slowdown,
-        'hardware_pulsing': settings.hardware_pulsing,
-        'brightness': settings.brightness,
-        'position_1': settings.position_1,
-        'position_2': settings.position_2,
-        'request_send_rate': settings.request_send_rate,
-        'wifi_ssid': settings.wifi_ssid,
-        'wifi_password': settings.wifi_password,
-        # 'use_sd_card_fallback': settings.use_sd_card_fallback,
-        'matrix_rows': settings.matrix_rows,
-        'matrix_cols': settings.matrix_cols,
-        'matrix_chain': settings.matrix_chain,
-        'matrix_parallel': settings.matrix_parallel,
-        'matrix_pwm_lsb_nanoseconds': settings.matrix_pwm_lsb_nanoseconds,
-        'sd_slide_duration': settings.sd_slide_duration,
-        'sd_video_fps': settings.sd_video_fps,
-        'sd_playlist_refresh_rate': settings.sd_playlist_refresh_rate
-    })
+    settings = display.settings.get()
+    response = jsonify({field: settings[field] for field in CLIENT_CONFIG_FIELDS})
+    response.set_etag(display.settings.etag)
+    return response.make_conditional(request)
 
 # --- Admin Settings Routes ---
 
@@ -710,7 +1464,9 @@ def get_admin_settings():
     """
     Endpoint for the Web UI to get current settings.
     """
-    settings = ClientSettings.get_settings()
+    display = request_display()
+    settings = display.settings.get()
+    latest_telemetry = get_latest_telemetry(display.client_id)
     
     # Calculate telemetry age
     telemetry_age = None
@@ -718,39 +1474,138 @@ def get_admin_settings():
         telemetry_age = time.time() - latest_telemetry['timestamp']
         
     return jsonify({
-        'settings': {
-            'polling_rate': settings.polling_rate,
-            'gpio_slowdown': settings.gpio_slowdown,
-            'hardware_pulsing': settings.hardware_pulsing,
-            'brightness': settings.brightness,
-            'position_1': settings.position_1,
-            'position_2': settings.position_2,
-            'request_send_rate': settings.request_send_rate,
-            'wifi_ssid': settings.wifi_ssid,
-            'wifi_password': settings.wifi_password,
-            # 'use_sd_card_fallback': settings.use_sd_card_fallback,
-            'matrix_rows': settings.matrix_rows,
-            'matrix_cols': settings.matrix_cols,
-            'matrix_chain': settings.matrix_chain,
-            'matrix_parallel': settings.matrix_parallel,
-            'matrix_pwm_lsb_nanoseconds': settings.matrix_pwm_lsb_nanoseconds,
-            'sd_slide_duration': settings.sd_slide_duration,
-            'sd_video_fps': settings.sd_video_fps,
-            'sd_playlist_refresh_rate': settings.sd_playlist_refresh_rate
-        },
+        'client_id': display.client_id,
+        'settings': {field: settings[field] for field in ADMIN_SETTINGS_FIELDS},
         'telemetry': latest_telemetry,
         'telemetry_age': telemetry_age
     })
 
+@app.route('/api/admin/telemetry', methods=['GET'])
+@admin_required
+def get_telemetry_history():
+    """
+    Telemetry history. ?since= is a unix timestamp (default: last 24h);
+    ?step= is the bucket size in seconds, rounded to whole minutes and
+    served from the per-minute rollups, or 'raw' for individual samples.
+    ?client= selects the client (default: 'default'). Only this worker's
+    buffer is flushed first, so reports other workers received in the last
+    TelemetryBuffer.FLUSH_INTERVAL seconds may be missing.
+    """
+    client_id = request_client_id()
+    try:
+        since = request.args.get('since', default=time.time() - 86400, type=float)
+        step = request.args.get('step', '60')
+        telemetry_buffer.flush()
+
+        if step == 'raw':
+            samples = (TelemetrySample.query
+                       .filter(TelemetrySample.client_id == client_id, TelemetrySample.timestamp >= since)
+                       .order_by(TelemetrySample.timestamp)
+                       .limit(10000).all())
+            return jsonify({'step': 'raw', 'points': [{
+                't': s.timestamp,
+                'ip': s.ip,
+                'ssid': s.ssid,
+                'network_type': s.network_type,
+                'refresh_rate': s.refresh_rate
+            } for s in samples]})
+
+        step = max(60, int(float(step)) // 60 * 60)
+        bucket = TelemetryRollup.minute - TelemetryRollup.minute % step
+        rows = (db.session.query(
+                    bucket.label('t'),
+                    db.func.sum(TelemetryRollup.count),
+                    db.func.sum(TelemetryRollup.refresh_sum),
+                    db.func.sum(TelemetryRollup.refresh_count),
+                    db.func.min(TelemetryRollup.refresh_min),
+                    db.func.max(TelemetryRollup.refresh_max))
+                .filter(TelemetryRollup.client_id == client_id, TelemetryRollup.minute >= int(since // 60) * 60)
+                .group_by('t').order_by('t').all())
+        return jsonify({'step': step, 'points': [{
+            't': t,
+            'count': count,
+            'refresh_rate_avg': refresh_sum / refresh_count if refresh_count else None,
+            'refresh_rate_min': refresh_min,
+            'refresh_rate_max': refresh_max
+        } for t, count, refresh_sum, refresh_count, refresh_min, refresh_max in rows]})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/admin/client-metrics', methods=['GET'])
+@admin_required
+def get_client_metrics():
+    """
+    Latency and error counters for calls from this worker to the Pi.
+    """
+    return jsonify(client_comm.get_metrics())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage latencies, DB commits and Pi calls of all workers, in the Prometheus text format."""
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/admin/transfers', methods=['GET'])
+@admin_required
+def get_sd_transfers():
+    """
+    Chunked SD pushes, running and recent, with progress and throughput.
+    """
+    transfers = []
+    for record in sd_transfers.all():
+        remaining = record['size'] - record['sent']
+        rate = record['bytes_per_second']
+        transfers.append(dict(record,
+            progress=record['sent'] / record['size'] if record['size'] else 1.0,
+            eta_seconds=remaining / rate if record['status'] == 'running' and rate > 0 else None))
+    return jsonify(transfers)
+
+@app.route('/api/admin/clients', methods=['GET'])
+@admin_required
+def get_clients():
+    """
+    All registered clients with their last known address and whether
+    they are fetching frames.
+    """
+    now = time.time()
+    clients = []
+    for client_id in ClientSettings.client_ids():
+        display = get_display(client_id)
+        settings = display.settings.get()
+        telemetry = get_latest_telemetry(client_id)
+        clients.append({
+            'client_id': client_id,
+            'ip': get_client_ip(client_id),
+            'last_seen': telemetry.get('last_seen', settings['last_seen']),
+            'age': now - telemetry['timestamp'] if 'timestamp' in telemetry else None,
+            'matrices': display.controller.get_status(),
+            'content': {m: display.controller.get_content(m).version for m in ('a', 'b')}
+        })
+    return jsonify(clients)
+
+@app.route('/api/admin/clients', methods=['POST'])
+@admin_required
+def register_client():
+    """Adds a client, so its Pi can fetch content and settings under its ID."""
+    data = request.get_json(silent=True)
+    client_id = (data.get('client_id') if isinstance(data, dict) else None) or request.values.get('client_id', '')
+    if not isinstance(client_id, str) or not CLIENT_ID_PATTERN.match(client_id):
+        return jsonify({'error': f'Invalid client ID: {client_id}'}), 400
+    _, created = ClientSettings.register(client_id)
+    get_display(client_id)
+    if not created:
+        return jsonify({'message': f'Client {client_id} already registered', 'client_id': client_id})
+    return jsonify({'message': f'Client {client_id} registered', 'client_id': client_id}), 201
+
 @app.route('/api/admin/settings', methods=['POST'])
 @admin_required
 def update_admin_settings():
     """
     Endpoint for the Web UI to update settings.
     """
+    display = request_display()
     try:
         data = request.json
-        settings = ClientSettings.get_settings()
+        settings = ClientSettings.get_settings(display.client_id)
         
         if 'polling_rate' in data:
             settings.polling_rate = float(data['polling_rate'])
@@ -787,8 +1642,12 @@ def update_admin_settings():
         if 'sd_slide_duration' in data: settings.sd_slide_duration = float(data['sd_slide_duration'])
         if 'sd_video_fps' in data: settings.sd_video_fps = float(data['sd_video_fps'])
         if 'sd_playlist_refresh_rate' in data: settings.sd_playlist_refresh_rate = float(data['sd_playlist_refresh_rate'])
+        if 'live_max_frames' in data: settings.live_max_frames = max(1, int(data['live_max_frames']))
+        if 'live_video_fps' in data: settings.live_video_fps = float(data['live_video_fps'])
             
         db.session.commit()
+        display.controller.set_layout((settings.matrix_cols, settings.matrix_rows), settings.position_1, settings.position_2)
+        display.notifier.publish('settings')
         
         # Prepare settings dict for push
         settings_dict = {
@@ -815,10 +1674,10 @@ def update_admin_settings():
             settings_dict['wifi_password'] = settings.wifi_password
         
         # Trigger push if client IP is known (check telemetry first, then DB)
-        client_ip = get_client_ip()
+        client_ip = get_client_ip(display.client_id)
             
         if client_ip:
-            threading.Thread(target=push_settings_to_client, args=(settings_dict, client_ip)).start()
+            client_comm.submit(client_comm.push_settings, settings_dict, client_ip)
             
         return jsonify({'message': 'Settings updated successfully'})
     except Exception as e:
@@ -828,29 +1687,28 @@ def update_admin_settings():
 @app.route('/api/sd/files', methods=['GET'])
 @login_required
 def list_sd_files():
+    """Lists a client's SD files from the server's index, without asking the Pi."""
+    index = sd_assets.index(get_display(request_client_id()).prefix)
+    return jsonify({
+        'files': sorted(index),
+        'entries': [dict(entry, filename=filename) for filename, entry in sorted(index.items())],
+        'source': 'index'
+    })
+
+# Panel rotations in degrees, as accepted for position_1/position_2
+SD_POSITIONS = (0, 90, 180, 270)
+
+def parse_sd_position(value):
+    """Returns a form's position as an int, or None when it was left empty; raises ValueError if invalid."""
+    if value is None or value == '':
+        return None
     try:
-        # Try to get client files first
-        client_ip = get_client_ip()
-        
-        if client_ip:
-            try:
-                url = f"http://{client_ip}:5000/api/sd/files"
-                resp = requests.get(url, timeout=3)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return jsonify({'files': data.get('files', []), 'source': 'client'})
-            except Exception as e:
-                print(f"Failed to fetch files from client: {e}")
-
-        # Fallback to local files
-        files = []
-        if os.path.exists(SD_UPLOAD_FOLDER):
-            for f in os.listdir(SD_UPLOAD_FOLDER):
-                if os.path.isfile(os.path.join(SD_UPLOAD_FOLDER, f)):
-                    files.append(f)
-        return jsonify({'files': files, 'source': 'local'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        position = int(value)
+    except ValueError:
+        position = None
+    if position not in SD_POSITIONS:
+        raise ValueError(f'Invalid position: {value}. Use one of 0, 90, 180 or 270.')
+    return position
 
 @app.route('/api/sd/upload', methods=['POST'])
 @login_required
@@ -859,45 +1717,126 @@ def upload_sd_file():
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     mode = request.form.get('mode', 'both') # Default to 'both' if not specified
-    pos1 = request.form.get('position_1')
-    pos2 = request.form.get('position_2')
+    try:
+        pos1 = parse_sd_position(request.form.get('position_1'))
+        pos2 = parse_sd_position(request.form.get('position_2'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    client_ids = request_client_ids()
+    transcode = request.form.get('transcode', 'false').lower() in ('1', 'true', 'on')
+    pixel_format = request.form.get('pixel_format', 'rgb565')
 
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
     if file:
-        filename = file.filename
-        filepath = os.path.join(SD_UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        filename = os.path.basename(file.filename)
+        if transcode and sd_transcode.is_video(filename):
+            if pixel_format not in sd_transcode.PIXEL_FORMATS:
+                return jsonify({'error': 'Invalid pixel_format. Use "rgb565" or "rgb888".'}), 400
+            return start_sd_transcode(file, filename, client_ids, mode, pos1, pos2, pixel_format)
+
+        # Stored once by content hash, however many names and clients use it
+        digest, size = sd_assets.add(file.stream, filename, [get_display(c).prefix for c in client_ids])
         
-        # Try to push to client if connected (or use last known IP)
-        client_ip = get_client_ip()
-
-        if client_ip:
-            threading.Thread(target=push_file_to_client, args=(filepath, filename, client_ip, mode, pos1, pos2)).start()
-            return jsonify({'message': 'File uploaded and push started'})
+        # Try to push to the clients if connected (or use last known IPs)
+        targets = [(c, get_client_ip(c)) for c in client_ids]
+        targets = [(c, ip) for c, ip in targets if ip]
+
+        if targets:
+            assets = [(filename, digest, sd_assets.blob_path(digest))]
+            job_id = jobs.submit('sd_upload', run_sd_push_job, targets, assets, mode, pos1, pos2)
+            return jsonify({'message': 'File uploaded and push started', 'job_id': job_id, 'sha256': digest}), 202
         
-        return jsonify({'message': 'File uploaded (Client not connected, stored locally)'})
+        return jsonify({'message': 'File uploaded (Client not connected, stored locally)', 'sha256': digest})
+
+def start_sd_transcode(file, filename, client_ids, mode, pos1, pos2, pixel_format):
+    """
+    Queues a video for transcoding into a pre-rendered frame file. Clients
+    are grouped by panel layout and sd_video_fps, so the video is transcoded
+    once per distinct layout rather than once per client.
+    """
+    fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    file.save(temp_path)
+
+    layouts = {}
+    for client_id in client_ids:
+        settings = get_display(client_id).settings.get()
+        positions = (settings['position_1'] if pos1 is None else pos1,
+                     settings['position_2'] if pos2 is None else pos2)
+        layout = ((settings['matrix_cols'], settings['matrix_rows']), settings['matrix_chain'],
+                  settings['sd_video_fps'], positions)
+        layouts.setdefault(layout, []).append((client_id, get_client_ip(client_id)))
+
+    job_id = jobs.submit('sd_transcode', run_sd_transcode_job, temp_path, filename, layouts, mode, pixel_format,
+                         cleanup=lambda: remove_temp_files([temp_path]))
+    return jsonify({'message': 'File uploaded, transcoding started', 'job_id': job_id}), 202
+
+def run_sd_transcode_job(job, src_path, filename, layouts, mode, pixel_format):
+    """Transcodes a video for each panel layout, stores the results and pushes them."""
+    name = sd_transcode.transcoded_name(filename)
+    targets = []
+    assets = {}
+    outputs = []
+    for i, (layout, clients) in enumerate(layouts.items()):
+        panel_size, chain, fps, positions = layout
+        fd, out_path = tempfile.mkstemp(suffix=sd_transcode.TRANSCODED_EXTENSION)
+        os.close(fd)
+        try:
+            with job.stage('transcode'):
+                frames = sd_transcode.transcode_video(src_path, out_path, panel_size, chain, fps, positions, mode,
+                                                      pixel_format)
+                with open(out_path, 'rb') as f:
+                    digest, size = sd_assets.add(f, name, [get_display(c).prefix for c, _ in clients])
+        finally:
+            remove_temp_files([out_path])
+        outputs.append({'sha256': digest, 'size': size, 'frames': frames, 'clients': [c for c, _ in clients]})
+        for client_id, client_ip in clients:
+            if client_ip:
+                targets.append((client_id, client_ip))
+                assets[client_ip] = [(name, digest, sd_assets.blob_path(digest))]
+        job.progress(0.5 * (i + 1) / len(layouts))
+
+    job.set_result(filename=name, source_size=os.path.getsize(src_path), outputs=outputs)
+    if targets:
+        # Frames are already laid out and rotated, so the Pi gets no positions
+        run_sd_push_job(job, targets, assets, mode)
+
+@app.route('/api/sd/sync', methods=['POST'])
+@login_required
+def sync_sd_files():
+    """Pushes every file in a client's index that has not reached it yet."""
+    client_ids = request_client_ids()
+    targets = []
+    assets = {}
+    for client_id in client_ids:
+        client_ip = get_client_ip(client_id)
+        index = sd_assets.index(get_display(client_id).prefix)
+        pending = [(f, e['hash'], sd_assets.blob_path(e['hash'])) for f, e in index.items() if not e['synced']]
+        if client_ip and pending:
+            targets.append((client_id, client_ip))
+            assets[client_ip] = pending
+    if not targets:
+        return jsonify({'message': 'Nothing to sync'})
+    job_id = jobs.submit('sd_sync', run_sd_push_job, targets, assets)
+    return jsonify({'message': 'Sync started', 'job_id': job_id}), 202
 
 @app.route('/api/sd/files/<filename>', methods=['DELETE'])
 @login_required
 def delete_sd_file(filename):
+    client_id = request_client_id()
     try:
-        # Delete locally
-        filepath = os.path.join(SD_UPLOAD_FOLDER, filename)
-        local_deleted = False
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            local_deleted = True
+        # Remove from the client's index (the blob goes once nothing refers to it)
+        local_deleted = sd_assets.remove(get_display(client_id).prefix, filename) is not None
             
         # Propagate to client
-        client_ip = get_client_ip()
+        client_ip = get_client_ip(client_id)
 
         client_msg = ""
         if client_ip:
-            url = f"http://{client_ip}:5000/api/sd/files/{filename}"
             try:
-                resp = requests.delete(url, timeout=5)
+                resp = client_comm.delete_sd_file(client_ip, filename)
                 if resp.status_code == 200:
                     client_msg = " and deleted from client"
                 else:
@@ -918,14 +1857,14 @@ def delete_sd_file(filename):
 @app.route('/api/sd/play', methods=['POST'])
 @login_required
 def play_sd_card():
+    client_id = request_client_id()
     try:
         # Try to push to client if connected (or use last known IP)
-        client_ip = get_client_ip()
+        client_ip = get_client_ip(client_id)
 
         if client_ip:
-            url = f"http://{client_ip}:5000/api/sd/play"
             try:
-                requests.post(url, timeout=5)
+                client_comm.sd_command(client_ip, 'play')
                 return jsonify({'message': 'Playback started'})
             except Exception as e:
                 return jsonify({'error': f'Failed to contact client: {e}'}), 500
@@ -937,14 +1876,14 @@ def play_sd_card():
 @app.route('/api/sd/stop', methods=['POST'])
 @login_required
 def stop_sd_card():
+    client_id = request_client_id()
     try:
         # Try to push to client if connected (or use last known IP)
-        client_ip = get_client_ip()
+        client_ip = get_client_ip(client_id)
 
         if client_ip:
-            url = f"http://{client_ip}:5000/api/sd/stop"
             try:
-                requests.post(url, timeout=5)
+                client_comm.sd_command(client_ip, 'stop')
                 return jsonify({'message': 'Playback stopped'})
             except Exception as e:
                 return jsonify({'error': f'Failed to contact client: {e}'}), 500
@@ -953,41 +1892,138 @@ def stop_sd_card():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def push_file_to_client(filepath, filename, client_ip, mode='both', pos1=None, pos2=None):
+# --- Playlist Routes ---
+def playlist_item_options(values):
+    """Item options from form fields (a missing field keeps the item's default)."""
+    data = {name: values[name] for name in ('duration', 'transition', 'transition_seconds') if values.get(name)}
+    if values.get('window_start') or values.get('window_end') or values.get('days'):
+        data['window'] = {'start': values.get('window_start'), 'end': values.get('window_end'),
+                          'days': [d for d in values.get('days', '').split(',') if d.strip()]}
+    return data
+
+@app.route('/api/playlist', methods=['GET'])
+@login_required
+def get_playlist():
+    """A client's playlist, with what it is playing and whether the next item is rendered yet."""
+    return jsonify(playlists.status(request_client_id()))
+
+@app.route('/api/playlist', methods=['PUT'])
+@approval_required
+def update_playlist():
+    client_id = request_client_id()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON body required'}), 400
+    items = data.get('items')
+    if items is not None and not isinstance(items, list):
+        return jsonify({'error': 'items must be a list'}), 400
+    try:
+        playlists.configure(client_id, data.get('enabled'), items)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(playlists.status(client_id))
+
+@app.route('/api/playlist/items', methods=['POST'])
+@approval_required
+def add_playlist_item():
+    display = request_display()
+    mode = request.form.get('mode')
+    uploads = [request.files.get('file_a'), request.files.get('file_b')]
+    uploads = [f for f in uploads if f and f.filename]
+    position = request.form.get('position')
+    files = [{'filename': os.path.basename(upload.filename)} for upload in uploads]
+    try:
+        position = int(position) if position else None
+        item = new_item(mode, files, playlist_item_options(request.form))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Files go into the client's SD index, so exporting the playlist reuses the SD push
+    for f, upload in zip(files, uploads):
+        f['sha256'], f['size'] = sd_assets.add(upload.stream, f['filename'], [display.prefix])
+    playlists.add_item(display.client_id, item, position)
+    return jsonify({'message': 'Item added', 'item': item}), 201
+
+@app.route('/api/playlist/items/<item_id>', methods=['DELETE'])
+@approval_required
+def delete_playlist_item(item_id):
+    if playlists.remove_item(request_client_id(), item_id) is None:
+        return jsonify({'error': 'Item not found'}), 404
+    return jsonify({'message': 'Item removed'})
+
+@app.route('/api/playlist/export', methods=['GET'])
+def export_playlist():
     """
-    Pushes a file to the client's SD card storage.
+    Endpoint for the Raspberry Pi to fetch its schedule for offline play.
+    Files are named as on its SD card and carry their SHA-256.
     """
-    url = f"http://{client_ip}:5000/api/sd/upload"
-    try:
-        with open(filepath, 'rb') as f:
-            files = {'file': (filename, f)}
-            data = {'mode': mode}
-            if pos1 is not None: data['position_1'] = pos1
-            if pos2 is not None: data['position_2'] = pos2
-            
-            print(f"Pushing file {filename} to {url} with mode {mode}")
-            response = requests.post(url, files=files, data=data, timeout=10)
-            if response.status_code == 200:
-                print(f"Successfully pushed {filename}")
-            else:
-                print(f"Failed to push {filename}: {response.text}")
-    except Exception as e:
-        print(f"Error pushing file: {e}")
+    return jsonify(playlists.export(request_client_id()))
 
-def push_settings_to_client(settings, client_ip):
+@app.route('/api/playlist/push', methods=['POST'])
+@approval_required
+def push_playlist():
+    """Copies a client's playlist files to its SD card, then sends it the schedule."""
+    client_id = request_client_id()
+    client_ip = get_client_ip(client_id)
+    if not client_ip:
+        return jsonify({'error': 'Client not connected'}), 400
+    job_id = jobs.submit('playlist_push', run_playlist_push_job, client_id, client_ip)
+    return jsonify({'message': 'Playlist push started', 'job_id': job_id}), 202
+
+def run_playlist_push_job(job, client_id, client_ip):
+    schedule = playlists.export(client_id)
+    assets = {}
+    for item in schedule['items']:
+        for f in item['files']:
+            assets[f['filename']] = (f['filename'], f['sha256'], sd_assets.blob_path(f['sha256']))
+    if assets:
+        run_sd_push_job(job, [(client_id, client_ip)], list(assets.values()))
+    with job.stage('schedule'):
+        accepted = client_comm.push_playlist(client_ip, schedule)
+    if accepted is None:
+        raise Exception('Client does not support playlists')
+    if not accepted:
+        raise Exception('Failed to send the schedule')
+    job.set_result(message=f"Pushed {len(schedule['items'])} item(s) and {len(assets)} file(s)",
+                   version=schedule['version'])
+
+def run_sd_push_job(job, targets, assets, mode='both', pos1=None, pos2=None):
     """
-    Pushes settings to the client.
+    Pushes SD assets to (client_id, client_ip) targets concurrently. assets
+    is a list of (filename, sha256, path), or a dict of such lists per IP.
+    Each client only receives the hashes it doesn't have yet, in chunks
+    that resume where an interrupted push stopped.
     """
-    url = f"http://{client_ip}:5000/api/config"
-    try:
-        print(f"Pushing settings to {url}")
-        response = requests.post(url, json=settings, timeout=5)
-        if response.status_code == 200:
-            print("Successfully pushed settings")
-        else:
-            print(f"Failed to push settings: {response.text}")
-    except Exception as e:
-        print(f"Error pushing settings: {e}")
+    client_ids = {ip: client_id for client_id, ip in targets}
+
+    def push(client_ip):
+        client_assets = assets[client_ip] if isinstance(assets, dict) else assets
+        begin_transfer = lambda filename, digest, size: sd_transfers.begin(client_ids[client_ip], digest, filename, size)
+        return client_assets, client_comm.push_assets(client_ip, client_assets, mode, pos1, pos2, begin_transfer)
+
+    with job.stage('push'):
+        pushes = client_comm.fan_out([ip for _, ip in targets], push)
+        failed = []
+        for client_id, client_ip in targets:
+            client_assets, synced = pushes[client_ip].result()
+            sd_assets.mark_synced(get_display(client_id).prefix, synced)
+            failed.extend(f"{filename} to {client_id}" for filename, _, _ in client_assets if filename not in synced)
+        if failed:
+            raise Exception(f"Failed to push {', '.join(failed)}")
+
+def start_background_work():
+    """Stored-state setup and background threads of a serving process."""
+    sd_assets.adopt_legacy_files()
+    metrics.start(shared_store)
+    default_display.controller.init_content()
+    # Runs the playlists in whichever worker holds the scheduler lease
+    playlists.start()
+
+# Decode pool processes run this file again as __mp_main__ (multiprocessing
+# re-imports the parent's main script in every child); they only need the
+# definitions
+if __name__ != '__mp_main__':
+    start_background_work()
 
 if __name__ == '__main__':
     with app.app_context():
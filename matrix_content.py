@@ -0,0 +1,363 @@
+import array
+import bisect
+import hashlib
+import io
+import itertools
+import json
+import struct
+import time
+
+import numpy as np
+from PIL import Image
+
+import frame_ops
+from metrics import metrics
+
+# Observed in the server processes only. Encodes that are part of an
+# upload's decode are also included in the decode stage.
+encode_seconds = metrics.histogram('stage_seconds', stage='encode')
+
+
+class MatrixContent:
+    """
+    Processed content for one matrix, stored compactly.
+
+    All frames live in one contiguous N x H x W x 3 uint8 array, durations
+    (float32) and the cumulative timeline (float64) are packed arrays, and
+    the PNG encoding of every frame is one bytes blob plus an offsets array.
+    Individual frames are only materialized on demand, as memoryview slices
+    or PIL images.
+
+    render_raw() additionally precomputes every frame in the panel's native
+    layout (rotated and sized for the panel) as RGB888 and RGB565 buffers.
+    """
+
+    __slots__ = (
+        'type', 'pixels', 'durations', 'timeline', 'total_duration', 'start_time',
+        'png', 'png_offsets', 'digest', 'format', 'raw_layout', 'raw',
+    )
+
+    RAW_FORMATS = ('rgb888', 'rgb565')
+    BUNDLE_MAGIC = b'LMB1'
+    FRAMES_MAGIC = b'LMF1'
+    SNAPSHOT_MAGIC = b'LMS1'
+    # Snapshot sections start at multiples of this, so arrays mapped from a
+    # snapshot are aligned
+    SNAPSHOT_ALIGN = 64
+
+    def __init__(self, content_type, pixels, durations=None, start_time=None):
+        self.type = content_type
+        self.pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        # Shared between matrices and clients, so never modified in place
+        self.pixels.flags.writeable = False
+        if content_type == 'animation':
+            self.durations = array.array('f', durations)
+            self.timeline = array.array('d', itertools.accumulate(durations))
+            self.total_duration = self.timeline[-1] if self.timeline else 0.0
+            self.start_time = time.time() if start_time is None else start_time
+        else:
+            self.durations = None
+            self.timeline = None
+            self.total_duration = 0.0
+            self.start_time = None
+        self.format = None
+        self.raw_layout = None
+        self.raw = {}
+        digest = hashlib.sha1(self.pixels.data)
+        if self.durations is not None:
+            digest.update(self.durations.tobytes())
+        self.digest = digest.hexdigest()[:12]
+        self._encode()
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__}
+        # Content loaded from a snapshot holds its PNG blob as a memoryview
+        state['png'] = bytes(self.png)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # Pickled before __getstate__ existed: (None, slot values)
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+        # Unpickled arrays come back writeable
+        self.pixels.flags.writeable = False
+
+    def with_start_time(self, start_time):
+        """
+        This content played from start_time. Shares every buffer (unlike
+        copy.copy, which goes through __getstate__ and copies the PNG blob).
+        """
+        content = object.__new__(MatrixContent)
+        for name in self.__slots__:
+            setattr(content, name, getattr(self, name))
+        content.start_time = start_time
+        return content
+
+    @classmethod
+    def from_image(cls, image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls('static', np.asarray(image)[np.newaxis])
+
+    @classmethod
+    def from_frames(cls, frames, durations, start_time=None):
+        return cls('animation', frames, durations, start_time)
+
+    @encode_seconds.timed
+    def _encode(self):
+        """PNG-encodes every frame once into a single blob."""
+        chunks = []
+        offsets = array.array('q', [0]) * (len(self.pixels) + 1)
+        for i in range(len(self.pixels)):
+            buffer = io.BytesIO()
+            self.image(i).save(buffer, 'PNG')
+            chunks.append(buffer.getvalue())
+            offsets[i + 1] = offsets[i] + len(chunks[-1])
+        self.png = b''.join(chunks)
+        self.png_offsets = offsets
+
+    @property
+    def frame_count(self):
+        return len(self.pixels)
+
+    @property
+    def size(self):
+        return self.pixels.shape[2], self.pixels.shape[1]
+
+    def frame_index(self, now=None):
+        if self.type != 'animation' or self.total_duration <= 0:
+            return 0
+        if now is None:
+            now = time.time()
+        loop_time = (now - self.start_time) % self.total_duration
+        index = bisect.bisect_right(self.timeline, loop_time)
+        return index if index < len(self.timeline) else 0
+
+    def frame(self, index):
+        """Raw RGB888 bytes of a frame as a memoryview (no copy)."""
+        return self.pixels[index].data.cast('B')
+
+    def image(self, index):
+        return Image.frombuffer('RGB', self.size, self.frame(index), 'raw', 'RGB', 0, 1)
+
+    def encoded(self, index):
+        """Returns (png_bytes, etag) for a frame."""
+        start, end = self.png_offsets[index], self.png_offsets[index + 1]
+        return bytes(self.png[start:end]), f"{self.digest}-{index}"
+
+    def render_raw(self, panel_size=None, rotation=0):
+        """
+        Precomputes the raw frame buffers for a panel of panel_size
+        (width, height) mounted with the given rotation in degrees
+        (counter-clockwise, like PIL's Image.rotate).
+        """
+        panel_size = tuple(panel_size or self.size)
+        rotation = int(rotation) % 360
+        if self.raw_layout == (panel_size, rotation):
+            return
+
+        with encode_seconds.time():
+            rgb888 = frame_ops.rotate_frames(self.pixels, rotation, panel_size)
+            self.raw = {'rgb888': rgb888, 'rgb565': frame_ops.to_rgb565(rgb888)}
+        self.raw_layout = (panel_size, rotation)
+
+    def raw_frame(self, index, pixel_format='rgb888'):
+        """Returns (raw_bytes, etag) for a frame in the panel layout."""
+        if not self.raw:
+            self.render_raw()
+        (width, height), rotation = self.raw_layout
+        etag = f"{self.digest}-{index}-{pixel_format}-{width}x{height}r{rotation}"
+        return self.raw[pixel_format][index].tobytes(), etag
+
+    @property
+    def version(self):
+        """Content version ID; changes whenever the frames or durations change."""
+        return self.digest
+
+    def bundle_etag(self, pixel_format='png'):
+        # The bundle header carries start_time, which changes when the same
+        # content is set again
+        clock = f"-{int(self.start_time * 1000)}" if self.start_time is not None else ''
+        if pixel_format == 'png':
+            return f"{self.digest}{clock}-bundle-png"
+        (width, height), rotation = self.raw_layout
+        return f"{self.digest}{clock}-bundle-{pixel_format}-{width}x{height}r{rotation}"
+
+    def bundle(self, pixel_format='png'):
+        """
+        Packs the whole content into one container so a client can play it
+        locally:
+
+            b'LMB1' | uint32 LE header length | JSON header | frame data
+
+        The header holds version, type, width, height, pixel_format,
+        frame_count, durations, start_time and offsets (frame_count + 1 byte
+        offsets into the frame data).
+        """
+        if pixel_format == 'png':
+            data = self.png
+            offsets = list(self.png_offsets)
+            width, height = self.size
+        else:
+            if not self.raw:
+                self.render_raw()
+            frames = self.raw[pixel_format]
+            data = frames.tobytes()
+            frame_size = frames[0].nbytes
+            offsets = [i * frame_size for i in range(self.frame_count + 1)]
+            (width, height), _ = self.raw_layout
+
+        header = json.dumps({
+            'version': self.version,
+            'type': self.type,
+            'width': width,
+            'height': height,
+            'pixel_format': pixel_format,
+            'frame_count': self.frame_count,
+            'durations': list(self.durations) if self.durations is not None else [0.0],
+            'start_time': self.start_time,
+            'offsets': offsets,
+        }, separators=(',', ':')).encode('utf-8')
+        return b''.join([self.BUNDLE_MAGIC, struct.pack('<I', len(header)), header, data])
+
+    @classmethod
+    def pack_frames(cls, frames, now, pixel_format='png'):
+        """
+        Packs the frames of several matrices for one instant into one
+        container:
+
+            b'LMF1' | uint32 LE header length | JSON header | frame data
+
+        frames is {matrix: (content, index, data, etag)}. The header holds
+        time, pixel_format and per matrix its version, type, index,
+        frame_count, start_time, width, height, offset and length into the
+        frame data.
+        """
+        entries = {}
+        offset = 0
+        for matrix, (content, index, data, _) in frames.items():
+            if pixel_format == 'png':
+                width, height = content.size
+            else:
+                (width, height), _ = content.raw_layout
+            entries[matrix] = {
+                'version': content.version,
+                'type': content.type,
+                'index': index,
+                'frame_count': content.frame_count,
+                'start_time': content.start_time,
+                'width': width,
+                'height': height,
+                'offset': offset,
+                'length': len(data),
+            }
+            offset += len(data)
+        header = json.dumps({'time': now, 'pixel_format': pixel_format, 'frames': entries},
+                            separators=(',', ':')).encode('utf-8')
+        return b''.join([cls.FRAMES_MAGIC, struct.pack('<I', len(header)), header,
+                         *(data for _, _, data, _ in frames.values())])
+
+    def write_snapshot(self, f):
+        """
+        Writes the content in a flat layout that from_snapshot can map back
+        without decoding or unpickling anything:
+
+            b'LMS1' | uint32 LE header length | JSON header | sections
+
+        The header holds the scalar fields and, for every array (pixels,
+        PNG blob and offsets, durations, timeline, raw buffers), its dtype,
+        shape and byte offset into the sections. The sections start at the
+        first SNAPSHOT_ALIGN boundary after the header and each one is
+        aligned the same way.
+        """
+        arrays = {
+            'pixels': self.pixels,
+            'png': np.frombuffer(self.png, dtype=np.uint8),
+            'png_offsets': np.frombuffer(self.png_offsets, dtype=np.int64),
+        }
+        if self.type == 'animation':
+            arrays['durations'] = np.frombuffer(self.durations, dtype=np.float32)
+            arrays['timeline'] = np.frombuffer(self.timeline, dtype=np.float64)
+        for pixel_format, frames in self.raw.items():
+            arrays[f'raw_{pixel_format}'] = frames
+
+        sections = {}
+        offset = 0
+        for name, value in arrays.items():
+            offset += -offset % self.SNAPSHOT_ALIGN
+            sections[name] = [offset, value.dtype.str, list(value.shape)]
+            offset += value.nbytes
+        header = json.dumps({
+            'type': self.type,
+            'start_time': self.start_time,
+            'total_duration': self.total_duration,
+            'digest': self.digest,
+            'format': self.format,
+            'raw_layout': self.raw_layout,
+            'sections': sections,
+        }, separators=(',', ':')).encode('utf-8')
+
+        position = len(self.SNAPSHOT_MAGIC) + 4 + len(header)
+        f.write(self.SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(b'\0' * (-position % self.SNAPSHOT_ALIGN))
+        position = 0
+        for value in arrays.values():
+            padding = -position % self.SNAPSHOT_ALIGN
+            f.write(b'\0' * padding)
+            f.write(np.ascontiguousarray(value).data.cast('B'))
+            position += padding + value.nbytes
+
+    @classmethod
+    def from_snapshot(cls, buffer):
+        """
+        Rebuilds content from write_snapshot's bytes (typically a read-only
+        mmap). The frame arrays, PNG blob and raw buffers are views into
+        the buffer, so nothing is copied. Raises ValueError if the buffer
+        is not a snapshot.
+        """
+        magic_size = len(cls.SNAPSHOT_MAGIC)
+        if len(buffer) < magic_size + 4 or bytes(buffer[:magic_size]) != cls.SNAPSHOT_MAGIC:
+            raise ValueError('Not a content snapshot')
+        (header_size,) = struct.unpack_from('<I', buffer, magic_size)
+        header_end = magic_size + 4 + header_size
+        header = json.loads(bytes(buffer[magic_size + 4:header_end]))
+        base = header_end + -header_end % cls.SNAPSHOT_ALIGN
+
+        def section(name):
+            offset, dtype, shape = header['sections'][name]
+            count = int(np.prod(shape)) if shape else 1
+            return np.frombuffer(buffer, dtype=np.dtype(dtype), count=count, offset=base + offset).reshape(shape)
+
+        content = cls.__new__(cls)
+        content.type = header['type']
+        content.pixels = section('pixels')
+        content.png = memoryview(section('png'))
+        content.png_offsets = array.array('q', section('png_offsets').tobytes())
+        if content.type == 'animation':
+            content.durations = array.array('f', section('durations').tobytes())
+            content.timeline = array.array('d', section('timeline').tobytes())
+        else:
+            content.durations = None
+            content.timeline = None
+        content.total_duration = header['total_duration']
+        content.start_time = header['start_time']
+        content.digest = header['digest']
+        content.format = header['format']
+        raw_layout = header['raw_layout']
+        content.raw_layout = (tuple(raw_layout[0]), raw_layout[1]) if raw_layout else None
+        content.raw = {pixel_format: section(f'raw_{pixel_format}') for pixel_format in cls.RAW_FORMATS
+                       if f'raw_{pixel_format}' in header['sections']}
+        return content
+
+    def nbytes(self):
+        """Approximate heap footprint of the stored buffers."""
+        total = self.pixels.nbytes + len(self.png) + self.png_offsets.itemsize * len(self.png_offsets)
+        total += sum(buffer.nbytes for buffer in self.raw.values())
+        if self.type == 'animation':
+            total += self.durations.itemsize * len(self.durations) + self.timeline.itemsize * len(self.timeline)
+        return total
+
@@ -0,0 +1,154 @@
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import imageio
+from PIL import Image, ImageSequence
+
+import frame_ops
+from matrix_content import MatrixContent
+
+
+def process_content(source, filename, target_size=(64, 64), max_frames=150, fps=None):
+    """
+    Processes a file and returns a content dict. source is a path or a
+    binary file object; videos need a path.
+
+    Frames are resized to target_size as soon as they are decoded, so only
+    the downsized frames are kept in memory. Videos are subsampled to at
+    most fps frames per second and capped at max_frames output frames.
+    """
+    filename = filename.lower()
+    
+    try:
+        if filename.endswith(('.mp4', '.avi', '.mov', '.mkv')):
+            # Video processing using imageio, streaming one frame at a time
+            reader = imageio.get_reader(source)
+            try:
+                source_fps = reader.get_meta_data().get('fps') or 30
+                output_fps = min(fps, source_fps) if fps and fps > 0 else source_fps
+                duration_per_frame = 1.0 / output_fps
+                
+                frames = []
+                durations = []
+                next_output_time = 0.0
+                
+                for index, frame in enumerate(reader):
+                    if len(frames) >= max_frames: break
+                    # Skip source frames until the next output timestamp
+                    if index / source_fps + 1e-9 < next_output_time:
+                        continue
+                    next_output_time += duration_per_frame
+                    # Convert numpy array to PIL Image and drop the full-size frame
+                    frames.append(frame_ops.resize_image(Image.fromarray(frame), target_size))
+                    durations.append(duration_per_frame)
+                    del frame
+            finally:
+                reader.close()
+            
+            if not frames:
+                raise Exception("No frames found in video")
+                
+            return {
+                'type': 'animation',
+                'frames': frames,
+                'durations': durations
+            }
+
+        elif filename.endswith('.gif'):
+            # GIF processing using Pillow
+            img = Image.open(source)
+            
+            if getattr(img, "is_animated", False):
+                frames = []
+                durations = []
+                for frame in ImageSequence.Iterator(img):
+                    frames.append(frame_ops.resize_image(frame, target_size))
+                    # GIF duration is in milliseconds
+                    durations.append(frame.info.get('duration', 100) / 1000.0)
+                
+                return {
+                    'type': 'animation',
+                    'frames': frames,
+                    'durations': durations
+                }
+            else:
+                return {
+                    'type': 'static',
+                    'image': frame_ops.resize_image(img, target_size)
+                }
+        else:
+            # Standard Image; let JPEG decode at a reduced scale when possible
+            img = Image.open(source)
+            img.draft('RGB', target_size)
+            return {
+                'type': 'static',
+                'image': frame_ops.resize_image(img, target_size)
+            }
+            
+    except Exception as e:
+        print(f"Error processing file: {e}")
+        raise e
+
+
+def decode_content(source, filename, target_size=(64, 64), max_frames=150, fps=None):
+    """
+    Decodes a file straight into a MatrixContent (resized, packed and
+    PNG-encoded). source is a path or the file's bytes, so the call can be
+    sent to a DecodePool process.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    content = process_content(source, filename, target_size, max_frames, fps)
+    if content['type'] == 'animation':
+        return MatrixContent.from_frames(frame_ops.resize_frames(content['frames'], target_size), content['durations'])
+    return MatrixContent.from_image(content['image'])
+
+
+class DecodePool:
+    """
+    Worker processes for decodes that should run side by side (A and B of
+    a separate-mode upload) instead of sharing one GIL.
+
+    The processes come from a forkserver (preloaded with this module) and
+    are started on first use. multiprocessing still runs the parent's main
+    script in each of them as __mp_main__, so a script that creates a pool
+    must keep its side effects out of that import. With a single worker (one
+    CPU) or a single call there is nothing to overlap, so calls run in the
+    calling thread. If the pool breaks (a worker killed, say) they are run
+    in the calling thread too and the pool is started again next time.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def run_all(self, fn, calls):
+        """Runs fn(*args) for every args tuple in calls in parallel; returns the results in order."""
+        if self.max_workers < 2 or len(calls) < 2:
+            return [fn(*args) for args in calls]
+        try:
+            futures = [self._get_executor().submit(fn, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            print(f"Decode pool failed ({e}), decoding in-process")
+            with self._lock:
+                self._executor = None
+            return [fn(*args) for args in calls]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
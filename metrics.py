@@ -0,0 +1,266 @@
+import atexit
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond frame serving to slow decodes
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def state(self):
+        return self.value
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram. counts[i] counts observations <= bounds[i]
+    (but > bounds[i - 1]); the last slot is +Inf.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    kind = 'histogram'
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # No lock: the GIL makes each statement effectively atomic for
+        # these plain list/float updates, and a lost increment in a rare
+        # race is acceptable for monitoring
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """
+        Context manager that observes the duration of its block. Costs
+        about a microsecond; use timed() on hot paths.
+        """
+        return _Timer(self)
+
+    def timed(self, fn):
+        """Decorator that observes the duration of every call that returns normally."""
+        observe = self.observe
+        clock = time.perf_counter
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = clock()
+            result = fn(*args, **kwargs)
+            observe(clock() - started)
+            return result
+        return wrapper
+
+    def state(self):
+        return (self.bounds, list(self.counts), self.sum)
+
+    @staticmethod
+    def merge(a, b):
+        if a[0] != b[0]:
+            # Bucket layout changed between deploys; keep the newer one
+            return b
+        return (a[0], [x + y for x, y in zip(a[1], b[1])], a[2] + b[2])
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    """
+    Process-wide counters and histograms, exported in the Prometheus text
+    format and aggregated across gunicorn workers.
+
+    Metrics are created once (histogram()/counter() return the same object
+    for the same name and labels) and then updated without any lookup or
+    lock, so an observation costs a few hundred nanoseconds (about half a
+    microsecond through Histogram.timed, timing included). Every worker
+    writes its totals to the shared store every FLUSH_INTERVAL seconds
+    under metrics_<pid>; render() sums the stored totals of all workers.
+    Totals of workers that have exited are folded into metrics_retired, so
+    the exported counters never go backwards when a worker is replaced.
+    """
+
+    FLUSH_INTERVAL = 5.0
+    KEY_PREFIX = 'metrics_'
+    RETIRED_KEY = 'metrics_retired'
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.store = None
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def describe(self, name, help_text):
+        self._help[f'{self.namespace}_{name}'] = help_text
+
+    def _get(self, cls, name, labels, *args):
+        key = (f'{self.namespace}_{name}', tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls(*args))
+        return metric
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, buckets)
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    # --- Aggregation across workers ---
+
+    def _key(self, pid=None):
+        return f'{self.KEY_PREFIX}{pid or os.getpid()}'
+
+    def snapshot(self):
+        """This process's totals: {(name, labels): (kind, state)}."""
+        with self._lock:
+            items = list(self._metrics.items())
+        return {key: (metric.kind, metric.state()) for key, metric in items}
+
+    def start(self, store):
+        """Starts writing this process's totals to the store in the background."""
+        self.store = store
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing metrics: {e}")
+
+    def flush(self):
+        if self.store is not None and self._metrics:
+            self.store.write(self._key(), self.snapshot())
+
+    @staticmethod
+    def _combine(total, snapshot):
+        for key, (kind, state) in snapshot.items():
+            if key in total and total[key][0] == kind:
+                total[key] = (kind, (Histogram if kind == 'histogram' else Counter).merge(total[key][1], state))
+            else:
+                total[key] = (kind, state)
+        return total
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _retire(self, key):
+        """Folds the stored totals of an exited worker into the retired totals."""
+        def fold(retired):
+            snapshot = self.store.read(key)
+            if snapshot is None:
+                # Another worker folded it first
+                return retired
+            self.store.delete(key)
+            return self._combine(dict(retired), snapshot)
+
+        self.store.update(self.RETIRED_KEY, fold, {})
+
+    def collect(self):
+        """Totals of all workers, this one taken live."""
+        own = self._key()
+        total = {}
+        if self.store is not None:
+            for key, _ in self.store.keys(self.KEY_PREFIX):
+                if key == own or key == self.RETIRED_KEY:
+                    continue
+                pid = key[len(self.KEY_PREFIX):]
+                if pid.isdigit() and not self._alive(int(pid)):
+                    self._retire(key)
+                    continue
+                self._combine(total, self.store.read(key, {}))
+            self._combine(total, self.store.read(self.RETIRED_KEY, {}))
+        return self._combine(total, self.snapshot())
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        families = {}
+        for (name, labels), (kind, state) in self.collect().items():
+            families.setdefault(name, (kind, []))[1].append((labels, state))
+
+        lines = []
+        for name in sorted(families):
+            kind, series = families[name]
+            # In this format a counter's family is named like its samples
+            family = f'{name}_total' if kind == 'counter' else name
+            if name in self._help:
+                lines.append(f'# HELP {family} {self._help[name]}')
+            lines.append(f'# TYPE {family} {kind}')
+            for labels, state in sorted(series):
+                if kind == 'counter':
+                    lines.append(f'{family}{_labels(labels)} {_number(state)}')
+                    continue
+                bounds, counts, total = state
+                cumulative = 0
+                for bound, count in zip(bounds + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+# The server's registry; modules bind their metrics once at import time
+metrics = Metrics('lemona')
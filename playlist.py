@@ -0,0 +1,439 @@
+import copy
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import frame_ops
+from matrix_content import MatrixContent
+
+MODES = ('matrix_a', 'matrix_b', 'both', 'split', 'separate')
+TRANSITIONS = ('cut', 'fade')
+DEFAULT_DURATION = 10.0
+DEFAULT_TRANSITION_SECONDS = 0.5
+# Crossfades are rendered at this frame rate
+FADE_FPS = 20
+
+
+def _number(data, name, minimum=0.0):
+    try:
+        value = float(data[name])
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid {name}. Use a number of seconds.')
+    if value < minimum or value != value:
+        raise ValueError(f'Invalid {name}. Use at least {minimum:g} seconds.')
+    return value
+
+
+def _minutes(value):
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except ValueError:
+        raise ValueError(f'Invalid time "{value}". Use HH:MM.')
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f'Invalid time "{value}". Use HH:MM.')
+    return hours * 60 + minutes
+
+
+def parse_window(window):
+    """
+    Validates a time-of-day window {'start': 'HH:MM', 'end': 'HH:MM',
+    'days': [0-6]} (days are weekdays, Monday = 0; none means every day).
+    end before start wraps past midnight; start == end is the whole day.
+    Returns the normalized window, or None for no window.
+    """
+    if not window:
+        return None
+    if not isinstance(window, dict):
+        raise ValueError('Invalid window. Use {"start": "HH:MM", "end": "HH:MM", "days": [...]}.')
+    start, end = window.get('start') or '00:00', window.get('end') or '00:00'
+    _minutes(start)
+    _minutes(end)
+    days = window.get('days') or []
+    try:
+        days = sorted({int(day) for day in days})
+    except (TypeError, ValueError):
+        raise ValueError('Invalid days. Use weekday numbers, Monday = 0.')
+    if any(not 0 <= day <= 6 for day in days):
+        raise ValueError('Invalid days. Use weekday numbers, Monday = 0.')
+    return {'start': start, 'end': end, 'days': days}
+
+
+def in_window(window, timestamp):
+    """Whether a server-local timestamp falls inside a window (None is always)."""
+    if window is None:
+        return True
+    local = time.localtime(timestamp)
+    minute = local.tm_hour * 60 + local.tm_min
+    start, end = _minutes(window['start']), _minutes(window['end'])
+    day_ok = lambda day: not window['days'] or day in window['days']
+    if start == end:
+        return day_ok(local.tm_wday)
+    if start < end:
+        return start <= minute < end and day_ok(local.tm_wday)
+    # Past midnight the window belongs to the day it started on
+    return (minute >= start and day_ok(local.tm_wday)) or (minute < end and day_ok((local.tm_wday - 1) % 7))
+
+
+def next_index(items, after, timestamp):
+    """The first item after index `after` (cyclically) whose window is open at timestamp, or None."""
+    for step in range(1, len(items) + 1):
+        index = (after + step) % len(items)
+        if in_window(items[index]['window'], timestamp):
+            return index
+    return None
+
+
+def apply_options(item, data):
+    """
+    Validates the editable fields of an item (duration, window, transition,
+    transition_seconds) in data and sets them on item. Raises ValueError.
+    """
+    if 'duration' in data:
+        item['duration'] = _number(data, 'duration', 0.1)
+    if 'window' in data:
+        item['window'] = parse_window(data['window'])
+    if 'transition' in data:
+        if data['transition'] not in TRANSITIONS:
+            raise ValueError('Invalid transition. Use "cut" or "fade".')
+        item['transition'] = data['transition']
+    if 'transition_seconds' in data:
+        item['transition_seconds'] = _number(data, 'transition_seconds')
+    if item['transition'] == 'fade' and item['transition_seconds'] >= item['duration']:
+        raise ValueError('transition_seconds must be shorter than duration')
+    return item
+
+
+def new_item(mode, files, data):
+    """
+    A playlist item showing files ([{'filename', 'sha256', 'size'}], two
+    for 'separate' mode) in a display mode, with the options in data.
+    """
+    if mode not in MODES:
+        raise ValueError('Invalid mode')
+    if len(files) != (2 if mode == 'separate' else 1):
+        raise ValueError('Both files required for separate mode' if mode == 'separate' else 'File required')
+    item = {
+        'id': uuid.uuid4().hex[:12],
+        'mode': mode,
+        'files': files,
+        'duration': DEFAULT_DURATION,
+        'window': None,
+        'transition': 'cut',
+        'transition_seconds': DEFAULT_TRANSITION_SECONDS,
+    }
+    return apply_options(item, data)
+
+
+def prepared_assets(state):
+    """Asset keys a playlist state holds for upcoming phases (not yet in any matrix key)."""
+    phases = list((state or {}).get('pending') or [])
+    phases += ((state or {}).get('next') or {}).get('phases') or []
+    return {ref['asset'] for phase in phases for ref in phase['refs'].values()}
+
+
+class PlaylistEngine:
+    """
+    Server-side playlists: per client, an ordered list of items, each shown
+    for its duration, only inside its time-of-day window, optionally
+    entered with a crossfade.
+
+    Playlists are stored in the shared store (<prefix>playlist) and run by
+    one scheduler thread in whichever worker holds the lease, so every item
+    switches exactly once however many workers there are. The scheduler
+    keeps its progress in <prefix>playlist_state, so another worker picks
+    up where it stopped.
+
+    While an item is live, the next one is decoded and rendered for the
+    panel layout in the background (prepare_content), so when it is due
+    the switch only repoints the matrix keys (show_prepared): no decode
+    at switch time, whatever the content. Switches happen on the planned
+    time, which is also the new content's start_time, so the schedule
+    doesn't drift with the scheduler's wake-ups.
+    """
+
+    KEY = 'playlist'
+    STATE_KEY = 'playlist_state'
+    LEASE_KEY = 'playlist_scheduler'
+    LEASE_SECONDS = 5.0
+    # Longest sleep between scheduler passes (also how soon edits made in
+    # another worker are noticed)
+    MAX_WAIT = 1.0
+    # When the scheduler is further behind than this (after a restart, say)
+    # the next item starts now instead of at its planned time
+    MAX_LATE = 5.0
+    # How often a playlist without any open window is checked again
+    IDLE_RECHECK = 1.0
+
+    def __init__(self, store, get_display, render):
+        """
+        get_display(client_id) returns the client's Display and
+        render(client_id, item) decodes an item's files into
+        {matrix: MatrixContent} for the matrices its mode covers.
+        """
+        self.store = store
+        self.get_display = get_display
+        self.render = render
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='playlist-prepare')
+        self._preparing = {}
+        self._wake = threading.Event()
+        self._scheduler_pid = None
+
+    # --- Playlists ---
+
+    def _key(self, client_id):
+        return f'{self.get_display(client_id).prefix}{self.KEY}'
+
+    def get(self, client_id):
+        playlist = self.store.read(self._key(client_id))
+        if playlist is None:
+            return {'client_id': client_id, 'version': 0, 'enabled': False, 'items': []}
+        return playlist
+
+    def _update(self, client_id, fn):
+        """Changes a playlist under the store lock; fn gets a copy and returns the new playlist."""
+        def apply(playlist):
+            playlist = fn(copy.deepcopy(playlist or self.get(client_id)))
+            playlist['version'] += 1
+            return playlist
+
+        playlist = self.store.update(self._key(client_id), apply)
+        self._wake.set()
+        return playlist
+
+    def add_item(self, client_id, item, position=None):
+        def apply(playlist):
+            playlist['items'].insert(len(playlist['items']) if position is None else position, item)
+            return playlist
+        return self._update(client_id, apply)
+
+    def remove_item(self, client_id, item_id):
+        """Returns the new playlist, or None if there is no such item."""
+        if not any(item['id'] == item_id for item in self.get(client_id)['items']):
+            return None
+
+        def apply(playlist):
+            playlist['items'] = [item for item in playlist['items'] if item['id'] != item_id]
+            return playlist
+        return self._update(client_id, apply)
+
+    def configure(self, client_id, enabled=None, items=None):
+        """
+        Turns a playlist on or off and/or reorders and edits its items.
+        items lists existing items by 'id' in the new order, with any
+        editable fields to change; items left out are removed. Raises
+        ValueError.
+        """
+        def apply(playlist):
+            if items is not None:
+                existing = {item['id']: item for item in playlist['items']}
+                ordered = []
+                for data in items:
+                    if not isinstance(data, dict) or data.get('id') not in existing:
+                        raise ValueError(f"Unknown item {data.get('id') if isinstance(data, dict) else data}")
+                    ordered.append(apply_options(existing.pop(data['id']), data))
+                playlist['items'] = ordered
+            if enabled is not None:
+                playlist['enabled'] = bool(enabled)
+            return playlist
+        return self._update(client_id, apply)
+
+    def _playlists(self):
+        for key, _ in self.store.keys():
+            if key == self.KEY or key.endswith(f'_{self.KEY}'):
+                playlist = self.store.read(key)
+                if isinstance(playlist, dict) and 'items' in playlist:
+                    yield playlist
+
+    def pinned_hashes(self):
+        """SHA-256 of every file some playlist uses."""
+        return {f['sha256'] for playlist in self._playlists() for item in playlist['items'] for f in item['files']}
+
+    def status(self, client_id):
+        playlist = self.get(client_id)
+        state = self.store.read(f'{self.get_display(client_id).prefix}{self.STATE_KEY}') or {}
+        upcoming = state.get('next') or {}
+        return dict(playlist, state={
+            'item': state.get('item'),
+            'phase': 'transition' if state.get('pending') else ('item' if state.get('item') else None),
+            'started': state.get('started'),
+            'ends': state.get('slot_end'),
+            'next_item': upcoming.get('item'),
+            'next_ready': 'phases' in upcoming,
+        })
+
+    def export(self, client_id):
+        """The schedule for a Pi to play on its own, with its files by name and hash."""
+        playlist = self.get(client_id)
+        return {
+            'version': playlist['version'],
+            'enabled': playlist['enabled'],
+            'timezone_offset': -time.altzone if time.localtime().tm_isdst > 0 else -time.timezone,
+            'items': playlist['items'],
+        }
+
+    # --- Scheduling ---
+
+    def start(self):
+        """Starts this process's scheduler thread (it only runs playlists while it holds the lease)."""
+        if self._scheduler_pid == os.getpid():
+            return
+        self._scheduler_pid = os.getpid()
+        threading.Thread(target=self._run, name='playlist-scheduler', daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            wait = self.MAX_WAIT
+            try:
+                playlists = list(self._playlists())
+                if playlists and self._hold_lease():
+                    for playlist in playlists:
+                        due = self.tick(playlist, time.time())
+                        if due is not None:
+                            wait = min(wait, max(due - time.time(), 0.001))
+            except Exception as e:
+                print(f"Error running playlists: {e}")
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _hold_lease(self):
+        """Claims or renews the scheduler lease; True while this process holds it."""
+        now = time.time()
+        pid = os.getpid()
+        lease = self.store.read(self.LEASE_KEY)
+        if lease and lease['pid'] == pid and lease['expires'] - now > self.LEASE_SECONDS / 2:
+            return True
+
+        def claim(lease):
+            if lease and lease['pid'] != pid and lease['expires'] > now:
+                return lease
+            return {'pid': pid, 'expires': now + self.LEASE_SECONDS}
+        return self.store.update(self.LEASE_KEY, claim)['pid'] == pid
+
+    def tick(self, playlist, now):
+        """
+        Advances one client's playlist if its next switch is due and keeps
+        the following item rendering in the background. Returns the time
+        of the next switch, or None when the playlist is off.
+        """
+        display = self.get_display(playlist['client_id'])
+        state_key = f'{display.prefix}{self.STATE_KEY}'
+        # Copied, as the store hands out its cached object
+        state = copy.deepcopy(self.store.read(state_key) or {})
+        if not playlist['enabled'] or not playlist['items']:
+            if state:
+                self.store.delete(state_key)
+            self._preparing.pop(display.client_id, None)
+            return None
+
+        changed = False
+        if state.get('version') != playlist['version']:
+            # Edited: start over with the first item that is on now
+            state = {'version': playlist['version']}
+            changed = True
+        if state.get('until') is None or now >= state['until']:
+            self._advance(display, playlist['items'], state, now)
+            changed = True
+        if self._prepare_next(display, playlist, state):
+            changed = True
+        if changed:
+            self.store.write(state_key, state)
+        return state['until']
+
+    def _advance(self, display, items, state, now):
+        controller = display.controller
+        due = state.get('until')
+        # Switch on the planned time unless far behind, so playback doesn't drift
+        at = due if due is not None and now - due < self.MAX_LATE else now
+
+        pending = state.get('pending')
+        if pending:
+            # The transition is over: show the item itself
+            controller.show_prepared(pending[0]['refs'], at)
+            state['pending'] = pending[1:]
+            state['until'] = at + pending[0]['seconds'] if state['pending'] else state['slot_end']
+            return
+
+        index = next_index(items, state.get('index', -1), at)
+        if index is None:
+            state.update(item=None, next=None, pending=[], until=at + self.IDLE_RECHECK)
+            return
+        item = items[index]
+        prepared = state.get('next')
+        if not (prepared and prepared['item'] == item['id'] and 'phases' in prepared
+                and prepared['layout'] == controller.get_layout()):
+            # Not rendered ahead (first item, edited playlist, changed layout)
+            try:
+                prepared = self._prepare(display, item, at)
+            except Exception as e:
+                print(f"Error preparing playlist item {item['id']}: {e}")
+                # Skip it; the next pass tries the item after it
+                state.update(index=index, item=None, next=None, pending=[], until=at + self.IDLE_RECHECK)
+                return
+
+        phases = prepared['phases']
+        controller.show_prepared(phases[0]['refs'], at)
+        state.update(index=index, item=item['id'], started=at, slot_end=at + item['duration'], next=None,
+                     pending=phases[1:], until=at + phases[0]['seconds'] if len(phases) > 1 else at + item['duration'])
+
+    def _prepare(self, display, item, at):
+        """
+        Decodes an item and stores it for the client's panel layout, plus
+        its crossfade from whatever the matrices will show at `at`.
+        Returns {'item', 'layout', 'phases': [{'refs', 'seconds'}]}.
+        """
+        controller = display.controller
+        contents = self.render(display.client_id, item)
+        phases = [{'refs': {m: controller.prepare_content(m, c) for m, c in contents.items()}, 'seconds': None}]
+        if item['transition'] == 'fade':
+            seconds = item['transition_seconds']
+            count = max(2, round(seconds * FADE_FPS))
+            fades = {}
+            for matrix, content in contents.items():
+                outgoing = controller.get_content(matrix)
+                if outgoing is not None and outgoing.size == content.size:
+                    frames = frame_ops.crossfade(outgoing.pixels[outgoing.frame_index(at)], content.pixels[0], count)
+                    fades[matrix] = controller.prepare_content(
+                        matrix, MatrixContent.from_frames(frames, [seconds / count] * count))
+            if fades:
+                phases.insert(0, {'refs': fades, 'seconds': seconds})
+        return {'item': item['id'], 'layout': controller.get_layout(), 'phases': phases}
+
+    def _prepare_next(self, display, playlist, state):
+        """
+        Starts rendering the item after the live one in the background, or
+        stores the result once it is done. Returns whether state changed.
+        """
+        if state.get('item') is None or state.get('pending'):
+            # Wait until the item itself is live; its crossfade starts from it
+            return False
+        at = state['slot_end']
+        index = next_index(playlist['items'], state['index'], at)
+        if index is None:
+            return False
+        item = playlist['items'][index]
+        if (state.get('next') or {}).get('item') == item['id']:
+            return False
+
+        client_id = display.client_id
+        key = (playlist['version'], item['id'], at)
+        job = self._preparing.get(client_id)
+        if job is None or job[0] != key:
+            future = self.executor.submit(self._prepare, display, item, at)
+            future.add_done_callback(lambda _: self._wake.set())
+            self._preparing[client_id] = (key, future)
+            return False
+        if not job[1].done():
+            return False
+        del self._preparing[client_id]
+        try:
+            state['next'] = job[1].result()
+        except Exception as e:
+            print(f"Error preparing playlist item {item['id']}: {e}")
+            # Not retried in the background; the switch tries it once more
+            state['next'] = {'item': item['id'], 'error': str(e)}
+        return True
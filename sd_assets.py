@@ -0,0 +1,254 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+
+class SdAssetStore:
+    """
+    Content-addressed storage for SD card files.
+
+    Every file is stored once under blobs/<sha256>, however many names or
+    clients refer to it, so uploading the same bytes again costs nothing.
+    Each client has an index (filename -> hash, size, uploaded, synced) in
+    the shared store under its key prefix; listing reads only the index.
+    Blobs no index refers to any more are deleted; adding a file and
+    collecting blobs hold the same lock, so a blob that is being referenced
+    again is never collected in between. pinned, if given, returns hashes
+    that are in use elsewhere (by playlists) and must be kept regardless.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    INDEX_KEY = 'sd_index'
+
+    def __init__(self, folder, store, pinned=None):
+        self.folder = folder
+        self.blob_folder = os.path.join(folder, 'blobs')
+        os.makedirs(self.blob_folder, exist_ok=True)
+        self.store = store
+        self.pinned = pinned
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_folder, digest)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.blob_folder, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, stream, filename, prefixes=('',), synced=False):
+        """
+        Stores the bytes of a file-like object under filename in the index
+        of every client prefix, hashing them as they are written. Returns
+        (sha256, size); bytes that are already stored are dropped on arrival.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_folder, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            with self._locked():
+                if os.path.exists(self.blob_path(digest)):
+                    os.remove(temp_path)
+                else:
+                    os.replace(temp_path, self.blob_path(digest))
+                replaced = set()
+                for prefix in prefixes:
+                    replaced.update(self._set_entry(prefix, filename, digest, size, synced))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        for old_digest in replaced - {digest}:
+            self.collect(old_digest)
+        return digest, size
+
+    def _key(self, prefix):
+        return f'{prefix}{self.INDEX_KEY}'
+
+    def index(self, prefix=''):
+        """Returns a client's index: {filename: {'hash', 'size', 'uploaded', 'synced'}}."""
+        return self.store.read(self._key(prefix), {})
+
+    def _set_entry(self, prefix, filename, digest, size, synced=False):
+        """Adds or replaces a file in a client's index; returns the hashes it replaced."""
+        replaced = []
+
+        def apply(index):
+            index = dict(index)
+            old = index.get(filename)
+            if old and old['hash'] != digest:
+                replaced.append(old['hash'])
+            index[filename] = {'hash': digest, 'size': size, 'uploaded': time.time(), 'synced': synced}
+            return index
+
+        self.store.update(self._key(prefix), apply, {})
+        return replaced
+
+    def mark_synced(self, prefix, synced):
+        """
+        Records that files reached the client; synced maps filename to the
+        hash that was sent, so a file replaced in the meantime stays unsynced.
+        """
+        def apply(index):
+            index = dict(index)
+            for filename, digest in synced.items():
+                if filename in index and index[filename]['hash'] == digest:
+                    index[filename] = dict(index[filename], synced=True)
+            return index
+
+        if synced:
+            self.store.update(self._key(prefix), apply, {})
+
+    def remove(self, prefix, filename):
+        """Removes a file from a client's index; returns the removed entry or None."""
+        removed = []
+
+        def apply(index):
+            index = dict(index)
+            if filename in index:
+                removed.append(index.pop(filename))
+            return index
+
+        self.store.update(self._key(prefix), apply, {})
+        if not removed:
+            return None
+        self.collect(removed[0]['hash'])
+        return removed[0]
+
+    def collect(self, digest):
+        """Deletes a blob once no client's index (or pinned hash) refers to it."""
+        with self._locked():
+            if self.pinned and digest in self.pinned():
+                return False
+            for key, _ in self.store.keys():
+                if key.endswith(self.INDEX_KEY):
+                    if any(entry['hash'] == digest for entry in self.store.read(key, {}).values()):
+                        return False
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+            return True
+
+    def adopt_legacy_files(self, prefix=''):
+        """
+        Moves files stored flat in the folder by older versions (one copy
+        per name) into the blob store and a client's index.
+        """
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            # Claim the file first, so concurrent workers adopt it only once
+            claimed = os.path.join(self.blob_folder, f'.legacy-{entry.name}')
+            try:
+                os.replace(entry.path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, 'rb') as f:
+                self.add(f, entry.name, (prefix,), synced=True)
+            os.remove(claimed)
+
+
+class Transfer:
+    """
+    Progress of one chunked push of a file to one client.
+
+    sent is the offset the client has acknowledged; it survives an
+    interrupted push, so the next attempt resumes from there. Updates are
+    written to the shared store at most every SAVE_INTERVAL seconds.
+    """
+
+    SAVE_INTERVAL = 0.5
+
+    def __init__(self, tracker, record):
+        self.tracker = tracker
+        self.record = record
+        self._saved = 0.0
+
+    @property
+    def sent(self):
+        return self.record['sent']
+
+    def _save(self):
+        self._saved = time.time()
+        self.tracker.store.write(self.tracker.key(self.record['client_id'], self.record['sha256']), self.record)
+
+    def update(self, sent):
+        now = time.time()
+        record = self.record
+        record['sent'] = sent
+        record['updated'] = now
+        elapsed = now - record['started']
+        record['bytes_per_second'] = max(sent - record['resumed_from'], 0) / elapsed if elapsed > 0 else 0.0
+        if now - self._saved >= self.SAVE_INTERVAL:
+            self._save()
+
+    def finish(self, ok, error=None):
+        self.record['status'] = 'done' if ok else 'interrupted'
+        self.record['error'] = None if ok else (error or 'Push failed')
+        self.record['updated'] = time.time()
+        self._save()
+
+
+class TransferTracker:
+    """Server-side record of how far each client got with each SD file."""
+
+    # Finished transfer records older than this are removed
+    TRANSFER_TTL = 3600
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def key(client_id, digest):
+        return f'transfer_{client_id}_{digest}'
+
+    def begin(self, client_id, digest, filename, size):
+        """Starts (or resumes) a transfer; returns a Transfer to report progress on."""
+        previous = self.store.read(self.key(client_id, digest))
+        offset = previous['sent'] if previous and previous['status'] != 'done' and previous['size'] == size else 0
+        now = time.time()
+        transfer = Transfer(self, {
+            'client_id': client_id,
+            'sha256': digest,
+            'filename': filename,
+            'size': size,
+            'sent': offset,
+            'resumed_from': offset,
+            'status': 'running',
+            'error': None,
+            'bytes_per_second': 0.0,
+            'started': now,
+            'updated': now,
+        })
+        transfer._save()
+        return transfer
+
+    def all(self):
+        """All transfer records, newest first; prunes finished ones past TRANSFER_TTL."""
+        cutoff = time.time() - self.TRANSFER_TTL
+        records = []
+        for key, mtime in self.store.keys('transfer_'):
+            record = self.store.read(key)
+            if record is None:
+                continue
+            if record['status'] == 'done' and mtime < cutoff:
+                self.store.delete(key)
+                continue
+            records.append(record)
+        return sorted(records, key=lambda r: r['updated'], reverse=True)
@@ -0,0 +1,125 @@
+import os
+import struct
+import zlib
+
+import imageio
+import numpy as np
+
+import frame_ops
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+TRANSCODED_EXTENSION = '.lmv'
+
+# Pre-rendered frame file:
+#
+#     header | frame_count compressed frames | index
+#
+# The header is fixed-size so it can be filled in after streaming: magic,
+# width, height, pixel format (0 = RGB888, 1 = RGB565 LE), panel count,
+# panel width, fps, frame count, keyframe interval and the file offset of
+# the index. The index is frame_count + 1 uint64 LE file offsets.
+#
+# Each frame is zlib-compressed. Keyframes (every keyframe interval frames,
+# starting with the first) hold the raw frame; the others hold the XOR with
+# the previous frame, which is mostly zeros for the static areas of LED
+# content. Decoded frames are already in the chain's native layout (each
+# panel rotated), row-major, so the Pi only inflates and copies them.
+MAGIC = b'LMV1'
+HEADER = struct.Struct('<4sHHBBHfIHQ')
+PIXEL_FORMATS = {'rgb888': 0, 'rgb565': 1}
+COMPRESSION_LEVEL = 6
+
+# Frames are rotated and packed this many at a time
+BATCH_SIZE = 32
+
+
+def is_video(filename):
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def transcoded_name(filename):
+    return os.path.splitext(filename)[0] + TRANSCODED_EXTENSION
+
+
+def render_chain(frames, mode, panel_size, chain, positions):
+    """
+    Lays out a batch of frames on the panel chain: 'split' spans the whole
+    chain, 'both' repeats the frame on every panel, 'matrix_a'/'matrix_b'
+    show it on the first/second panel only. Panel 0 is rotated by
+    positions[0], every further panel by positions[1].
+    """
+    cols, rows = panel_size
+    panels = []
+    for i in range(chain):
+        if mode == 'split':
+            panel = frames[:, :, i * cols:(i + 1) * cols]
+        elif mode == 'both' or (mode == 'matrix_a' and i == 0) or (mode == 'matrix_b' and i == 1):
+            panel = frames
+        else:
+            panel = np.zeros((len(frames), rows, cols, 3), dtype=np.uint8)
+        panels.append(frame_ops.rotate_frames(panel, positions[min(i, 1)], panel_size))
+    return np.concatenate(panels, axis=2)
+
+
+def transcode_video(src_path, out_path, panel_size, chain=2, fps=30.0, positions=(0, 0), mode='both',
+                    pixel_format='rgb565'):
+    """
+    Transcodes a video into a pre-rendered frame file for a chain of panels
+    of panel_size (cols, rows), at most fps frames per second.
+
+    ffmpeg scales every frame while decoding, so full-size frames never
+    reach Python, and frames are streamed to out_path in batches. Returns
+    the number of frames written.
+    """
+    cols, rows = panel_size
+    source_size = (cols * chain, rows) if mode == 'split' else (cols, rows)
+    reader = imageio.get_reader(src_path, 'ffmpeg', size=source_size, output_params=['-sws_flags', 'lanczos'])
+    try:
+        source_fps = reader.get_meta_data().get('fps') or 30
+        output_fps = min(fps, source_fps) if fps and fps > 0 else source_fps
+        frame_time = 1.0 / output_fps
+        # One keyframe per second of output
+        keyframe_interval = max(1, round(output_fps))
+        header = [MAGIC, cols * chain, rows, PIXEL_FORMATS[pixel_format], chain, cols, output_fps]
+
+        offsets = []
+        previous = None
+        with open(out_path, 'wb') as out:
+            out.write(HEADER.pack(*header, 0, keyframe_interval, 0))
+
+            def write(batch):
+                nonlocal previous
+                frames = render_chain(np.stack(batch), mode, panel_size, chain, positions)
+                if pixel_format == 'rgb565':
+                    frames = frame_ops.to_rgb565(frames)
+                for frame in frames:
+                    data = frame if len(offsets) % keyframe_interval == 0 else frame ^ previous
+                    offsets.append(out.tell())
+                    out.write(zlib.compress(data.tobytes(), COMPRESSION_LEVEL))
+                    previous = frame
+
+            batch = []
+            next_output_time = 0.0
+            for index, frame in enumerate(reader):
+                # Skip source frames until the next output timestamp
+                if index / source_fps + 1e-9 < next_output_time:
+                    continue
+                next_output_time += frame_time
+                batch.append(frame)
+                if len(batch) == BATCH_SIZE:
+                    write(batch)
+                    batch = []
+            if batch:
+                write(batch)
+
+            index_offset = out.tell()
+            out.write(np.array(offsets + [index_offset], dtype='<u8').tobytes())
+            out.seek(0)
+            out.write(HEADER.pack(*header, len(offsets), keyframe_interval, index_offset))
+    finally:
+        reader.close()
+
+    count = len(offsets)
+    if not count:
+        raise Exception("No frames found in video")
+    return count
@@ -28,6 +28,7 @@ function undo() {
     if (historyStep > 0) {
         historyStep--;
         ctx.putImageData(historyStack[historyStep], 0, 0);
+        markDirty(0, 0, canvas.width, canvas.height);
     }
 }
 
@@ -35,9 +36,68 @@ function redo() {
     if (historyStep < historyStack.length - 1) {
         historyStep++;
         ctx.putImageData(historyStack[historyStep], 0, 0);
+        markDirty(0, 0, canvas.width, canvas.height);
     }
 }
 
+// Live drawing: changed pixels are sent to /api/draw/delta as they are drawn.
+// Changes are collected into one dirty rectangle and at most one request is
+// in flight; whatever is drawn meanwhile goes out with the next one.
+const liveToggle = document.getElementById('liveDraw');
+let dirtyRect = null;
+let liveInFlight = false;
+
+function markDirty(x0, y0, x1, y1) {
+    x0 = Math.max(0, x0); y0 = Math.max(0, y0);
+    x1 = Math.min(canvas.width, x1); y1 = Math.min(canvas.height, y1);
+    if (x0 >= x1 || y0 >= y1) return;
+    if (dirtyRect) {
+        dirtyRect = {
+            x0: Math.min(dirtyRect.x0, x0), y0: Math.min(dirtyRect.y0, y0),
+            x1: Math.max(dirtyRect.x1, x1), y1: Math.max(dirtyRect.y1, y1)
+        };
+    } else {
+        dirtyRect = { x0, y0, x1, y1 };
+    }
+    flushLive();
+}
+
+async function flushLive() {
+    if (!liveToggle || !liveToggle.checked || liveInFlight || !dirtyRect) return;
+    const { x0, y0, x1, y1 } = dirtyRect;
+    dirtyRect = null;
+    const w = x1 - x0, h = y1 - y0;
+    const rgba = ctx.getImageData(x0, y0, w, h).data;
+    // Drop the alpha channel: the server takes packed RGB
+    let binary = '';
+    for (let i = 0; i < rgba.length; i += 4) {
+        binary += String.fromCharCode(rgba[i], rgba[i + 1], rgba[i + 2]);
+    }
+
+    liveInFlight = true;
+    try {
+        const response = await fetch('/api/draw/delta', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ rects: [{ x: x0, y: y0, w, h, data: btoa(binary) }] })
+        });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    } catch (error) {
+        console.error('Error:', error);
+        // Resend the area with the next change
+        markDirty(x0, y0, x1, y1);
+    } finally {
+        liveInFlight = false;
+    }
+    flushLive();
+}
+
+if (liveToggle) {
+    liveToggle.addEventListener('change', () => {
+        if (liveToggle.checked) markDirty(0, 0, canvas.width, canvas.height);
+    });
+}
+
 // Initialize Canvas
 ctx.fillStyle = '#000000';
 ctx.fillRect(0, 0, canvas.width, canvas.height);
@@ -70,6 +130,7 @@ function clearCanvas() {
     ctx.fillStyle = '#000000';
     ctx.fillRect(0, 0, canvas.width, canvas.height);
     saveState();
+    markDirty(0, 0, canvas.width, canvas.height);
 }
 
 // Drawing Logic
@@ -95,6 +156,7 @@ function drawPixel(x, y, color, size) {
     ctx.fillStyle = color;
     const offset = Math.floor(size / 2);
     ctx.fillRect(x - offset, y - offset, size, size);
+    markDirty(x - offset, y - offset, x - offset + size, y - offset + size);
 }
 
 // Flood Fill Algorithm
@@ -149,6 +211,7 @@ function floodFill(startX, startY, fillColor) {
     
     ctx.putImageData(imageData, 0, 0);
     saveState();
+    markDirty(0, 0, canvas.width, canvas.height);
 }
 
 canvas.addEventListener('mousedown', (e) => {
@@ -308,10 +371,16 @@ async function uploadFiles() {
             body: formData
         });
         const result = await response.json();
-        statusDiv.textContent = '';
         if (response.ok) {
-            showToast(result.message || 'Upload successful!', 'success');
+            const job = await waitForJob(result.job_id, statusDiv);
+            statusDiv.textContent = '';
+            if (job.status === 'done') {
+                showToast(job.result.message || 'Upload successful!', 'success');
+            } else {
+                showToast(job.error || 'Upload failed.', 'error');
+            }
         } else {
+            statusDiv.textContent = '';
             showToast(result.error || 'Upload failed.', 'error');
         }
     } catch (error) {
@@ -321,6 +390,21 @@ async function uploadFiles() {
     }
 }
 
+// Polls a background job until it finishes, showing its stage in statusDiv
+async function waitForJob(jobId, statusDiv) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) return { status: 'error', error: job.error };
+        if (job.status === 'done' || job.status === 'error') return job;
+        if (statusDiv) {
+            const stage = job.stage ? ` (${job.stage})` : '';
+            statusDiv.textContent = `Processing${stage}... ${Math.round(job.progress * 100)}%`;
+        }
+        await new Promise(resolve => setTimeout(resolve, 500));
+    }
+}
+
 async function clearMatrix() {
     try {
         const response = await fetch('/api/clear', { method: 'POST' });
@@ -468,6 +552,9 @@ function loadSDFiles() {
             if (data.source === 'client') {
                 sourceInfo.innerHTML = 'Source: <strong>Raspberry Pi</strong>';
                 sourceInfo.style.color = '#4CAF50';
+            } else if (data.source === 'index') {
+                sourceInfo.innerHTML = 'Source: <strong>Server index</strong>';
+                sourceInfo.style.color = '#4CAF50';
             } else {
                 sourceInfo.innerHTML = 'Source: <strong>Server (Fallback)</strong> - Pi unreachable';
                 sourceInfo.style.color = '#ff9800';
@@ -481,12 +568,16 @@ function loadSDFiles() {
                 return;
             }
             
+            const synced = {};
+            (data.entries || []).forEach(entry => { synced[entry.filename] = entry.synced; });
+
             data.files.forEach(filename => {
                 const card = document.createElement('div');
                 card.className = 'user-card'; // Reuse user-card style
+                const pending = synced[filename] === false ? ' <small>(not on Pi yet)</small>' : '';
                 card.innerHTML = `
                     <div class="user-info">
-                        <span class="user-name">${filename}</span>
+                        <span class="user-name">${filename}</span>${pending}
                     </div>
                     <div class="user-actions">
                         <button onclick="deleteSDFile('${filename}')" class="tool-btn danger">Delete</button>
@@ -518,6 +609,7 @@ async function uploadSDFile() {
     formData.append('mode', mode);
     formData.append('position_1', pos1);
     formData.append('position_2', pos2);
+    formData.append('transcode', document.getElementById('sd-transcode').checked);
     
     const statusDiv = document.getElementById('sdUploadStatus');
     statusDiv.textContent = 'Uploading...';
@@ -533,6 +625,13 @@ async function uploadSDFile() {
             showToast(result.message, 'success');
             fileInput.value = ''; // Clear input
             loadSDFiles(); // Refresh list
+            if (result.job_id) {
+                // Transcoding and the push run in the background
+                const job = await waitForJob(result.job_id, statusDiv);
+                statusDiv.textContent = '';
+                if (job.status === 'error') showToast(job.error || 'Push failed', 'error');
+                loadSDFiles();
+            }
         } else {
             showToast(result.error || 'Upload failed', 'error');
         }
@@ -653,6 +752,8 @@ function updateConfigForm(settings) {
     document.getElementById('conf-slide-duration').value = settings.sd_slide_duration || 30.0;
     document.getElementById('conf-video-fps').value = settings.sd_video_fps || 30.0;
     document.getElementById('conf-playlist-refresh').value = settings.sd_playlist_refresh_rate || 10.0;
+    document.getElementById('conf-live-max-frames').value = settings.live_max_frames || 150;
+    document.getElementById('conf-live-video-fps').value = settings.live_video_fps || 30.0;
 
     document.getElementById('conf-pos1').value = settings.position_1;
     document.getElementById('val-pos1').textContent = settings.position_1; // Update display
@@ -689,6 +790,8 @@ function saveSettings() {
         sd_slide_duration: parseFloat(document.getElementById('conf-slide-duration').value),
         sd_video_fps: parseFloat(document.getElementById('conf-video-fps').value),
         sd_playlist_refresh_rate: parseFloat(document.getElementById('conf-playlist-refresh').value),
+        live_max_frames: parseInt(document.getElementById('conf-live-max-frames').value),
+        live_video_fps: parseFloat(document.getElementById('conf-live-video-fps').value),
 
         position_1: parseInt(document.getElementById('conf-pos1').value),
         position_2: parseInt(document.getElementById('conf-pos2').value),
@@ -0,0 +1,53 @@
+"""
+Draw deltas are parsed from request JSON, so anything that isn't a delta
+must raise ValueError (which /api/draw/delta answers with a 400).
+
+    python -m pytest tests
+"""
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_store import SharedStore  # noqa: E402
+from draw_canvas import DrawCanvas  # noqa: E402
+
+
+@pytest.fixture
+def canvas(tmp_path):
+    return DrawCanvas(SharedStore(str(tmp_path)), 'draw_canvas')
+
+
+@pytest.mark.parametrize('delta', [
+    [],
+    [{'x': 0, 'y': 0, 'length': 1, 'color': [1, 2, 3]}],
+    'runs',
+    3,
+    None,
+    {'rects': {'x': 0}},
+    {'rects': 'abc'},
+    {'rects': [1, 2]},
+    {'runs': [[0, 0, 1, [1, 2, 3]]]},
+    {'runs': [{'x': 0, 'y': 0}]},
+    {'rects': [{'x': 0, 'y': 0, 'w': 1, 'h': 1, 'data': 'not base64!'}]},
+    {},
+])
+def test_malformed_deltas_raise_value_error(canvas, delta):
+    with pytest.raises(ValueError):
+        canvas.apply(delta)
+
+
+def test_delta_is_applied_and_clipped(canvas):
+    seq, clipped = canvas.apply({
+        'rects': [{'x': -1, 'y': 0, 'w': 2, 'h': 1, 'data': base64.b64encode(bytes(range(6))).decode()}],
+        'runs': [{'x': DrawCanvas.WIDTH - 2, 'y': 5, 'length': 10, 'color': [9, 8, 7]}],
+    })
+    assert seq == 1
+    assert clipped['rects'] == [{'x': 0, 'y': 0, 'w': 1, 'h': 1, 'data': base64.b64encode(bytes([3, 4, 5])).decode()}]
+    assert clipped['runs'] == [{'x': DrawCanvas.WIDTH - 2, 'y': 5, 'length': 2, 'color': [9, 8, 7]}]
+    _, pixels = canvas.get()
+    assert pixels[0, 0].tolist() == [3, 4, 5]
+    assert pixels[5, -1].tolist() == [9, 8, 7]
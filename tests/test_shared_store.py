@@ -0,0 +1,107 @@
+"""
+Matrix content is shared by every gunicorn worker through the shared store,
+so a frame uploaded to one worker is served identically by all of them.
+
+Starts gunicorn with three workers on a temporary instance folder, uploads
+one image and polls /api/matrix/a over fresh connections, which gunicorn
+spreads over the workers.
+
+    python -m pytest tests
+"""
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = 3
+POLLS = 60
+
+SETUP_SCRIPT = """
+import main
+with main.app.app_context():
+    main.db.create_all()
+    main.db.session.add(main.User(username='test', is_admin=True, is_approved=True,
+                                  password=main.bcrypt.generate_password_hash('test').decode()))
+    main.db.session.commit()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return requests.get(url, timeout=5)
+        except requests.RequestException:
+            if time.time() > deadline:
+                raise RuntimeError(f"Nothing is answering at {url}")
+            time.sleep(0.1)
+
+
+@pytest.fixture
+def server(tmp_path):
+    env = dict(os.environ, LEMONA_INSTANCE_PATH=str(tmp_path / 'instance'),
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    subprocess.run([sys.executable, '-c', SETUP_SCRIPT], cwd=tmp_path, env=env, check=True)
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(WORKERS), '--threads', '2',
+         '--bind', f'127.0.0.1:{port}', '--pythonpath', REPO_DIR, '--log-level', 'warning', 'main:app'],
+        cwd=tmp_path, env=env)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        wait_for(f'{base}/api/time')
+        yield base
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def test_workers_serve_the_same_frame(server):
+    session = requests.Session()
+    session.post(f'{server}/login', data={'username': 'test', 'password': 'test'})
+    image = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 30, 90)).save(image, 'PNG')
+    response = session.post(f'{server}/api/upload', data={'mode': 'both'},
+                            files={'file_a': ('red.png', image.getvalue(), 'image/png')})
+    assert response.status_code == 202, response.text
+
+    job_id = response.json()['job_id']
+    deadline = time.time() + 30
+    while True:
+        job = session.get(f'{server}/api/jobs/{job_id}').json()
+        if job['status'] in ('done', 'error') or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'done', job
+
+    etags, versions, bodies = set(), set(), set()
+    for _ in range(POLLS):
+        # A new connection per poll, so the polls land on different workers
+        response = requests.get(f'{server}/api/matrix/a', headers={'Connection': 'close'}, timeout=10)
+        assert response.status_code == 200
+        etags.add(response.headers['ETag'])
+        versions.add(response.headers['X-Content-Version'])
+        bodies.add(response.content)
+    assert len(etags) == 1, etags
+    assert len(versions) == 1, versions
+    assert len(bodies) == 1
+
+    body, = bodies
+    assert Image.open(io.BytesIO(body)).getpixel((10, 10)) == (200, 30, 90)
+    # The version is the content's digest, which the ETag carries with the frame index
+    version, = versions
+    assert etags.pop().strip('"').startswith(f'{version}-')
@@ -9,9 +9,53 @@ def add_telemetry_columns():
         ('last_ssid', 'TEXT', '""'),
         ('last_network_type', 'TEXT', '""'),
         ('last_refresh_rate', 'REAL', '0.0'),
-        ('last_seen', 'REAL', '0.0')
+        ('last_seen', 'REAL', '0.0'),
+        ('live_max_frames', 'INTEGER', '150'),
+        ('live_video_fps', 'REAL', '30.0'),
+        ('client_id', 'VARCHAR(64)', "'default'")
     ]
     
+    # Telemetry history tables
+    c.execute("""CREATE TABLE IF NOT EXISTS telemetry_sample (
+        id INTEGER PRIMARY KEY,
+        timestamp FLOAT NOT NULL,
+        ip VARCHAR(20),
+        ssid VARCHAR(100),
+        network_type VARCHAR(20),
+        refresh_rate FLOAT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_sample_timestamp ON telemetry_sample (timestamp)")
+    try:
+        c.execute("SELECT client_id FROM telemetry_sample LIMIT 1")
+    except sqlite3.OperationalError:
+        c.execute("ALTER TABLE telemetry_sample ADD COLUMN client_id VARCHAR(64) DEFAULT 'default'")
+        print("Added column telemetry_sample.client_id")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_telemetry_sample_client_id ON telemetry_sample (client_id)")
+
+    # Rollups are keyed by (client_id, minute); the primary key can't be
+    # altered in place, so an old single-client table is rebuilt
+    try:
+        c.execute("SELECT client_id FROM telemetry_rollup LIMIT 1")
+    except sqlite3.OperationalError:
+        c.execute("ALTER TABLE telemetry_rollup RENAME TO telemetry_rollup_old")
+        print("Rebuilding telemetry_rollup with client_id")
+    c.execute("""CREATE TABLE IF NOT EXISTS telemetry_rollup (
+        client_id VARCHAR(64) NOT NULL,
+        minute INTEGER NOT NULL,
+        count INTEGER,
+        refresh_count INTEGER,
+        refresh_sum FLOAT,
+        refresh_min FLOAT,
+        refresh_max FLOAT,
+        PRIMARY KEY (client_id, minute)
+    )""")
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='telemetry_rollup_old'")
+    if c.fetchone():
+        c.execute("""INSERT INTO telemetry_rollup
+            SELECT 'default', minute, count, refresh_count, refresh_sum, refresh_min, refresh_max
+            FROM telemetry_rollup_old""")
+        c.execute("DROP TABLE telemetry_rollup_old")
+    
     for col_name, col_type, default_val in columns:
         try:
             # Check if column exists first to avoid error spam
@@ -25,6 +69,10 @@ def add_telemetry_columns():
                 print(f"Error adding {col_name}: {e}")
         else:
             print(f"Column {col_name} already exists")
+
+    # One settings row per client
+    c.execute("UPDATE client_settings SET client_id = 'default' WHERE client_id IS NULL")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_client_settings_client_id ON client_settings (client_id)")
             
     conn.commit()
     conn.close()
@@ -0,0 +1,67 @@
+import io
+import os
+import tempfile
+
+
+class UploadBuffer:
+    """
+    An uploaded file, held in memory up to max_size bytes and spilled to a
+    temp file beyond that (like SpooledTemporaryFile, but readable by
+    several consumers at once).
+
+    The decoder and every push to a client read the same bytes: open()
+    returns an independent reader each time, a BytesIO over the in-memory
+    data (no copy) or a new handle on the spill file. source() is what
+    the decoder takes, the spill file's path when there is one.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, stream, filename, max_size=8 * 1024 * 1024):
+        self.filename = filename
+        self.path = None
+        self.size = 0
+        memory = io.BytesIO()
+        spill = None
+        try:
+            while True:
+                chunk = stream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                if spill is None and self.size > max_size:
+                    fd, self.path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+                    spill = os.fdopen(fd, 'wb')
+                    spill.write(memory.getbuffer())
+                    memory = None
+                (spill or memory).write(chunk)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if spill is not None:
+                spill.close()
+        self.data = memory.getvalue() if memory is not None else None
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def open(self):
+        """Returns a new binary reader positioned at the start."""
+        if self.path is None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def source(self):
+        """A path or a reader, for decoders that prefer a path."""
+        return self.path or self.open()
+
+    def close(self):
+        """Deletes the spill file, if any."""
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.path = None